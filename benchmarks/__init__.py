@@ -0,0 +1 @@
+# Замеры производительности менеджеров: python -m benchmarks run --size 1k
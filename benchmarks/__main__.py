@@ -0,0 +1,57 @@
+import sys
+import json
+import argparse
+
+from benchmarks.compare import (DEFAULT_MIN_SECONDS, DEFAULT_THRESHOLD, compare_results, load_results,
+                                print_comparison)
+from benchmarks.generator import parse_size
+from benchmarks.suite import run_suite
+
+
+def print_result(name, result):
+    print(f'{name:<28} {result["seconds"] * 1000:>12.2f} мс  ({result["per_op"] * 1e6:.1f} мкс/оп)', flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Замеры производительности менеджеров')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('run', help='выполнить замеры и сохранить результат в JSON')
+    command.add_argument('--size', default='1k', help='размер набора: 1k, 10k, 100k, 1m или число записей')
+    command.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    command.add_argument('--repeat', type=int, default=3)
+    command.add_argument('--seed', type=int, default=1)
+    command.add_argument('--data-dir', help='каталог для сгенерированных наборов (по умолчанию во временном)')
+    command.add_argument('--cases', nargs='*', help='шаблоны имён замеров, например notes.* finance.report*')
+    command.add_argument('--output', help='файл для результатов в JSON')
+
+    command = commands.add_parser('compare', help='сравнить два файла результатов')
+    command.add_argument('base')
+    command.add_argument('head')
+    command.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                         help='допустимое замедление, доля (0.1 — 10%%)')
+    command.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS,
+                         help='более короткие замеры не считаются регрессией')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = run_suite(parse_size(args.size), args.backend, args.repeat, args.seed, args.data_dir,
+                            args.cases, print_result)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            print(f'Результаты сохранены в {args.output}')
+        return 0
+
+    base, head = load_results(args.base), load_results(args.head)
+    rows = compare_results(base, head, args.threshold, args.min_seconds)
+    print_comparison(base, head, rows)
+    regressions = [row for row in rows if row[4] == 'РЕГРЕССИЯ']
+    if regressions:
+        print(f'Регрессий: {len(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import json
+
+DEFAULT_THRESHOLD = 0.10
+DEFAULT_MIN_SECONDS = 0.001
+
+
+def load_results(file_name):
+    with open(file_name, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_results(base, head, threshold=DEFAULT_THRESHOLD, min_seconds=DEFAULT_MIN_SECONDS):
+    # Сравнивается медиана; замеры короче min_seconds слишком шумные, чтобы считать их регрессией
+    rows = []
+    for name in sorted(set(base['results']) & set(head['results'])):
+        before = base['results'][name]
+        after = head['results'][name]
+        change = after['seconds'] / before['seconds'] - 1 if before['seconds'] else 0.0
+        status = ''
+        if max(before['seconds'], after['seconds']) >= min_seconds:
+            if change > threshold:
+                status = 'РЕГРЕССИЯ'
+            elif change < -threshold:
+                status = 'ускорение'
+        rows.append((name, before['seconds'], after['seconds'], change, status))
+    return rows
+
+
+def format_seconds(value):
+    if value < 1:
+        return f'{value * 1000:.2f} мс'
+    return f'{value:.2f} с'
+
+
+def print_comparison(base, head, rows):
+    for key in ('backend', 'size'):
+        if base['meta'].get(key) != head['meta'].get(key):
+            print(f'Внимание: различается {key}: {base["meta"].get(key)} и {head["meta"].get(key)}')
+    print(f'База: {base["meta"].get("commit")}, сравнение: {head["meta"].get("commit")}')
+    unmatched = set(base['results']) ^ set(head['results'])
+    if unmatched:
+        print(f'Замеры только в одном из файлов пропущены: {", ".join(sorted(unmatched))}')
+    width = max([len(row[0]) for row in rows] + [10])
+    print(f'{"Замер":<{width}}  {"база":>12}  {"сравнение":>12}  {"разница":>8}')
+    for name, before, after, change, status in rows:
+        print(f'{name:<{width}}  {format_seconds(before):>12}  {format_seconds(after):>12}  '
+              f'{change * 100:>+7.1f}%  {status}')
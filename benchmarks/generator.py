@@ -0,0 +1,167 @@
+import os
+import csv
+import json
+import random
+import datetime
+import itertools
+
+SIZES = {'1k': 1000, '10k': 10000, '100k': 100000, '1m': 1000000}
+BASE_DATE = datetime.date(2025, 1, 1)
+DATE_SPAN = 730
+
+WORDS = '''
+встреча проект отчёт задача клиент договор звонок письмо бюджет план неделя месяц срок команда
+презентация документ счёт оплата поставка заказ склад сервер релиз ошибка исправление тест код
+обзор анализ данные таблица график продажи маркетинг реклама сайт приложение пользователь доступ
+пароль настройка резервная копия обновление версия модуль интеграция платёж банк карта перевод
+аренда квартира ремонт машина страховка врач запись анализы лекарства спорт зал тренировка бег
+продукты магазин рынок подарок день рождения праздник отпуск билеты гостиница поезд самолёт виза
+книга статья курс лекция экзамен домашнее задание учитель школа университет конференция доклад
+идея заметка список покупок рецепт ужин обед завтрак кофе чай молоко хлеб сыр овощи фрукты мясо
+собака кошка ветеринар корм прогулка парк дача сад огород семена полив урожай погода дождь снег
+важно срочно позже обязательно проверить обсудить согласовать отправить подготовить купить
+позвонить написать встретиться оплатить забрать отвезти починить записаться узнать напомнить
+москва петербург казань новосибирск екатеринбург нижний новгород самара омск ростов уфа красноярск
+python postgres docker api backend frontend deploy review sprint backlog jira github
+'''.split()
+
+FIRST_NAMES = ('Александр Алексей Анна Андрей Анастасия Борис Валентина Василий Вера Виктор Галина Дмитрий '
+               'Евгений Екатерина Елена Иван Игорь Ирина Кирилл Ксения Лариса Максим Мария Михаил Наталья '
+               'Никита Николай Ольга Павел Пётр Роман Светлана Сергей Татьяна Юлия Юрий Яна').split()
+LAST_NAMES = ('Иванов Смирнов Кузнецов Попов Васильев Петров Соколов Михайлов Новиков Фёдоров Морозов '
+              'Волков Алексеев Лебедев Семёнов Егоров Павлов Козлов Степанов Николаев Орлов Андреев Макаров '
+              'Никитин Захаров Зайцев Соловьёв Борисов Яковлев Григорьев Романов Воробьёв').split()
+DOMAINS = ('mail.ru', 'yandex.ru', 'gmail.com', 'rambler.ru', 'company.ru')
+PRIORITIES = ('Высокий', 'Средний', 'Низкий')
+EXPENSE_CATEGORIES = ('еда', 'транспорт', 'жильё', 'связь', 'здоровье', 'одежда', 'развлечения',
+                      'образование', 'подарки', 'путешествия', 'техника', 'коммунальные услуги')
+INCOME_CATEGORIES = ('зарплата', 'премия', 'фриланс', 'проценты', 'возврат')
+
+TRANSLIT = dict(zip('абвгдеёжзийклмнопрстуфхцчшщъыьэюя',
+                    ['a', 'b', 'v', 'g', 'd', 'e', 'e', 'zh', 'z', 'i', 'y', 'k', 'l', 'm', 'n', 'o', 'p', 'r',
+                     's', 't', 'u', 'f', 'kh', 'ts', 'ch', 'sh', 'sch', '', 'y', '', 'e', 'yu', 'ya']))
+
+NOTES_CSV_HEADER = ['ID', 'Заголовок', 'Содержимое', 'Дата']
+TASKS_CSV_HEADER = ['ID', 'Title', 'Description', 'Status', 'Priority', 'Due Date']
+CONTACTS_CSV_HEADER = ['ID', 'Имя', 'Телефон', 'E-mail']
+FINANCE_CSV_HEADER = ['ID', 'Сумма', 'Категория', 'Дата', 'Описание']
+
+
+def parse_size(value):
+    value = str(value).lower()
+    if value in SIZES:
+        return SIZES[value]
+    return int(value)
+
+def translit(text):
+    return ''.join(TRANSLIT.get(char, char) for char in text.lower())
+
+
+class Generator:
+    # Каждый вид записей получает собственный генератор, поэтому данные одного вида
+    # не зависят от того, сколько записей других видов было создано
+    def __init__(self, seed=1):
+        self.seed = seed
+        # Частоты слов убывают как 1/ранг — так индекс и BM25 работают на правдоподобном распределении
+        self.cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(WORDS) + 1)))
+
+    def rng(self, kind):
+        return random.Random(f'{self.seed}-{kind}')
+
+    def words(self, rng, count):
+        return ' '.join(rng.choices(WORDS, cum_weights=self.cum_weights, k=count))
+
+    def date(self, rng):
+        return (BASE_DATE + datetime.timedelta(days=rng.randrange(DATE_SPAN))).strftime('%d-%m-%Y')
+
+    def phone(self, rng):
+        digits = f'9{rng.randrange(10, 100)}{rng.randrange(1000000, 10000000)}'
+        style = rng.randrange(3)
+        if style == 0:
+            return f'+7 {digits[:3]} {digits[3:6]}-{digits[6:8]}-{digits[8:]}'
+        if style == 1:
+            return f'8 ({digits[:3]}) {digits[3:6]}-{digits[6:]}'
+        return f'+7{digits}'
+
+    def notes(self, count):
+        rng = self.rng('notes')
+        for note_id in range(1, count + 1):
+            yield {'id': note_id, 'title': self.words(rng, rng.randint(2, 6)).capitalize(),
+                   'content': self.words(rng, rng.randint(10, 60)),
+                   'timestamp': f'{self.date(rng)} {rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}',
+                   'version': 0}
+
+    def tasks(self, count):
+        rng = self.rng('tasks')
+        for task_id in range(1, count + 1):
+            yield {'id': task_id, 'title': self.words(rng, rng.randint(2, 5)).capitalize(),
+                   'description': self.words(rng, rng.randint(0, 20)), 'done': rng.random() < 0.4,
+                   'priority': rng.choice(PRIORITIES), 'due_date': self.date(rng), 'version': 0}
+
+    def contacts(self, count):
+        rng = self.rng('contacts')
+        for contact_id in range(1, count + 1):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            if first.endswith(('а', 'я')) and not last.endswith('а'):
+                last += 'а'
+            email = f'{translit(first)}.{translit(last)}{contact_id}@{rng.choice(DOMAINS)}'
+            yield {'id': contact_id, 'name': f'{first} {last}', 'phone': self.phone(rng), 'email': email,
+                   'version': 0}
+
+    def finance(self, count):
+        rng = self.rng('finance')
+        for record_id in range(1, count + 1):
+            if rng.random() < 0.15:
+                amount = round(rng.lognormvariate(10, 0.6), 2)
+                category = rng.choice(INCOME_CATEGORIES)
+            else:
+                amount = -round(rng.lognormvariate(6, 1.2), 2)
+                category = rng.choice(EXPENSE_CATEGORIES)
+            yield {'id': record_id, 'amount': amount, 'category': category, 'date': self.date(rng),
+                   'description': self.words(rng, rng.randint(1, 6)), 'version': 0}
+
+
+def csv_rows(kind, records):
+    for record in records:
+        if kind == 'notes':
+            yield [record['id'], record['title'], record['content'], record['timestamp']]
+        elif kind == 'tasks':
+            yield [record['id'], record['title'], record['description'],
+                   'Выполнена' if record['done'] else 'Не выполнена', record['priority'], record['due_date']]
+        elif kind == 'contacts':
+            yield [record['id'], record['name'], record['phone'], record['email']]
+        else:
+            yield [record['id'], record['amount'], record['category'], record['date'], record['description']]
+
+
+CSV_HEADERS = {'notes': NOTES_CSV_HEADER, 'tasks': TASKS_CSV_HEADER,
+               'contacts': CONTACTS_CSV_HEADER, 'finance': FINANCE_CSV_HEADER}
+KINDS = ('notes', 'tasks', 'contacts', 'finance')
+# Меняется вместе с форматом снимка, чтобы не переиспользовать наборы старого формата
+DATASET_FORMAT = 2
+
+
+def write_dataset(directory, count, seed=1):
+    # Для каждого вида: снимок хранилища <kind>.json и тот же набор в CSV для импорта.
+    # Готовый набор переиспользуется: генерация миллиона записей дороже самих замеров
+    os.makedirs(directory, exist_ok=True)
+    marker = os.path.join(directory, 'dataset.json')
+    description = {'count': count, 'seed': seed, 'format': DATASET_FORMAT}
+    if os.path.exists(marker):
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == description:
+                return directory
+    generator = Generator(seed)
+    for kind in KINDS:
+        records = list(getattr(generator, kind)(count))
+        snapshot = {'fields': list(records[0]) if records else [],
+                    'rows': [list(record.values()) for record in records]}
+        with open(os.path.join(directory, f'{kind}.json'), 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        with open(os.path.join(directory, f'{kind}.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADERS[kind])
+            writer.writerows(csv_rows(kind, records))
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(description, f)
+    return directory
@@ -0,0 +1,316 @@
+import gc
+import os
+import io
+import sys
+import time
+import random
+import shutil
+import fnmatch
+import platform
+import tempfile
+import datetime
+import contextlib
+import statistics
+import subprocess
+
+import personal_assistant as pa
+
+from benchmarks.generator import KINDS, write_dataset
+
+MANAGERS = {'notes': pa.NoteManager, 'tasks': pa.TaskManager,
+            'contacts': pa.ContactManager, 'finance': pa.FinanceManager}
+STORE_FILES = {'notes': pa.NOTES_FILE, 'tasks': pa.TASKS_FILE,
+               'contacts': pa.CONTACTS_FILE, 'finance': pa.FINANCE_FILE}
+MUTATION_OPS = 200
+PAGE_OPS = 50
+CLI_SEARCH_OPS = 3
+# Путь к скрипту запоминается до того, как замеры начнут менять текущий каталог
+SCRIPT_PATH = os.path.abspath(pa.__file__)
+IMPORT_PARTS = 12
+SEARCH_QUERIES = {
+    'notes': ['встреча', 'отчёт проект', 'срочно позвонить', '"список покупок"', 'серв*', 'python docker',
+              'москва', 'оплатить счёт', 'тренировка', 'ремонт квартира'],
+    'contacts.name': ['Иван', 'Петров', 'Анна Смирнова', 'ольга', 'ёв', 'mail.ru', 'Никол'],
+    'contacts.phone': ['+7 912', '8 (915)', '916 1', '+79', '9261234567', '903'],
+}
+# Отдельные изменения: поле, которое меняется при редактировании, и новая запись для add_*
+EDIT_FIELDS = {'notes': 'content', 'tasks': 'description', 'contacts': 'email', 'finance': 'description'}
+ADD_ITEM = {
+    'notes': lambda manager, number: manager.add_note(f'Новая заметка {number}', 'текст новой заметки'),
+    'tasks': lambda manager, number: manager.add_task(f'Новая задача {number}', 'описание', 'Средний', '01-06-2026'),
+    'contacts': lambda manager, number: manager.add_contact(f'Контакт {number}', f'+7 900 000-{number:04d}',
+                                                            f'new{number}@mail.ru'),
+    'finance': lambda manager, number: manager.add_record(-150.0, 'еда', '15-03-2026', 'обед'),
+}
+FINANCE_EXPRESSIONS = ['amount * 1.2 where category == "еда"', 'amount where year == 2025 and month == 3',
+                       'abs(amount) where date >= day("01-06-2026")', 'amount if amount > 0 else 0']
+IMPORT_METHODS = {'notes': 'import_notes_from_csv', 'tasks': 'import_tasks_from_csv',
+                  'contacts': 'import_contacts_from_csv', 'finance': 'import_records_from_csv'}
+
+
+def close_databases():
+    # Соединения SQLite кэшируются по имени файла, а каждый замер идёт в новом каталоге
+    for database in pa.SqliteDatabase.opened.values():
+        database.conn.close()
+    pa.SqliteDatabase.opened.clear()
+
+
+class Case:
+    def __init__(self, name, run, setup=None, files=(), ops=1):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.files = files
+        self.ops = ops
+
+
+class Workspace:
+    # Каждый повтор замера идёт в чистом временном каталоге с копией нужных файлов набора
+    def __init__(self, dataset, backend, files):
+        self.dataset = dataset
+        self.backend = backend
+        self.files = files
+        self.directory = None
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = os.getcwd()
+        self.directory = tempfile.mkdtemp(prefix='pa-bench-')
+        for name, target in self.files:
+            shutil.copyfile(os.path.join(self.dataset, name), os.path.join(self.directory, target))
+        os.chdir(self.directory)
+        pa.STORAGE_BACKEND = self.backend
+        close_databases()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Отложенные записи (PA_WRITE_BEHIND) идут по относительным путям: сбросить до смены каталога
+        if pa.WRITE_BEHIND is not None:
+            pa.WRITE_BEHIND.flush_all()
+        close_databases()
+        os.chdir(self.previous)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def snapshot(kind):
+    return [(f'{kind}.json', STORE_FILES[kind])]
+
+def csv_file(kind):
+    return [(f'{kind}.csv', f'{kind}.csv')]
+
+
+def open_store(kind):
+    # Снимок однократно переносится в рабочий формат хранилища (двоичный снимок, таблица SQLite),
+    # после чего сохранённые индексы и агрегаты удаляются: загрузка идёт без них
+    def setup(state):
+        MANAGERS[kind]()
+        close_databases()
+        for name in os.listdir('.'):
+            if name.endswith((pa.INDEX_SUFFIX, pa.TOTALS_SUFFIX, pa.ROLLUPS_SUFFIX)):
+                os.remove(name)
+    return setup
+
+def warm_store(kind):
+    # Второе открытие: индексы и агрегаты уже сохранены рядом со снимком
+    def setup(state):
+        MANAGERS[kind]().items
+        close_databases()
+    return setup
+
+def opened_manager(kind):
+    def setup(state):
+        state['manager'] = MANAGERS[kind]()
+        state['manager'].items
+    return setup
+
+def sample_keys(count, ops, seed):
+    return random.Random(seed).sample(range(1, count + 1), min(ops, count))
+
+
+def load_items(kind):
+    def run(state):
+        MANAGERS[kind]().items
+    return run
+
+def add_items(kind, ops):
+    def run(state):
+        for number in range(ops):
+            ADD_ITEM[kind](state['manager'], number)
+    return run
+
+def edit_items(kind, count, ops):
+    def run(state):
+        manager = state['manager']
+        for key in sample_keys(count, ops, 1):
+            manager.change_item(manager.get_item(key), **{EDIT_FIELDS[kind]: f'изменено {key}'})
+    return run
+
+def delete_items(count, ops):
+    def run(state):
+        manager = state['manager']
+        for key in sample_keys(count, ops, 2):
+            manager.remove_item(manager.get_item(key))
+    return run
+
+def import_items(kind):
+    def run(state):
+        getattr(MANAGERS[kind](), IMPORT_METHODS[kind])(f'{kind}.csv', progress=None)
+    return run
+
+def split_csv(kind, parts):
+    # Набор делится на файлы-«выписки» в каталоге statements: разбор идёт параллельно по файлам
+    def setup(state):
+        with open(f'{kind}.csv', encoding='utf-8', newline='') as f:
+            header, *lines = f.readlines()
+        os.mkdir('statements')
+        size = -(-len(lines) // parts)
+        for part in range(parts):
+            with open(os.path.join('statements', f'{part:02d}.csv'), 'w', encoding='utf-8', newline='') as f:
+                f.writelines([header] + lines[part * size:(part + 1) * size])
+    return setup
+
+def import_files(kind):
+    def run(state):
+        getattr(MANAGERS[kind](), IMPORT_METHODS[kind])('statements')
+    return run
+
+def export_items(fmt):
+    def run(state):
+        state['manager'].export_items(f'export.{fmt}', fmt=fmt)
+    return run
+
+def read_pages(count, ops):
+    # Страницы по курсорам из случайных мест: время не должно зависеть от размера набора
+    def run(state):
+        manager = state['manager']
+        for key in sample_keys(count, ops, 3):
+            page = manager.page_items([key, key])
+            manager.page_items(page.before or [key, key], backward=True)
+    return run
+
+def search_notes(state):
+    for query in SEARCH_QUERIES['notes']:
+        state['manager'].find_notes(query, 10)
+
+def indexed_notes(state):
+    # Снимок перенесён и поисковый индекс сохранён рядом с ним — как после прошлого запуска
+    pa.NoteManager().search_index()
+    close_databases()
+
+def search_notes_cli(queries):
+    # Холодный поиск: каждый запрос — новый процесс, который открывает снимок и индекс с диска
+    def run(state):
+        env = dict(os.environ, PA_STORAGE=pa.STORAGE_BACKEND)
+        for query in queries:
+            subprocess.run([sys.executable, SCRIPT_PATH, 'notes', 'search', query],
+                           env=env, check=True, stdout=subprocess.DEVNULL)
+    return run
+
+def search_contacts(queries):
+    def run(state):
+        for query in queries:
+            state['manager'].find_contacts(query)
+    return run
+
+def report_totals(state):
+    manager = state['manager']
+    for month in range(1, 13):
+        manager.range_totals(datetime.date(2025, month, 1), datetime.date(2026, month, 28))
+
+def category_report(state):
+    manager = state['manager']
+    for period in ('month', 'week', 'year'):
+        manager.category_report(period, datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))
+
+def evaluate_expressions(state):
+    for expression in FINANCE_EXPRESSIONS:
+        state['manager'].evaluate(expression)
+
+def generate_report(state):
+    state['manager'].generate_report('01-01-2025', '31-12-2025')
+
+
+def build_cases(count):
+    ops = min(MUTATION_OPS, count)
+    cases = []
+    for kind in KINDS:
+        cases += [
+            Case(f'{kind}.load.cold', load_items(kind), open_store(kind), snapshot(kind), count),
+            Case(f'{kind}.load.warm', load_items(kind), warm_store(kind), snapshot(kind), count),
+            Case(f'{kind}.add', add_items(kind, ops), opened_manager(kind), snapshot(kind), ops),
+            Case(f'{kind}.edit', edit_items(kind, count, ops), opened_manager(kind), snapshot(kind), ops),
+            Case(f'{kind}.delete', delete_items(count, ops), opened_manager(kind), snapshot(kind), ops),
+            Case(f'{kind}.import', import_items(kind), None, csv_file(kind), count),
+            Case(f'{kind}.export.csv', export_items('csv'), opened_manager(kind), snapshot(kind), count),
+            Case(f'{kind}.export.jsonl', export_items('jsonl'), opened_manager(kind), snapshot(kind), count),
+            Case(f'{kind}.page', read_pages(count, PAGE_OPS), opened_manager(kind), snapshot(kind), 2 * PAGE_OPS),
+        ]
+    cases += [
+        Case('notes.search', search_notes, opened_manager('notes'), snapshot('notes'), len(SEARCH_QUERIES['notes'])),
+        Case('notes.search.cli', search_notes_cli(SEARCH_QUERIES['notes'][:CLI_SEARCH_OPS]), indexed_notes,
+             snapshot('notes'), CLI_SEARCH_OPS),
+        Case('contacts.search.name', search_contacts(SEARCH_QUERIES['contacts.name']), opened_manager('contacts'),
+             snapshot('contacts'), len(SEARCH_QUERIES['contacts.name'])),
+        Case('contacts.search.phone', search_contacts(SEARCH_QUERIES['contacts.phone']), opened_manager('contacts'),
+             snapshot('contacts'), len(SEARCH_QUERIES['contacts.phone'])),
+        Case('finance.report.totals', report_totals, opened_manager('finance'), snapshot('finance'), 12),
+        Case('finance.report.csv', generate_report, opened_manager('finance'), snapshot('finance'), 1),
+        Case('finance.report.categories', category_report, opened_manager('finance'), snapshot('finance'), 3),
+        Case('contacts.import.files', import_files('contacts'), split_csv('contacts', IMPORT_PARTS),
+             csv_file('contacts'), count),
+        Case('finance.import.files', import_files('finance'), split_csv('finance', IMPORT_PARTS),
+             csv_file('finance'), count),
+        Case('finance.eval', evaluate_expressions, opened_manager('finance'), snapshot('finance'),
+             len(FINANCE_EXPRESSIONS)),
+    ]
+    return cases
+
+
+def measure(case, dataset, backend, repeat):
+    runs = []
+    for _ in range(repeat):
+        with Workspace(dataset, backend, case.files), contextlib.redirect_stdout(io.StringIO()):
+            state = {}
+            if case.setup:
+                case.setup(state)
+            gc.collect()
+            started = time.perf_counter()
+            case.run(state)
+            runs.append(time.perf_counter() - started)
+            state.clear()
+    seconds = statistics.median(runs)
+    return {'seconds': seconds, 'best': min(runs), 'runs': runs, 'ops': case.ops, 'per_op': seconds / case.ops}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(pa.__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(count, backend='json', repeat=3, seed=1, data_dir=None, patterns=None, report=None):
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), 'pa-benchmark-data')
+    dataset = write_dataset(os.path.join(data_dir, f'{count}-{seed}'), count, seed)
+    results = {}
+    for case in build_cases(count):
+        if patterns and not any(fnmatch.fnmatch(case.name, pattern) for pattern in patterns):
+            continue
+        results[case.name] = measure(case, dataset, backend, repeat)
+        if report:
+            report(case.name, results[case.name])
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'numpy': pa.numpy is not None,
+            'backend': backend,
+            'size': count,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.parse
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка HTTP-сервера (server.py)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--spawn', action='store_true',
+                        help='запустить сервер во временном каталоге на свободном порту')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json', help='хранилище для --spawn')
+    parser.add_argument('--concurrency', type=int, default=200, help='одновременных соединений')
+    parser.add_argument('--requests', type=int, default=10000, help='всего запросов')
+    parser.add_argument('--write-share', type=float, default=0.3, help='доля запросов на запись')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+class Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = b'' if payload is None else json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n'
+                f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n')
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('соединение закрыто сервером')
+        status = int(status_line.split()[1])
+        length = 0
+        close = False
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                close = True
+        data = await self.reader.readexactly(length)
+        if close:
+            self.close()
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def make_request(rng, number, write_share):
+    # Смесь запросов похожа на работу нескольких локальных инструментов одновременно
+    if rng.random() < write_share:
+        choice = rng.randrange(4)
+        if choice == 0:
+            return 'POST', '/tasks', {'title': f'Задача {number}', 'priority': 'Высокий', 'due_date': '01-01-2030'}
+        if choice == 1:
+            return 'POST', '/notes', {'title': f'Заметка {number}', 'content': 'нагрузочный тест сервера'}
+        if choice == 2:
+            return 'POST', '/finance', {'amount': rng.choice([-1, 1]) * rng.randint(1, 5000),
+                                        'category': rng.choice(['еда', 'транспорт', 'зарплата']),
+                                        'date': f'{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-2026'}
+        return 'PATCH', f'/tasks/{rng.randint(1, 50)}', {'done': True}
+    choice = rng.randrange(5)
+    if choice == 0:
+        return 'GET', '/tasks?limit=20', None
+    if choice == 1:
+        return 'GET', f'/notes/{rng.randint(1, 50)}', None
+    if choice == 2:
+        return 'GET', '/notes/search?q=' + urllib.parse.quote(rng.choice(['нагрузочный', 'сервер', 'тест'])), None
+    if choice == 3:
+        return 'GET', '/contacts/search?q=' + urllib.parse.quote(rng.choice(['Ив', '912', 'Пётр'])), None
+    return 'GET', '/finance/report?from=01-01-2026&to=31-12-2026', None
+
+
+async def seed(host, port):
+    connection = Connection(host, port)
+    for number in range(50):
+        await connection.request('POST', '/tasks', {'title': f'Исходная задача {number}'})
+        await connection.request('POST', '/notes', {'title': f'Исходная заметка {number}', 'content': 'сервер'})
+    for name, phone in (('Иван', '+7 912 000 00 01'), ('Пётр', '+7 913 000 00 02')):
+        await connection.request('POST', '/contacts', {'name': name, 'phone': phone})
+    connection.close()
+
+
+async def run(args):
+    counter = iter(range(args.requests))
+    latencies = []
+    statuses = {}
+    failures = []
+
+    async def client(number):
+        rng = random.Random(args.seed * 1000 + number)
+        connection = Connection(args.host, args.port)
+        for request_number in counter:
+            method, path, payload = make_request(rng, request_number, args.write_share)
+            started = time.perf_counter()
+            try:
+                status, _ = await connection.request(method, path, payload)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+                failures.append(f'{method} {path}: {e}')
+                connection.close()
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    await seed(args.host, args.port)
+    started = time.perf_counter()
+    await asyncio.gather(*(client(number) for number in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    return elapsed, latencies, statuses, failures
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def start_server(args):
+    directory = tempfile.mkdtemp(prefix='pa-load-')
+    environment = dict(os.environ, PA_STORAGE=args.storage, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+                               '--host', args.host, '--port', '0'],
+                              cwd=directory, env=environment, stdout=subprocess.PIPE, text=True)
+    # Сервер печатает адрес первой строкой; порт 0 — любой свободный
+    line = server.stdout.readline()
+    args.port = int(line.rsplit(':', 1)[1])
+    print(f'Сервер запущен в {directory}, порт {args.port}')
+    return server
+
+
+def main():
+    args = parse_args()
+    server = start_server(args) if args.spawn else None
+    try:
+        elapsed, latencies, statuses, failures = asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    latencies.sort()
+    print(f'Запросов: {len(latencies)}, соединений: {args.concurrency}, время: {elapsed:.2f} с')
+    print(f'Пропускная способность: {len(latencies) / elapsed:.0f} запросов/с')
+    print('Задержка, мс: p50 {:.1f}, p95 {:.1f}, p99 {:.1f}, max {:.1f}'.format(
+        *(percentile(latencies, share) * 1000 for share in (0.5, 0.95, 0.99, 1.0))))
+    print('Коды ответов: ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+    errors = len(failures) + sum(count for status, count in statuses.items() if status >= 500)
+    for failure in failures[:10]:
+        print(f'ОШИБКА: {failure}')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
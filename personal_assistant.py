@@ -1,91 +1,3364 @@
 import os
+import re
+import ast
+import sys
 import json
 import csv
+import io
+import glob
+import gzip
+import lzma
+import math
+import time
+import atexit
+import signal
+import inspect
+import heapq
+import bisect
+import contextlib
+import tempfile
+import argparse
+import shlex
+import array
 import datetime
+import functools
+import operator
+import itertools
+import sqlite3
+import mmap
+import struct
+import cProfile
+import pstats
+import tracemalloc
+import threading
+import concurrent.futures
+from tokenize import NAME, OP, TokenError, generate_tokens
+
+# numpy необязателен (pip install numpy): с ним выражения над финансами считаются
+# по колонкам сразу, без него — построчно
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 NOTES_FILE = 'notes.json'
 TASKS_FILE = 'tasks.json'
 CONTACTS_FILE = 'contacts.json'
 FINANCE_FILE = 'finance.json'
+INDEX_SUFFIX = '.idx'
+TOTALS_SUFFIX = '.agg'
+ROLLUPS_SUFFIX = '.rollups'
+
+STORAGE_BACKEND = os.environ.get('PA_STORAGE', 'json')
+SQLITE_FILE = 'assistant.db'
+
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_COMPACT_THRESHOLD = 1000
+JOURNAL_FSYNC = True
+# Отложенная запись: «пауза[:предел]» в секундах, например 0.5:5; пусто или 0 — выключена
+WRITE_BEHIND_ENV = 'PA_WRITE_BEHIND'
+WRITE_BEHIND_DEBOUNCE = 0.5
+WRITE_BEHIND_MAX_LATENCY = 5.0
+LOCK_SUFFIX = '.lock'
+SNAPSHOT_SUFFIX = '.snap'
+CHANGES_SUFFIX = '.changes'
+# JSON-снимок после переноса в двоичный остаётся рядом под этим суффиксом
+BACKUP_SUFFIX = '.bak'
+# Лог изменений хранит не меньше стольких последних номеров; более старые вычищаются
+CHANGES_KEEP = 100000
+CHANGE_SEQ_RE = re.compile(rb'\{"seq": (\d+)')
+SNAPSHOT_MAGIC = b'PASNAP1\n'
+# Ширина колонки в таблице строк: строки и прочие значения хранятся как смещение и длина в области данных
+SNAPSHOT_TYPES = {'int': 'q', 'float': 'd', 'bool': '?', 'text': 'qq', 'json': 'qq'}
+INDEX_MAGIC = b'PAIDX1\n'
+# Заметка: ID, длина, длина заголовка, начало и число её терминов; термин: начало и длина строки,
+# начало постинга, число заметок и позиций в нём
+INDEX_DOC = struct.Struct('<qiiqi')
+INDEX_TERM = struct.Struct('<qiqii')
+SQLITE_TIMEOUT = 30
+
+IMPORT_BATCH_SIZE = 1000
+PAGE_SIZE = 20
+OUTPUT_BATCH_SIZE = 1000
+EXPORT_COMPRESSION = {'.gz': 'gzip', '.xz': 'xz'}
+
+def load_data(file_path, default_data):
+    if not os.path.exists(file_path):
+        save_data(file_path, default_data)
+        return default_data
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_data(file_path, data, indent=4):
+    with replace_file(file_path) as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+
+@contextlib.contextmanager
+def replace_file(file_path, binary=False):
+    # Пишем во временный файл и атомарно подменяем: при сбое остаётся прежняя версия.
+    # Имя временного файла уникально, чтобы одновременные записи не мешали друг другу
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + '.', suffix='.tmp',
+                                    dir=os.path.dirname(file_path) or '.')
+    try:
+        with open(fd, 'wb') if binary else open(fd, 'w', encoding='utf-8') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, file_path)
+
+
+class ConflictError(Exception):
+    pass
+
+
+class FileLock:
+    # Рекомендательная блокировка fcntl на отдельном файле рядом с данными. Повторный захват
+    # в том же процессе только увеличивает счётчик; без fcntl (Windows) блокировка не действует.
+    # Потоки одного процесса делят flock, поэтому между собой они разделяются мьютексом
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.fd = None
+        self.pid = None
+        self.depth = 0
+        self.exclusive = False
+        self.mutex = threading.RLock()
+
+    def acquire(self, shared=False):
+        self.mutex.acquire()
+        try:
+            if fcntl is not None:
+                # После fork дескриптор общий с родителем, и flock у них тоже был бы общим
+                if self.fd is None or self.pid != os.getpid():
+                    self.fd = os.open(self.file_path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self.pid = os.getpid()
+                    self.depth = 0
+                    self.exclusive = False
+                if self.depth == 0 or (not shared and not self.exclusive):
+                    fcntl.flock(self.fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        except BaseException:
+            self.mutex.release()
+            raise
+        if not shared:
+            self.exclusive = True
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        try:
+            if self.depth == 0:
+                self.exclusive = False
+                if fcntl is not None:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            self.mutex.release()
+
+    @contextlib.contextmanager
+    def hold(self, shared=False):
+        self.acquire(shared)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class LazyText:
+    # Строка в отображённом снимке; декодируется только при обращении
+    __slots__ = ('buffer', 'start', 'end')
+
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def raw(self):
+        return self.buffer[self.start:self.end]
+
+    def decode(self):
+        return self.raw().decode('utf-8')
+
+
+def column_type(values):
+    kinds = set(map(type, values))
+    if kinds <= {int} and (not values or -2 ** 63 <= min(values) and max(values) < 2 ** 63):
+        return 'int'
+    if kinds == {float}:
+        return 'float'
+    if kinds == {bool}:
+        return 'bool'
+    if kinds <= {str, LazyText, type(None)}:
+        return 'text'
+    return 'json'
+
+def write_snapshot(file_path, fields, rows):
+    # Формат: сигнатура, заголовок JSON (поля, типы колонок, число строк), таблица строк
+    # фиксированной ширины по возрастанию ID и область данных со строками UTF-8.
+    # Данные пишутся потоком сразу за зарезервированной таблицей, таблица — в конце
+    rows = sorted(rows, key=operator.itemgetter(0))
+    types = [column_type(column) for column in zip(*rows)] if rows else ['int'] * len(fields)
+    row_struct = struct.Struct('<' + ''.join(SNAPSHOT_TYPES[kind] for kind in types))
+    header = json.dumps({'fields': list(fields), 'types': types, 'count': len(rows)}).encode('utf-8')
+    table_start = len(SNAPSHOT_MAGIC) + 4 + len(header)
+    table = bytearray(row_struct.size * len(rows))
+    with replace_file(file_path, binary=True) as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+        f.seek(table_start + len(table))
+        offset = 0
+        for number, row in enumerate(rows):
+            values = []
+            for value, kind in zip(row, types):
+                if kind == 'text' or kind == 'json':
+                    if type(value) is LazyText:
+                        value = value.raw() if kind == 'text' else value.decode()
+                    if value is None and kind == 'text':
+                        values += (0, -1)
+                        continue
+                    if kind == 'json':
+                        value = json.dumps(value, ensure_ascii=False)
+                    data = value if type(value) is bytes else value.encode('utf-8')
+                    f.write(data)
+                    values += (offset, len(data))
+                    offset += len(data)
+                else:
+                    values.append(value)
+            row_struct.pack_into(table, number * row_struct.size, *values)
+        f.seek(table_start)
+        f.write(table)
+    return len(rows)
+
+def is_snapshot(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+class BinarySnapshot:
+    # Снимок открывается через mmap: в память процесса попадают только прочитанные строки.
+    # Как последовательность возвращает ID по позиции, чтобы по ней работал bisect
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_start = len(SNAPSHOT_MAGIC) + 4
+        header_size, = struct.unpack_from('<I', self.buffer, len(SNAPSHOT_MAGIC))
+        header = json.loads(self.buffer[header_start:header_start + header_size])
+        self.fields = header['fields']
+        self.count = header['count']
+        self.row_struct = struct.Struct('<' + ''.join(SNAPSHOT_TYPES[kind] for kind in header['types']))
+        self.table_start = header_start + header_size
+        self.blob_start = self.table_start + self.count * self.row_struct.size
+        self.columns = []
+        slot = 0
+        for name, kind in zip(self.fields, header['types']):
+            self.columns.append((name, kind, slot))
+            slot += len(SNAPSHOT_TYPES[kind])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError(position)
+        return struct.unpack_from('<q', self.buffer, self.table_start + position * self.row_struct.size)[0]
+
+    def decode(self, values, lazy_fields=()):
+        row = []
+        for name, kind, slot in self.columns:
+            if kind == 'text' or kind == 'json':
+                offset, length = values[slot], values[slot + 1]
+                if length < 0:
+                    row.append(None)
+                    continue
+                start = self.blob_start + offset
+                if kind == 'text' and name in lazy_fields:
+                    row.append(LazyText(self.buffer, start, start + length))
+                    continue
+                value = self.buffer[start:start + length].decode('utf-8')
+                row.append(json.loads(value) if kind == 'json' else value)
+            else:
+                row.append(values[slot])
+        return row
+
+    def row(self, position, lazy_fields=()):
+        values = self.row_struct.unpack_from(self.buffer, self.table_start + position * self.row_struct.size)
+        return self.decode(values, lazy_fields)
+
+    def rows(self, lazy_fields=()):
+        table = memoryview(self.buffer)[self.table_start:self.blob_start]
+        for values in self.row_struct.iter_unpack(table):
+            yield self.decode(values, lazy_fields)
+
+
+class SnapshotTable:
+    # Записи поверх двоичного снимка: объекты создаются при обращении, а строки, изменённые
+    # после снимка, лежат в changes (None — запись удалена). Для журнала и менеджера
+    # таблица ведёт себя как словарь ID -> строка, при обходе отдаёт объекты записей
+    def __init__(self, record_class, snapshot=None, lazy_fields=()):
+        self.record_class = record_class
+        self.snapshot = snapshot
+        self.lazy_fields = lazy_fields
+        self.count = len(snapshot) if snapshot is not None else 0
+        self.changes = {}
+        self.added = []
+        self.removed = 0
+
+    @classmethod
+    def from_rows(cls, record_class, rows):
+        table = cls(record_class)
+        for row in sorted(rows, key=operator.itemgetter(0)):
+            table[row[0]] = row
+        return table
+
+    def __len__(self):
+        return self.count - self.removed + len(self.added)
+
+    def __iter__(self):
+        return itertools.starmap(self.record_class, self.rows(lazy=True))
+
+    def position(self, key):
+        if not self.count:
+            return None
+        position = bisect.bisect_left(self.snapshot, key)
+        if position < self.count and self.snapshot[position] == key:
+            return position
+        return None
+
+    def get(self, key, default=None):
+        if key in self.changes:
+            row = self.changes[key]
+        else:
+            position = self.position(key)
+            row = None if position is None else self.snapshot.row(position, self.lazy_fields)
+        return default if row is None else row
+
+    def __setitem__(self, key, row):
+        if self.position(key) is None:
+            if key not in self.changes:
+                bisect.insort(self.added, key)
+        elif self.changes.get(key, row) is None:
+            self.removed -= 1
+        self.changes[key] = row
+
+    def pop(self, key, default=None):
+        row = self.get(key)
+        if row is None:
+            return default
+        if self.position(key) is None:
+            del self.changes[key]
+            del self.added[bisect.bisect_left(self.added, key)]
+        else:
+            self.changes[key] = None
+            self.removed += 1
+        return row
+
+    def record(self, key):
+        row = self.get(key)
+        return None if row is None else self.record_class(*row)
+
+    def max_id(self):
+        keys = self.added[-1:]
+        if self.count:
+            keys.append(self.snapshot[self.count - 1])
+        return max(keys, default=0)
+
+    def keys_from(self, key=None, descending=False):
+        # ID по порядку строго после key (при descending — перед ним, по убыванию) без обхода таблицы
+        snapshot_keys = ()
+        if descending:
+            if self.count:
+                end = self.count if key is None else bisect.bisect_left(self.snapshot, key)
+                snapshot_keys = (self.snapshot[position] for position in range(end - 1, -1, -1))
+            end = len(self.added) if key is None else bisect.bisect_left(self.added, key)
+            added_keys = (self.added[position] for position in range(end - 1, -1, -1))
+        else:
+            if self.count:
+                start = 0 if key is None else bisect.bisect_right(self.snapshot, key)
+                snapshot_keys = (self.snapshot[position] for position in range(start, self.count))
+            start = 0 if key is None else bisect.bisect_right(self.added, key)
+            added_keys = (self.added[position] for position in range(start, len(self.added)))
+        for key in heapq.merge(snapshot_keys, added_keys, reverse=descending):
+            if self.changes.get(key, key) is not None:
+                yield key
+
+    def rows(self, lazy=False):
+        # По возрастанию ID: строки снимка вперемешку с добавленными после него
+        snapshot_rows = ()
+        if self.count:
+            snapshot_rows = ((row[0], row) for row in self.snapshot.rows(self.lazy_fields if lazy else ()))
+        added_rows = ((key, None) for key in self.added)
+        for key, row in heapq.merge(snapshot_rows, added_rows, key=operator.itemgetter(0)):
+            if key in self.changes:
+                row = self.changes[key]
+                if row is None:
+                    continue
+            yield row
+
+
+class JournalStore:
+    resident = True
+
+    def __init__(self, file_path, schema, dump, binary=False, lazy_fields=()):
+        self.file_path = file_path
+        self.journal_path = file_path + JOURNAL_SUFFIX
+        # Двоичный снимок лежит рядом с JSON-файлом под своим именем; JSON читается только для переноса
+        self.snapshot_path = os.path.splitext(file_path)[0] + SNAPSHOT_SUFFIX if binary else file_path
+        self.binary = binary
+        self.lazy_fields = lazy_fields
+        self.schema = schema
+        self.dump = dump
+        self.after_save = None
+        self.journal_ops = 0
+        self.record_count = 0
+        self.tail = []
+        self.offset = 0
+        self.seen_stamp = None
+        self.depth = 0
+        self.pending = None
+        self.savepoints = []
+        self.rollback_only = False
+        self.lock = FileLock(file_path + LOCK_SUFFIX)
+        # Номер последнего изменения: строка журнала начинается с номера своего последнего изменения,
+        # при сжатии события журнала переносятся в лог изменений рядом с файлом
+        self.changes_path = file_path + CHANGES_SUFFIX
+        self.version_position = schema.fields.index('version')
+        self.last_seq = 0
+        # При отложенной записи строки журнала копятся здесь до фонового сброса
+        self.write_behind = None
+        self.deferred = []
+        self.deferred_ops = 0
+
+    def load(self):
+        # Несохранённые изменения пишутся до перечитывания, иначе они пропали бы из памяти
+        if self.deferred:
+            self.flush(compact=False)
+        # Снимок и журнал читаются под общей блокировкой, чтобы не застать их посреди сжатия
+        with self.lock.hold(shared=True):
+            return self._load()
+
+    def _load(self):
+        if not self.binary:
+            rows, migrated = self._load_rows()
+            if migrated:
+                self.save(rows)
+            return rows
+        if not os.path.exists(self.snapshot_path):
+            # Перенос JSON-снимка в двоичный под исключительной блокировкой: другой процесс мог успеть раньше
+            with self.lock.hold():
+                if not os.path.exists(self.snapshot_path):
+                    self.save(self._load_rows()[0])
+                    if os.path.exists(self.file_path):
+                        os.replace(self.file_path, self.file_path + BACKUP_SUFFIX)
+        records = self.open_snapshot()
+        self.journal_ops = self._replay(records)
+        self.record_count = len(records)
+        self.seen_stamp = self.stamp()
+        return records
+
+    def _load_rows(self):
+        if self.binary and not os.path.exists(self.file_path):
+            data = self.encode([])
+        else:
+            data = load_data(self.file_path, self.encode([]))
+        # Старый формат — список словарей; он переписывается в строки при первой загрузке
+        migrated = isinstance(data, list)
+        if migrated:
+            rows = [self.schema.row_from_dict(record) for record in data]
+        else:
+            rows = self.schema.convert_rows(data['fields'], data['rows'])
+        records = {}
+        next_id = max([row[0] for row in rows], default=0)
+        for row in rows:
+            if row[0] in records:
+                # В старых файлах импорт мог продублировать ID — выдаём новый
+                next_id += 1
+                row[0] = next_id
+                migrated = True
+            records[row[0]] = row
+        self.journal_ops = self._replay(records)
+        self.record_count = len(records)
+        self.seen_stamp = self.stamp()
+        return list(records.values()), migrated
+
+    def open_snapshot(self):
+        return SnapshotTable(self.schema, BinarySnapshot(self.snapshot_path), self.lazy_fields)
+
+    def encode(self, rows):
+        return {'fields': self.schema.fields, 'rows': rows}
+
+    def _read_journal(self, offset):
+        # Читает целые строки журнала начиная с offset; возвращает записи и конец прочитанного
+        entries = []
+        if not os.path.exists(self.journal_path):
+            return entries, 0
+        with open(self.journal_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # Недописанная последняя строка — след сбоя во время записи
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                # Транзакция пишется одной строкой, поэтому применяется целиком или не применяется вовсе
+                ops = entry['ops'] if entry['op'] == 'batch' else [entry]
+                seq = entry.get('seq')
+                for number, entry in enumerate(ops, 1 - len(ops)):
+                    if 'data' in entry:
+                        # Запись журнала старого формата
+                        entry = {'op': 'put', 'row': self.schema.row_from_dict(entry['data'])}
+                    if seq is not None:
+                        entry['seq'] = seq + number
+                    entries.append(entry)
+        return entries, offset
+
+    def track_seq(self, entries):
+        for entry in reversed(entries):
+            if 'seq' in entry:
+                self.last_seq = max(self.last_seq, entry['seq'])
+                break
+
+    def change_event(self, entry):
+        # Новая запись пишется с версией 0, каждое изменение увеличивает версию
+        if entry['op'] == 'del':
+            return entry['seq'], 'deleted', entry['id']
+        return entry['seq'], 'created' if entry['row'][self.version_position] == 0 else 'updated', entry['row'][0]
+
+    def read_changes(self, seq=0):
+        # Горизонт лога (номер, после которого он полон) и события после seq
+        since = 0
+        events = []
+        if not os.path.exists(self.changes_path):
+            return since, events
+        with open(self.changes_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break
+                if isinstance(event, dict):
+                    since = event['since']
+                elif event[0] > seq:
+                    events.append(tuple(event))
+        return since, events
+
+    def changes_horizon(self):
+        if not os.path.exists(self.changes_path):
+            return 0
+        with open(self.changes_path, 'rb') as f:
+            try:
+                return json.loads(f.readline())['since']
+            except (ValueError, KeyError, TypeError):
+                return 0
+
+    def archived_seq(self):
+        # Номер из последней строки лога изменений: читается только конец файла
+        if not os.path.exists(self.changes_path):
+            return 0
+        with open(self.changes_path, 'rb') as f:
+            start = max(0, os.path.getsize(self.changes_path) - 4096)
+            f.seek(start)
+            # Первая строка куска, прочитанного с середины файла, неполная
+            lines = [line for line in f.read().split(b'\n')[1 if start else 0:] if line]
+        for line in reversed(lines):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            return event['since'] if isinstance(event, dict) else event[0]
+        return 0
+
+    def disk_seq(self):
+        # Под блокировкой записи. Если журнал не менялся после нашего чтения, номер уже известен;
+        # иначе журнал дописал или сжал другой процесс, и номер читается с диска
+        size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if size == self.offset and self.stamp() == self.seen_stamp:
+            return self.last_seq
+        seq = self.archived_seq()
+        if size:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    match = CHANGE_SEQ_RE.match(line)
+                    if match:
+                        seq = max(seq, int(match[1]))
+        return seq
+
+    def archive_changes(self):
+        # События журнала дописываются в лог перед его удалением; после сбоя между этими шагами
+        # повторно перенесённые номера отсекаются по последнему номеру лога
+        entries = [entry for entry in self._read_journal(0)[0] if 'seq' in entry]
+        archived = self.archived_seq()
+        events = [self.change_event(entry) for entry in entries if entry['seq'] > archived]
+        if not events:
+            return
+        if archived - self.changes_horizon() + len(events) > 2 * CHANGES_KEEP:
+            # Лог переписывается, когда в нём вдвое больше номеров, чем нужно хранить
+            since = events[-1][0] - CHANGES_KEEP
+            kept = [event for event in self.read_changes(since)[1] + events if event[0] > since]
+            with replace_file(self.changes_path, binary=True) as f:
+                f.write(json.dumps({'since': since}).encode('utf-8') + b'\n')
+                f.writelines(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n' for event in kept)
+            return
+        with open(self.changes_path, 'ab') as f:
+            if f.tell() == 0:
+                f.write(json.dumps({'since': 0}).encode('utf-8') + b'\n')
+            f.writelines(json.dumps(event, ensure_ascii=False).encode('utf-8') + b'\n' for event in events)
+            f.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(f.fileno())
+
+    def change_seq(self):
+        with self.lock.hold(shared=True):
+            return self.disk_seq()
+
+    def changes_since(self, seq):
+        # None — лог уже не хранит изменения после seq, нужна полная выгрузка
+        with self.lock.hold(shared=True):
+            since, events = self.read_changes(seq)
+            entries = self._read_journal(0)[0]
+        if seq < since:
+            return None
+        archived = events[-1][0] if events else seq
+        events += [self.change_event(entry) for entry in entries if entry.get('seq', 0) > archived]
+        return events
+
+    def _replay(self, records):
+        # tail — пары (было, стало) для изменений поверх снимка: по ним
+        # сохранённые рядом со снимком индексы догоняют текущее состояние
+        self.tail = []
+        entries, self.offset = self._read_journal(0)
+        self.last_seq = self.archived_seq()
+        self.track_seq(entries)
+        for entry in entries:
+            if entry['op'] == 'put':
+                key = entry['row'][0]
+                self.tail.append((records.get(key), entry['row']))
+                records[key] = entry['row']
+            elif entry['op'] == 'del':
+                self.tail.append((records.pop(entry['id'], None), None))
+        if os.path.exists(self.journal_path) and self.offset < os.path.getsize(self.journal_path):
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(self.offset)
+        return len(entries)
+
+    def poll(self):
+        # None — снимок переписан извне и нужна полная перезагрузка,
+        # иначе список записей, дописанных в журнал после нашего последнего чтения
+        with self.lock.hold(shared=True):
+            if self.stamp() != self.seen_stamp:
+                return None
+            size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+            if size < self.offset:
+                return None
+            if size == self.offset:
+                return []
+            entries, self.offset = self._read_journal(self.offset)
+        self.journal_ops += len(entries)
+        self.track_seq(entries)
+        return entries
+
+    def begin(self):
+        # Транзакция держит исключительную блокировку от begin() до commit()/rollback()
+        if self.depth == 0:
+            self.lock.acquire()
+            self.pending = []
+            self.pending_save = False
+            self.savepoints = []
+            self.rollback_only = False
+        else:
+            # Точка сохранения вложенного блока; save() заменяет список отложенных записей, а не очищает его
+            self.savepoints.append((self.pending, len(self.pending), self.pending_save))
+        self.depth += 1
+
+    def commit(self):
+        self.depth -= 1
+        if self.depth:
+            self.savepoints.pop()
+            return
+        pending, self.pending = self.pending, None
+        try:
+            if self.pending_save:
+                self.compact()
+            elif len(pending) == 1:
+                self._append(pending)
+            elif pending:
+                self._append([{'op': 'batch', 'ops': pending}], len(pending))
+        finally:
+            self.lock.release()
+
+    def rollback(self):
+        # Возвращает, было ли что отменять: без записей состояние в памяти перечитывать не нужно
+        discarded = bool(self.pending) or bool(self.depth and self.pending_save)
+        if self.depth:
+            self.lock.release()
+        self.depth = 0
+        self.pending = None
+        self.savepoints = []
+        return discarded
+
+    def rollback_savepoint(self):
+        # Отменяет записи вложенного блока. Возвращает записи внешнего блока, которые нужно заново
+        # применить к состоянию с диска, или None, если отменять нечего
+        pending, size, pending_save = self.savepoints.pop()
+        self.depth -= 1
+        if pending is self.pending and len(pending) == size and pending_save == self.pending_save:
+            return None
+        if pending_save:
+            # Состояние памяти после полной перезаписи с диска не восстановить: откатится вся транзакция
+            self.rollback_only = True
+            return None
+        del pending[size:]
+        self.pending = pending
+        self.pending_save = False
+        return pending
+
+    def _append(self, entries, ops=None):
+        if self.pending is not None:
+            self.pending.extend(entries)
+            return
+        if self.write_behind is not None:
+            with self.lock.mutex:
+                self.deferred.extend(entries)
+                self.deferred_ops += ops or len(entries)
+                due = self.journal_ops + self.deferred_ops >= max(JOURNAL_COMPACT_THRESHOLD, self.record_count)
+            # Сжатие читает записи менеджера, поэтому идёт в потоке, который их меняет, а не в фоновом
+            if due:
+                self.flush()
+            else:
+                self.write_behind.touch(self)
+            return
+        with self.lock.hold():
+            self._write(entries, ops)
+            if self.journal_ops >= max(JOURNAL_COMPACT_THRESHOLD, self.record_count):
+                self.compact()
+
+    def flush(self, compact=True):
+        with self.lock.hold():
+            self._write_deferred()
+            if compact and self.journal_ops >= max(JOURNAL_COMPACT_THRESHOLD, self.record_count):
+                self.compact()
+
+    def _write_deferred(self):
+        # Отложенные строки дописываются одним вызовом; при ошибке они остаются для повтора
+        if self.deferred:
+            self._write(self.deferred, self.deferred_ops)
+            self.deferred = []
+            self.deferred_ops = 0
+
+    def _write(self, entries, ops=None):
+        # Вызывается под блокировкой записи
+        seq = self.disk_seq()
+        lines = []
+        for entry in entries:
+            seq += len(entry['ops']) if entry['op'] == 'batch' else 1
+            lines.append(json.dumps({'seq': seq, **entry}, ensure_ascii=False).encode('utf-8') + b'\n')
+        lines = b''.join(lines)
+        with open(self.journal_path, 'ab') as f:
+            start = f.tell()
+            try:
+                f.write(lines)
+                f.flush()
+                if JOURNAL_FSYNC:
+                    os.fsync(f.fileno())
+            except BaseException:
+                # Недописанный хвост убирается, чтобы следующая запись не склеилась с ним
+                with contextlib.suppress(OSError):
+                    os.ftruncate(f.fileno(), start)
+                raise
+        # Если перед нами дописал другой процесс, смещение не двигаем: poll() перечитает
+        # и чужие, и наши строки, а повторное применение put/del безвредно
+        if start == self.offset:
+            self.offset = start + len(lines)
+        self.last_seq = seq
+        self.journal_ops += ops or len(entries)
+
+    def put(self, row):
+        self._append([{'op': 'put', 'row': row}])
+
+    def put_many(self, rows):
+        if rows:
+            self._append([{'op': 'put', 'row': row} for row in rows])
+
+    def delete(self, key):
+        self._append([{'op': 'del', 'id': key}])
+
+    def save(self, rows):
+        if self.pending is not None:
+            # Внутри транзакции полная перезапись откладывается до commit()
+            self.pending = []
+            self.pending_save = True
+            return
+        with self.lock.hold():
+            # Снимок сделан с памяти, где отложенные изменения уже есть, но в лог изменений
+            # они попадут только через журнал
+            self._write_deferred()
+            if self.binary:
+                self.record_count = write_snapshot(self.snapshot_path, self.schema.fields, rows)
+            else:
+                save_data(self.file_path, self.encode(rows), indent=None)
+                self.record_count = len(rows)
+            # Журнал очищается только после того, как снимок надёжно записан, а его события — в логе изменений
+            if os.path.exists(self.journal_path):
+                self.archive_changes()
+                os.remove(self.journal_path)
+            self.journal_ops = 0
+            self.tail = []
+            self.offset = 0
+            self.seen_stamp = self.stamp()
+            if self.after_save:
+                self.after_save()
+
+    def compact(self):
+        self.save(self.dump())
+
+    def stamp(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+
+class SqliteDatabase:
+    # Одно соединение на файл базы: транзакция по нескольким таблицам — это одна транзакция SQLite
+    opened = {}
+
+    def __init__(self, file_path):
+        self.conn = sqlite3.connect(file_path, timeout=SQLITE_TIMEOUT)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.depth = 0
+
+    @classmethod
+    def open(cls, file_path):
+        database = cls.opened.get(file_path)
+        if database is None:
+            database = cls.opened[file_path] = cls(file_path)
+        return database
+
+
+class SqliteStore:
+    resident = False
+
+    def __init__(self, file_path, schema, dump, columns=None, binary=False):
+        self.file_path = file_path
+        self.binary = binary
+        self.table = os.path.splitext(os.path.basename(file_path))[0]
+        self.schema = schema
+        self.dump = dump
+        self.after_save = None
+        self.tail = []
+        self.seen_stamp = None
+        # Колонка для индекса: имя -> (поле записи, преобразование значения)
+        self.columns = columns or {}
+        self.derived = [(schema.fields.index(field), convert) for field, convert in self.columns.values()]
+        self.version_position = schema.fields.index('version')
+        self.db = SqliteDatabase.open(SQLITE_FILE)
+        self.conn = self.db.conn
+        extra = ''.join(f', {name}' for name in self.columns)
+        # Схема и переносы данных проверяются и применяются под BEGIN IMMEDIATE: при одновременном
+        # первом открытии второй процесс ждёт и видит уже сделанное первым
+        owned = not self.conn.in_transaction
+        if owned:
+            self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} (id INTEGER PRIMARY KEY, data TEXT NOT NULL{extra})')
+            # Колонки, добавленные в columns после создания таблицы, заполняются из данных ниже
+            existing = {row[1] for row in self.conn.execute(f'PRAGMA table_info({self.table})')}
+            added = [name for name in self.columns if name not in existing]
+            for name in added:
+                self.conn.execute(f'ALTER TABLE {self.table} ADD COLUMN {name}')
+            for name in self.columns:
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {self.table}_{name} ON {self.table} ({name})')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            self.conn.execute('INSERT OR IGNORE INTO versions (name, version) VALUES (?, 0)', (self.table,))
+            # Лог изменений общий для всех таблиц базы, номера растут, но у одной таблицы идут с пропусками
+            self.conn.execute('CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                              'name TEXT NOT NULL, id INTEGER NOT NULL, op TEXT NOT NULL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS changes_name ON changes (name, seq)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS change_horizons (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)')
+            self._migrate()
+            if added:
+                self._fill_columns()
+        except BaseException:
+            if owned:
+                self.conn.rollback()
+            raise
+        if owned:
+            self.conn.commit()
+        self.stale = False
+        self.seen_version = self.begin_version = self._version()
+        self.depth = 0
+        self.dirty = False
+        self.savepoints = []
+        self.rollback_only = False
+
+    def _migrate(self):
+        # Однократный перенос данных из JSON-хранилища в таблицу
+        if not self.conn.execute('SELECT 1 FROM migrations WHERE name = ?', (self.table,)).fetchone():
+            rows = []
+            source = JournalStore(self.file_path, self.schema, None, self.binary)
+            if os.path.exists(self.file_path) or os.path.exists(source.snapshot_path):
+                rows = source.load()
+                if isinstance(rows, SnapshotTable):
+                    rows = list(rows.rows())
+            self.conn.executemany(self._insert_sql(), [self._row(row) for row in rows])
+            self.conn.execute('INSERT INTO migrations (name) VALUES (?)', (self.table,))
+        # Записи, сохранённые словарями до перехода на строки, переписываются один раз
+        name = f'{self.table}:rows'
+        if not self.conn.execute('SELECT 1 FROM migrations WHERE name = ?', (name,)).fetchone():
+            records = self.conn.execute(f"SELECT data FROM {self.table} WHERE data LIKE '{{%'").fetchall()
+            self.conn.executemany(self._insert_sql(),
+                                  [self._row(self.schema.row_from_dict(json.loads(data))) for (data,) in records])
+            self.conn.execute('INSERT INTO migrations (name) VALUES (?)', (name,))
+
+    def _fill_columns(self):
+        rows = [json.loads(data) for (data,) in self.conn.execute(f'SELECT data FROM {self.table}')]
+        self.conn.executemany(self._insert_sql(), [self._row(row) for row in rows])
+
+    def _insert_sql(self):
+        placeholders = ', '.join('?' * (len(self.columns) + 2))
+        names = ''.join(f', {name}' for name in self.columns)
+        return f'INSERT OR REPLACE INTO {self.table} (id, data{names}) VALUES ({placeholders})'
+
+    def _row(self, row):
+        derived = [convert(row[position]) if convert else row[position] for position, convert in self.derived]
+        return (row[0], json.dumps(row, ensure_ascii=False), *derived)
+
+    def load(self):
+        return list(self.select())
+
+    def select(self, where=None, params=(), order_by='id', limit=None):
+        sql = f'SELECT data FROM {self.table}'
+        if where:
+            sql += f' WHERE {where}'
+        sql += f' ORDER BY {order_by}'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        for (data,) in self.conn.execute(sql, params):
+            yield json.loads(data)
+
+    def aggregate(self, expressions, where=None, params=()):
+        sql = f'SELECT {expressions} FROM {self.table}'
+        if where:
+            sql += f' WHERE {where}'
+        return self.conn.execute(sql, params).fetchone()
+
+    def group(self, expressions, group_by, where=None, params=()):
+        sql = f'SELECT {expressions} FROM {self.table}'
+        if where:
+            sql += f' WHERE {where}'
+        sql += f' GROUP BY {group_by}'
+        return self.conn.execute(sql, params).fetchall()
+
+    def get(self, key):
+        row = self.conn.execute(f'SELECT data FROM {self.table} WHERE id = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self):
+        return self.conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def max_key(self):
+        return self.conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {self.table}').fetchone()[0]
+
+    def _version(self):
+        return self.conn.execute('SELECT version FROM versions WHERE name = ?', (self.table,)).fetchone()[0]
+
+    @contextlib.contextmanager
+    def _write(self):
+        # Счётчик версии таблицы растёт при каждой записи; если перед нашей записью
+        # он ушёл вперёд, значит таблицу менял другой процесс
+        self.dirty = True
+        self.conn.execute('UPDATE versions SET version = version + 1 WHERE name = ?', (self.table,))
+        version = self._version()
+        if version - 1 != self.seen_version:
+            self.stale = True
+        self.seen_version = version
+        try:
+            yield
+        except BaseException:
+            if self.db.depth == 0:
+                self.conn.rollback()
+                self.seen_version = version - 1
+            raise
+        if self.db.depth == 0:
+            self.conn.commit()
+
+    def begin(self):
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: другие процессы ждут до commit()
+        if self.db.depth == 0 and not self.conn.in_transaction:
+            self.conn.execute('BEGIN IMMEDIATE')
+        if self.depth == 0:
+            self.begin_version = self.seen_version
+            self.dirty = False
+            self.savepoints = []
+        else:
+            name = f'{self.table}_{self.depth}'
+            self.conn.execute(f'SAVEPOINT "{name}"')
+            self.savepoints.append((name, self.seen_version, self.dirty))
+            self.dirty = False
+        self.depth += 1
+        self.db.depth += 1
+
+    def commit(self):
+        self.depth -= 1
+        self.db.depth -= 1
+        if self.depth:
+            name, _, dirty = self.savepoints.pop()
+            self.conn.execute(f'RELEASE "{name}"')
+            self.dirty = self.dirty or dirty
+        if self.db.depth == 0:
+            self.conn.commit()
+
+    def rollback(self):
+        self.db.depth -= self.depth
+        self.depth = 0
+        self.savepoints = []
+        self.conn.rollback()
+        self.seen_version = self.begin_version
+        return self.dirty
+
+    def rollback_savepoint(self):
+        # Записи внешнего блока остаются в базе, перечитать таблицу достаточно
+        name, seen_version, dirty = self.savepoints.pop()
+        self.conn.execute(f'ROLLBACK TO "{name}"')
+        self.conn.execute(f'RELEASE "{name}"')
+        self.depth -= 1
+        self.db.depth -= 1
+        discarded, self.dirty = self.dirty, dirty
+        self.seen_version = seen_version
+        return [] if discarded else None
+
+    def poll(self):
+        version = self._version()
+        if self.stale or version != self.seen_version:
+            self.stale = False
+            self.seen_version = version
+            return None
+        return []
+
+    def _log(self, events):
+        # Новая запись пишется с версией 0, каждое изменение увеличивает версию
+        self.conn.executemany('INSERT INTO changes (name, id, op) VALUES (?, ?, ?)',
+                              [(self.table, key, op) for key, op in events])
+        seq = self.conn.execute('SELECT MAX(seq) FROM changes').fetchone()[0]
+        if seq // CHANGES_KEEP != (seq - len(events)) // CHANGES_KEEP:
+            self.conn.execute('DELETE FROM changes WHERE name = ? AND seq <= ?', (self.table, seq - CHANGES_KEEP))
+            self.conn.execute('INSERT OR REPLACE INTO change_horizons (name, seq) VALUES (?, ?)',
+                              (self.table, seq - CHANGES_KEEP))
+
+    def _put_event(self, row):
+        return row[0], 'created' if row[self.version_position] == 0 else 'updated'
+
+    def put(self, row):
+        with self._write():
+            self.conn.execute(self._insert_sql(), self._row(row))
+            self._log([self._put_event(row)])
+
+    def put_many(self, rows):
+        with self._write():
+            self.conn.executemany(self._insert_sql(), [self._row(row) for row in rows])
+            self._log([self._put_event(row) for row in rows])
+
+    def delete(self, key):
+        with self._write():
+            self.conn.execute(f'DELETE FROM {self.table} WHERE id = ?', (key,))
+            self._log([(key, 'deleted')])
+
+    def change_horizon(self):
+        row = self.conn.execute('SELECT seq FROM change_horizons WHERE name = ?', (self.table,)).fetchone()
+        return row[0] if row else 0
+
+    def change_seq(self):
+        seq = self.conn.execute('SELECT MAX(seq) FROM changes WHERE name = ?', (self.table,)).fetchone()[0]
+        return max(seq or 0, self.change_horizon())
+
+    def changes_since(self, seq):
+        events = self.conn.execute('SELECT seq, op, id FROM changes WHERE name = ? AND seq > ? ORDER BY seq',
+                                   (self.table, seq)).fetchall()
+        # Горизонт проверяется после чтения: вычистка между запросами только сдвигает его вперёд
+        if seq < self.change_horizon():
+            return None
+        return events
+
+    def save(self, rows):
+        with self._write():
+            self.conn.execute(f'DELETE FROM {self.table}')
+            self.conn.executemany(self._insert_sql(), [self._row(row) for row in rows])
+
+    def compact(self):
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def stamp(self):
+        return None
+
+
+class WriteBehind:
+    # Фоновый сброс отложенных записей: хранилище пишется, когда правки стихли на debounce
+    # секунд, но не позже max_latency после первой несохранённой. Срок хранится для каждого
+    # хранилища; при ошибке запись повторяется через max_latency, изменения остаются в памяти
+    def __init__(self, debounce=WRITE_BEHIND_DEBOUNCE, max_latency=WRITE_BEHIND_MAX_LATENCY):
+        self.debounce = debounce
+        self.max_latency = max(max_latency, debounce)
+        self.dirty = {}
+        self.active = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.failures = 0
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def touch(self, store):
+        now = time.monotonic()
+        with self.condition:
+            first = self.dirty[store][0] if store in self.dirty else now
+            self.dirty[store] = [first, min(now + self.debounce, first + self.max_latency)]
+            self.condition.notify()
+
+    def run(self):
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                ready = [store for store, (_, due) in self.dirty.items() if due <= now]
+                if not ready:
+                    timeout = min((due for _, due in self.dirty.values()), default=None)
+                    self.condition.wait(None if timeout is None else timeout - now)
+                    continue
+                for store in ready:
+                    del self.dirty[store]
+                self.active = ready
+                # Запись идёт без условия, чтобы основной поток не ждал диска в touch()
+                self.condition.release()
+                try:
+                    for store in ready:
+                        self.flush_store(store)
+                finally:
+                    self.condition.acquire()
+                    self.active = []
+                    self.condition.notify_all()
+
+    def flush_store(self, store):
+        try:
+            store.flush(compact=False)
+        except Exception as e:
+            self.failures += 1
+            print(f'Не удалось сохранить изменения в {store.file_path}: {e}; '
+                  f'повтор через {self.max_latency:g} с', file=sys.stderr)
+            now = time.monotonic()
+            with self.condition:
+                self.dirty.setdefault(store, [now, now + self.max_latency])
+                self.condition.notify()
+
+    def close(self):
+        # При выходе фоновый поток останавливается, а остаток пишется здесь же
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush_all()
+
+    def flush_all(self):
+        # Сбрасывает всё сразу в вызывающем потоке, дождавшись записей, начатых фоновым
+        with self.condition:
+            while self.active:
+                self.condition.wait()
+            stores, self.dirty = list(self.dirty), {}
+        for store in stores:
+            try:
+                store.flush(compact=False)
+            except Exception as e:
+                self.failures += 1
+                print(f'Изменения не сохранены в {store.file_path} ({store.deferred_ops} операций): {e}',
+                      file=sys.stderr)
+
+WRITE_BEHIND = None
+
+def parse_write_behind(value):
+    debounce, _, max_latency = value.partition(':')
+    try:
+        debounce = float(debounce)
+        max_latency = float(max_latency) if max_latency else max(WRITE_BEHIND_MAX_LATENCY, debounce)
+    except ValueError:
+        raise ValueError(f'ожидается «пауза[:предел]» в секундах, получено «{value}»')
+    if debounce < 0 or max_latency < 0:
+        raise ValueError('интервалы не могут быть отрицательными')
+    return debounce, max_latency
+
+def exit_on_signal(signum, frame):
+    # SystemExit разворачивает стек и запускает atexit, где отложенные записи сбрасываются
+    raise SystemExit(128 + signum)
+
+def enable_write_behind(debounce=WRITE_BEHIND_DEBOUNCE, max_latency=WRITE_BEHIND_MAX_LATENCY):
+    global WRITE_BEHIND
+    if WRITE_BEHIND is None:
+        WRITE_BEHIND = WriteBehind(debounce, max_latency)
+        atexit.register(WRITE_BEHIND.close)
+        if threading.current_thread() is threading.main_thread():
+            for name in ('SIGTERM', 'SIGHUP'):
+                signum = getattr(signal, name, None)
+                if signum is not None and signal.getsignal(signum) == signal.SIG_DFL:
+                    signal.signal(signum, exit_on_signal)
+    return WRITE_BEHIND
+
+
+def open_store(file_path, schema, dump, columns=None, binary=False, lazy_fields=()):
+    # SQLite в режиме WAL и так не ждёт fsync на каждую правку, отложенная запись — только для журнала
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteStore(file_path, schema, dump, columns, binary)
+    store = JournalStore(file_path, schema, dump, binary, lazy_fields)
+    store.write_behind = WRITE_BEHIND
+    return store
+
+
+def parse_date(value, date_format='%d-%m-%Y'):
+    try:
+        return datetime.datetime.strptime(value, date_format).date()
+    except (TypeError, ValueError):
+        return None
+
+def iso_date(value):
+    date = parse_date(value)
+    return date.isoformat() if date else None
+
+def load_sidecar(file_path, stamp):
+    # Файл-спутник (индекс, агрегаты) годится, только если снят с того же снимка хранилища
+    if stamp is None or not os.path.exists(file_path):
+        return None
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or data.get('stamp') != stamp:
+        return None
+    return data.get('payload')
+
+def save_sidecar(file_path, stamp, payload):
+    if stamp is not None:
+        save_data(file_path, {'stamp': stamp, 'payload': payload}, indent=None)
+
+@contextlib.contextmanager
+def transaction(*managers):
+    # Изменения копятся в памяти и пишутся одной порцией на хранилище при выходе из блока;
+    # при исключении записи отбрасываются, а состояние в памяти перечитывается с диска.
+    # Хранилища блокируются в одном порядке (без взаимных блокировок между процессами),
+    # после чего менеджеры догоняют изменения, сделанные на диске другими процессами
+    started = []
+    try:
+        for manager in sorted(managers, key=lambda manager: manager.store.file_path):
+            nested = manager.store.depth > 0
+            manager.store.begin()
+            started.append((manager, nested))
+        for manager in managers:
+            manager.refresh()
+        yield managers
+    except BaseException:
+        # Вложенный блок откатывается до своей точки сохранения, записи внешнего остаются
+        for manager, nested in started:
+            if nested:
+                entries = manager.store.rollback_savepoint()
+                if entries is not None:
+                    manager.rollback_savepoint(entries)
+            elif manager.store.rollback():
+                manager.rollback_items()
+        raise
+    if not any(manager.store.rollback_only for manager, nested in started if not nested):
+        for manager, _ in started:
+            manager.store.commit()
+        return
+    for manager, nested in started:
+        if nested:
+            manager.store.commit()
+        elif manager.store.rollback():
+            manager.rollback_items()
+    raise ConflictError('вложенный блок отменён после полной перезаписи хранилища, транзакция не сохранена')
+
+def read_csv_rows(file_name, as_dict=True, skip_header=False):
+    with open(file_name, 'r', encoding='utf-8', newline='') as csv_file:
+        reader = csv.DictReader(csv_file) if as_dict else csv.reader(csv_file)
+        if skip_header:
+            next(reader, None)
+        yield from reader
+
+def import_sources(source):
+    # Каталог — все CSV-файлы в нём, иначе шаблон glob. Порядок по имени файла: результат
+    # слияния не зависит от того, какой процесс закончил разбор первым
+    pattern = os.path.join(source, '*.csv') if os.path.isdir(source) else source
+    return sorted(file_name for file_name in glob.glob(pattern) if os.path.isfile(file_name))
+
+def is_import_pattern(source):
+    return os.path.isdir(source) or any(char in source for char in '*?[')
+
+def parse_import_file(convert, file_name):
+    # Выполняется в процессе-обработчике: файл читается и проверяется целиком, наружу
+    # уходят готовые строки записей, ID им выдаёт основной процесс
+    rows = []
+    errors = []
+    line = 0
+    try:
+        for line, row in enumerate(read_csv_rows(file_name), 1):
+            try:
+                rows.append(convert(row, 0).to_row())
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                errors.append((line, str(e)))
+    except (OSError, UnicodeDecodeError, csv.Error) as e:
+        errors.append((line + 1, str(e)))
+    return file_name, rows, errors
+
+def print_import_progress(imported, processed):
+    # Строка прогресса перерисовывается на месте, поэтому выводится только в терминал
+    if sys.stdout.isatty():
+        print(f'\rОбработано строк: {processed}, импортировано: {imported}', end='', flush=True)
+
+@contextlib.contextmanager
+def open_export_target(target, compression=None):
+    # target — имя файла, «-» для stdout или уже открытый файловый объект
+    if isinstance(target, str) and target != '-':
+        if compression is None:
+            compression = EXPORT_COMPRESSION.get(os.path.splitext(target)[1])
+        if compression == 'gzip':
+            stream = gzip.open(target, 'wt', encoding='utf-8', newline='')
+        elif compression == 'xz':
+            stream = lzma.open(target, 'wt', encoding='utf-8', newline='')
+        else:
+            stream = open(target, 'w', encoding='utf-8', newline='')
+        with stream:
+            yield stream
+        return
+    if target is None or target == '-':
+        target = sys.stdout
+    if compression is None:
+        yield target
+        target.flush()
+        return
+    binary = getattr(target, 'buffer', target)
+    if compression == 'gzip':
+        compressor = gzip.GzipFile(fileobj=binary, mode='wb')
+    elif compression == 'xz':
+        compressor = lzma.LZMAFile(binary, 'wb')
+    else:
+        raise ValueError(f'Неизвестный формат сжатия: {compression}')
+    with compressor, io.TextIOWrapper(compressor, encoding='utf-8', newline='') as stream:
+        yield stream
+
+def export_format(target):
+    name = target if isinstance(target, str) else ''
+    for suffix in EXPORT_COMPRESSION:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return 'jsonl' if name.endswith('.jsonl') else 'csv'
+
+def report_import(imported, errors, dedup=None):
+    if sys.stdout.isatty():
+        print()
+    for first_line, last_line, error in errors:
+        print(f'Строки {first_line}–{last_line} не импортированы: {error}')
+    print(f'Импортировано записей: {imported}')
+    if dedup is not None:
+        print(f'Объединено с существующими: {dedup.merged}, пропущено дубликатов: {dedup.skipped}')
+
+
+IMPORT_MODES = ('append', 'skip', 'upsert')
+
+
+class ImportIndex:
+    # Хеш-индекс нормализованных ключей для проверки строк импорта за O(1).
+    # unique: ключ определяет одну запись (контакт), все совпавшие строки сводятся к ней.
+    # Иначе одинаковые ключи бывают у разных записей (две одинаковые покупки в выписке):
+    # каждая существующая запись поглощает не больше одной строки файла
+    def __init__(self, keys, unique=True, mode='skip'):
+        self.keys = keys
+        self.unique = unique
+        self.mode = mode
+        self.targets = {}
+        self.merged = 0
+        self.skipped = 0
+
+    @classmethod
+    def build(cls, items, keys, unique=True, mode='skip'):
+        index = cls(keys, unique, mode)
+        for item in items:
+            index.add(item, item.id)
+        return index
+
+    def add(self, item, target):
+        for key in self.keys(item):
+            if self.unique:
+                self.targets.setdefault(key, target)
+            else:
+                self.targets.setdefault(key, []).append(target)
+
+    def replace(self, item, target):
+        # Новая запись попала в индекс объектом; после сохранения её место занимает ID
+        for key in self.keys(item):
+            if self.targets.get(key) is item:
+                self.targets[key] = target
+
+    def match(self, item):
+        for key in self.keys(item):
+            target = self.targets.get(key)
+            if self.unique and target is not None:
+                return target
+            if not self.unique and target:
+                return target.pop()
+        return None
+
+def write_lines(lines, batch_size=OUTPUT_BATCH_SIZE):
+    # Строки собираются пачками и пишутся одним вызовом на пачку, а не print на каждую запись
+    lines = iter(lines)
+    stream = sys.stdout
+    while True:
+        chunk = list(itertools.islice(lines, batch_size))
+        if not chunk:
+            break
+        stream.write('\n'.join(chunk) + '\n')
+    stream.flush()
+
+
+class Page:
+    # Курсор — пара (значение ключа сортировки, ID) граничной записи: страницы не съезжают,
+    # когда между запросами записи добавляются или удаляются
+    def __init__(self, items, before=None, after=None):
+        self.items = items
+        self.before = before
+        self.after = after
+
+
+TOKEN_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'"([^"]*)"|(\S+)')
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_EXPANSION_LIMIT = 64
+
+def tokenize(text):
+    # casefold приводит регистр и для кириллицы, «ё» ищется как «е»
+    return TOKEN_RE.findall((text or '').casefold().replace('ё', 'е'))
+
+def parse_query(query):
+    clauses = []
+    for phrase, word in QUERY_RE.findall(query):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) > 1:
+                clauses.append(('phrase', terms))
+            elif terms:
+                clauses.append(('term', terms[0]))
+            continue
+        terms = tokenize(word)
+        if not terms:
+            continue
+        if word.endswith('*'):
+            clauses.extend(('term', term) for term in terms[:-1])
+            clauses.append(('prefix', terms[-1]))
+        else:
+            clauses.extend(('term', term) for term in terms)
+    return clauses
+
+
+class NoteIndex:
+    # Индекс, прочитанный с диска, лежит в source: постинг термина и сведения о заметке
+    # разбираются при первом обращении. Изменения после загрузки до этого копятся рядом:
+    # removed — заметки из source, которые удалены или заменены, added — новые вхождения
+    def __init__(self, source=None):
+        self.source = source
+        self.postings = {}
+        self.docs = {}
+        self.terms = []
+        self.removed = set()
+        self.added = {}
+        self.doc_count = source.doc_count if source is not None else 0
+        self.total_length = source.total_length if source is not None else 0
+
+    def posting(self, term):
+        posting = self.postings.get(term)
+        if posting is None and self.source is not None:
+            posting = self.source.posting(term)
+            added = self.added.pop(term, None)
+            if posting is None and added is None:
+                return None
+            posting = posting or {}
+            for note_id in self.removed.intersection(posting):
+                del posting[note_id]
+            posting.update(added or ())
+            self.postings[term] = posting
+        return posting
+
+    def doc(self, note_id):
+        if note_id in self.docs:
+            return self.docs[note_id]
+        return self.source.doc(note_id) if self.source is not None else None
+
+    def doc_lengths(self, note_id):
+        if note_id in self.docs or self.source is None:
+            return self.docs[note_id][:2]
+        return self.source.doc_lengths()[note_id]
+
+    def add(self, note_id, title, content):
+        self.remove(note_id)
+        title_tokens = tokenize(title)
+        positions = {}
+        for position, term in enumerate(title_tokens):
+            positions.setdefault(term, []).append(position)
+        # Разрыв в одну позицию, чтобы фраза не склеивала заголовок с текстом
+        content_tokens = tokenize(content)
+        for position, term in enumerate(content_tokens, len(title_tokens) + 1):
+            positions.setdefault(term, []).append(position)
+        for term, term_positions in positions.items():
+            posting = self.postings.get(term)
+            if posting is None and self.source is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            elif posting is None:
+                # Постинг с диска ради добавления не разбирается
+                if term not in self.added and self.source.find(term) is None:
+                    bisect.insort(self.terms, term)
+                posting = self.added.setdefault(term, {})
+            posting[note_id] = term_positions
+        length = len(title_tokens) + len(content_tokens)
+        self.docs[note_id] = (length, len(title_tokens), list(positions))
+        self.doc_count += 1
+        self.total_length += length
+
+    def remove(self, note_id):
+        doc = self.doc(note_id)
+        if doc is None:
+            return
+        # Заметку из source закрывает None; опустевший постинг термина из source остаётся пустым
+        if self.source is None:
+            del self.docs[note_id]
+        else:
+            if note_id not in self.docs:
+                self.removed.add(note_id)
+            self.docs[note_id] = None
+        self.doc_count -= 1
+        self.total_length -= doc[0]
+        for term in doc[2]:
+            posting = self.postings.get(term)
+            if posting is None:
+                # Вхождения из source отфильтруются по removed при разборе постинга
+                posting = self.added.get(term, {})
+            posting.pop(note_id, None)
+            if not posting and self.source is None:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def expand(self, prefix):
+        start = bisect.bisect_left(self.terms, prefix)
+        end = bisect.bisect_left(self.terms, prefix + '\U0010ffff')
+        if self.source is None:
+            return self.terms[start:min(end, start + PREFIX_EXPANSION_LIMIT)]
+        terms = heapq.merge(self.terms[start:end], self.source.expand(prefix))
+        return list(itertools.islice((term for term, _ in itertools.groupby(terms) if self.posting(term)),
+                                     PREFIX_EXPANSION_LIMIT))
+
+    def all_terms(self):
+        terms = self.terms if self.source is None else heapq.merge(self.terms, self.source.expand(''))
+        return [term for term, _ in itertools.groupby(terms) if self.posting_size(term)]
+
+    def posting_size(self, term):
+        # Число заметок с термином; постинг с диска разбирается, только если его меняли
+        if term in self.postings:
+            return len(self.postings[term])
+        if self.source is None:
+            return 0
+        if self.removed or term in self.added:
+            return len(self.posting(term) or ())
+        return self.source.posting_size(term)
+
+    def _score(self, term, scores, only=None):
+        posting = self.posting(term)
+        if not posting:
+            return
+        idf = math.log(1 + (self.doc_count - len(posting) + 0.5) / (len(posting) + 0.5))
+        average = self.total_length / self.doc_count
+        candidates = posting if only is None or len(posting) <= len(only) else only
+        for note_id in candidates:
+            positions = posting.get(note_id)
+            if positions is None or (only is not None and note_id not in only):
+                continue
+            length, title_length = self.doc_lengths(note_id)
+            # Вхождения в заголовок весят вдвое больше
+            frequency = len(positions) + sum(1 for position in positions if position < title_length)
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+            scores[note_id] = scores.get(note_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+    def _phrase(self, terms):
+        postings = [self.posting(term) for term in terms]
+        if not all(postings):
+            return set()
+        matched = set()
+        for note_id in set.intersection(*(set(posting) for posting in postings)):
+            starts = set(postings[0][note_id])
+            for offset, posting in enumerate(postings[1:], 1):
+                starts &= {position - offset for position in posting[note_id]}
+                if not starts:
+                    break
+            if starts:
+                matched.add(note_id)
+        return matched
+
+    def search(self, query, limit=10):
+        clauses = parse_query(query)
+        if not clauses or not self.doc_count:
+            return []
+        # Все условия запроса обязательны, ранжирование — по сумме BM25
+        matched = None
+        clause_terms = []
+        for kind, value in clauses:
+            if kind == 'phrase':
+                found = self._phrase(value)
+                terms = value
+            elif kind == 'prefix':
+                terms = self.expand(value)
+                found = set().union(*(self.posting(term) for term in terms))
+            else:
+                terms = [value]
+                found = set(self.posting(value) or ())
+            matched = found if matched is None else matched & found
+            if not matched:
+                return []
+            clause_terms.extend(terms)
+        scores = {}
+        for term in clause_terms:
+            self._score(term, scores, matched)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+
+    def iter_docs(self):
+        # (ID, длина, длина заголовка, термины) по возрастанию ID; термины из source — номерами в нём
+        overlay = sorted((note_id, doc) for note_id, doc in self.docs.items() if doc is not None)
+        source_docs = ()
+        if self.source is not None:
+            source_docs = ((note_id, doc) for note_id, doc in self.source.docs() if note_id not in self.docs)
+        return heapq.merge(overlay, source_docs, key=operator.itemgetter(0))
+
+
+def write_index(file_path, stamp, index):
+    # Формат: сигнатура, заголовок JSON, таблица заметок, номера их терминов, таблица терминов
+    # по алфавиту, строки терминов и постинги. Постинг — ID заметок, число позиций в каждой и сами
+    # позиции подряд; постинги, не менявшиеся после чтения, копируются из прежнего файла как есть
+    source = index.source
+    terms = index.all_terms()
+    numbers = {term: number for number, term in enumerate(terms)}
+    if source is not None:
+        renumber = array.array('i', [numbers.get(term, -1) for term in source.expand('')])
+    doc_table = bytearray()
+    doc_terms = array.array('i')
+    for note_id, (length, title_length, doc_term_list) in index.iter_docs():
+        start = len(doc_terms)
+        if type(doc_term_list) is array.array:
+            doc_terms.extend(map(renumber.__getitem__, doc_term_list))
+        else:
+            doc_terms.extend(map(numbers.__getitem__, doc_term_list))
+        doc_table += INDEX_DOC.pack(note_id, length, title_length, start, len(doc_terms) - start)
+    term_table = bytearray()
+    term_blob = bytearray()
+    postings = bytearray()
+    for term in terms:
+        data = term.encode('utf-8')
+        posting = index.postings.get(term)
+        if posting is None:
+            chunk, doc_count, position_count = source.raw_posting(term)
+        else:
+            counts = array.array('i', map(len, posting.values()))
+            positions = array.array('i', itertools.chain.from_iterable(posting.values()))
+            chunk = array.array('q', posting).tobytes() + counts.tobytes() + positions.tobytes()
+            doc_count, position_count = len(counts), len(positions)
+        term_table += INDEX_TERM.pack(len(term_blob), len(data), len(postings), doc_count, position_count)
+        term_blob += data
+        postings += chunk
+    header = json.dumps({'stamp': stamp, 'byteorder': sys.byteorder, 'docs': len(doc_table) // INDEX_DOC.size,
+                         'doc_terms': len(doc_terms), 'terms': len(terms), 'term_bytes': len(term_blob),
+                         'total_length': index.total_length}).encode('utf-8')
+    with replace_file(file_path, binary=True) as f:
+        f.write(INDEX_MAGIC + struct.pack('<I', len(header)) + header)
+        f.write(doc_table)
+        f.write(doc_terms.tobytes())
+        f.write(term_table)
+        f.write(term_blob)
+        f.write(postings)
+
+
+class IndexFile:
+    # Сохранённый индекс заметок через mmap: термин и заметка ищутся двоичным поиском по таблицам,
+    # в память попадают только постинги терминов из запросов
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header_start = len(INDEX_MAGIC) + 4
+        header_size, = struct.unpack_from('<I', self.buffer, len(INDEX_MAGIC))
+        self.header = json.loads(self.buffer[header_start:header_start + header_size])
+        self.doc_count = self.header['docs']
+        self.term_count = self.header['terms']
+        self.total_length = self.header['total_length']
+        self.docs_start = header_start + header_size
+        self.doc_terms_start = self.docs_start + self.doc_count * INDEX_DOC.size
+        self.terms_start = self.doc_terms_start + self.header['doc_terms'] * 4
+        self.term_bytes_start = self.terms_start + self.term_count * INDEX_TERM.size
+        self.postings_start = self.term_bytes_start + self.header['term_bytes']
+        self.lengths = None
+
+    @classmethod
+    def open(cls, file_path, stamp):
+        # Годится только индекс с того же снимка и с тем же порядком байт
+        if stamp is None or not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, 'rb') as f:
+                if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                    return None
+            index = cls(file_path)
+        except (OSError, ValueError, struct.error):
+            return None
+        if index.header.get('stamp') != stamp or index.header.get('byteorder') != sys.byteorder:
+            return None
+        return index
+
+    def term(self, number):
+        start, length = struct.unpack_from('<qi', self.buffer, self.terms_start + number * INDEX_TERM.size)
+        start += self.term_bytes_start
+        return self.buffer[start:start + length].decode('utf-8')
+
+    def find(self, term):
+        number = bisect.bisect_left(range(self.term_count), term, key=self.term)
+        if number < self.term_count and self.term(number) == term:
+            return number
+        return None
+
+    def expand(self, prefix):
+        number = bisect.bisect_left(range(self.term_count), prefix, key=self.term)
+        while number < self.term_count:
+            term = self.term(number)
+            if not term.startswith(prefix):
+                return
+            yield term
+            number += 1
+
+    def raw_posting(self, term):
+        # Постинг байтами, число заметок и позиций в нём; None, если термина нет
+        number = self.find(term)
+        if number is None:
+            return None
+        _, _, offset, doc_count, position_count = INDEX_TERM.unpack_from(
+            self.buffer, self.terms_start + number * INDEX_TERM.size)
+        start = self.postings_start + offset
+        return self.buffer[start:start + 12 * doc_count + 4 * position_count], doc_count, position_count
+
+    def posting_size(self, term):
+        number = self.find(term)
+        if number is None:
+            return 0
+        return INDEX_TERM.unpack_from(self.buffer, self.terms_start + number * INDEX_TERM.size)[3]
+
+    def posting(self, term):
+        raw = self.raw_posting(term)
+        if raw is None:
+            return None
+        chunk, doc_count, _ = raw
+        ids = array.array('q', chunk[:8 * doc_count])
+        counts = array.array('i', chunk[8 * doc_count:12 * doc_count])
+        positions = array.array('i', chunk[12 * doc_count:]).tolist()
+        posting = {}
+        start = 0
+        for note_id, count in zip(ids, counts):
+            posting[note_id] = positions[start:start + count]
+            start += count
+        return posting
+
+    def doc_id(self, position):
+        return struct.unpack_from('<q', self.buffer, self.docs_start + position * INDEX_DOC.size)[0]
+
+    def doc_terms(self, start, count):
+        start = self.doc_terms_start + 4 * start
+        return array.array('i', self.buffer[start:start + 4 * count])
+
+    def doc(self, note_id):
+        position = bisect.bisect_left(range(self.doc_count), note_id, key=self.doc_id)
+        if position == self.doc_count:
+            return None
+        found_id, length, title_length, start, count = INDEX_DOC.unpack_from(
+            self.buffer, self.docs_start + position * INDEX_DOC.size)
+        if found_id != note_id:
+            return None
+        return length, title_length, [self.term(number) for number in self.doc_terms(start, count)]
+
+    def doc_lengths(self):
+        # Длины всех заметок нужны ранжированию сразу: таблица читается целиком один раз
+        if self.lengths is None:
+            table = memoryview(self.buffer)[self.docs_start:self.doc_terms_start]
+            self.lengths = {note_id: (length, title_length)
+                            for note_id, length, title_length, _, _ in INDEX_DOC.iter_unpack(table)}
+        return self.lengths
+
+    def docs(self):
+        # Термины заметок отдаются номерами в этом файле: так их дешевле перенумеровать при записи
+        table = memoryview(self.buffer)[self.docs_start:self.doc_terms_start]
+        for note_id, length, title_length, start, count in INDEX_DOC.iter_unpack(table):
+            yield note_id, (length, title_length, self.doc_terms(start, count))
+
+
+CONTACT_SEARCH_LIMIT = 50
+NGRAM_SIZE = 3
+PHONE_QUERY_RE = re.compile(r'^[\d\s()+\-]*\d[\d\s()+\-]*$')
+
+def normalize_phone(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    # Российские номера через «8» хранятся в том же виде, что и через «+7»
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    return digits
+
+def phone_prefixes(query):
+    digits = re.sub(r'\D', '', query)
+    prefixes = [digits]
+    # Номер без кода страны или через «8» ищем и в виде «7…»
+    if digits.startswith('8'):
+        prefixes.append('7' + digits[1:])
+    elif not digits.startswith('7'):
+        prefixes.append('7' + digits)
+    return prefixes
+
+def e164_phone(phone):
+    # +<код страны><номер>; десятизначный номер без кода считается российским
+    digits = normalize_phone(phone)
+    if len(digits) == 10:
+        digits = '7' + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return '+' + digits
+
+def ngrams(text):
+    return {text[start:start + size]
+            for size in range(1, NGRAM_SIZE + 1)
+            for start in range(len(text) - size + 1)}
+
+
+class PhoneTrie:
+    def __init__(self):
+        self.root = {}
+
+    def add(self, digits, contact_id):
+        node = self.root
+        for digit in digits:
+            node = node.setdefault(digit, {})
+        node.setdefault('', set()).add(contact_id)
+
+    def remove(self, digits, contact_id):
+        path = [self.root]
+        for digit in digits:
+            node = path[-1].get(digit)
+            if node is None:
+                return
+            path.append(node)
+        ids = path[-1].get('')
+        if ids is None:
+            return
+        ids.discard(contact_id)
+        if not ids:
+            del path[-1]['']
+        # Убираем опустевшие ветки снизу вверх
+        for depth in range(len(digits), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][digits[depth - 1]]
+
+    def find(self, prefix, limit):
+        node = self.root
+        for digit in prefix:
+            node = node.get(digit)
+            if node is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            found.extend(sorted(node.get('', ())))
+            stack.extend(node[digit] for digit in sorted(node, reverse=True) if digit)
+        return found[:limit]
+
+
+class ContactIndex:
+    def __init__(self):
+        self.grams = {}
+        self.docs = {}
+        self.phones = PhoneTrie()
+
+    def add(self, contact_id, name, phone, email):
+        self.remove(contact_id)
+        texts = ((name or '').casefold(), (email or '').casefold())
+        grams = ngrams(texts[0]) | ngrams(texts[1])
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(contact_id)
+        digits = normalize_phone(phone)
+        if digits:
+            self.phones.add(digits, contact_id)
+        self.docs[contact_id] = (texts, digits, grams)
+
+    def remove(self, contact_id):
+        doc = self.docs.pop(contact_id, None)
+        if doc is None:
+            return
+        texts, digits, grams = doc
+        for gram in grams:
+            ids = self.grams[gram]
+            ids.discard(contact_id)
+            if not ids:
+                del self.grams[gram]
+        if digits:
+            self.phones.remove(digits, contact_id)
+
+    def find_text(self, query, limit):
+        query = query.casefold()
+        if not query:
+            return []
+        grams = [query[start:start + NGRAM_SIZE] for start in range(max(len(query) - NGRAM_SIZE + 1, 1))]
+        postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        found = []
+        # Пересечение n-грамм может дать ложные совпадения — проверяем подстрокой
+        for contact_id in sorted(candidates):
+            texts = self.docs[contact_id][0]
+            if len(query) <= NGRAM_SIZE or query in texts[0] or query in texts[1]:
+                found.append(contact_id)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def find_phone(self, query, limit):
+        found = []
+        for prefix in phone_prefixes(query):
+            found += [contact_id for contact_id in self.phones.find(prefix, limit) if contact_id not in found]
+        return found[:limit]
+
+    def search(self, query, limit=CONTACT_SEARCH_LIMIT):
+        found = self.find_text(query, limit)
+        if PHONE_QUERY_RE.match(query):
+            found += [contact_id for contact_id in self.find_phone(query, limit) if contact_id not in found]
+        return found[:limit]
+
+
+class Record:
+    # Запись хранится строкой значений в порядке fields: так она пишется на диск и так
+    # из неё создаётся объект. Общий ключ всех записей — id; старые файлы хранили его
+    # под именем legacy_key (note_id, task_id, ...)
+    __slots__ = ()
+    fields = ()
+    legacy_key = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.row_getter = operator.attrgetter(*cls.fields)
+        cls.defaults = {name: parameter.default for name, parameter in inspect.signature(cls).parameters.items()
+                        if parameter.default is not parameter.empty}
+
+    def to_row(self):
+        return self.row_getter(self)
+
+    def to_dict(self):
+        return dict(zip(self.fields, self.row_getter(self)))
+
+    def assign(self, row):
+        for name, value in zip(self.fields, row):
+            setattr(self, name, value)
+
+    @classmethod
+    def row_from_dict(cls, data):
+        if 'id' not in data and cls.legacy_key in data:
+            data = dict(data, id=data[cls.legacy_key])
+        return [data.get(name, cls.defaults.get(name)) for name in cls.fields]
+
+    @classmethod
+    def convert_rows(cls, fields, rows):
+        # Строки из файла с другим набором полей переставляются по именам
+        if tuple(fields) == cls.fields:
+            return rows
+        return [cls.row_from_dict(dict(zip(fields, row))) for row in rows]
+
+class Note(Record):
+    fields = ('id', 'title', 'content', 'timestamp', 'version')
+    __slots__ = ('id', 'title', '_content', 'timestamp', 'version')
+    legacy_key = 'note_id'
+
+    def __init__(self, id, title, content, timestamp, version=0):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.timestamp = timestamp
+        self.version = version
+
+    @property
+    def content(self):
+        # Текст из двоичного снимка декодируется при первом обращении
+        if type(self._content) is LazyText:
+            self._content = self._content.decode()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+class Task(Record):
+    fields = __slots__ = ('id', 'title', 'description', 'done', 'priority', 'due_date', 'version')
+    legacy_key = 'task_id'
+
+    def __init__(self, id, title, description, done=False, priority="Низкий", due_date=None, version=0):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.done = done
+        self.priority = priority
+        self.due_date = due_date
+        self.version = version
+
+class Contact(Record):
+    fields = __slots__ = ('id', 'name', 'phone', 'email', 'version')
+    legacy_key = 'contact_id'
+
+    def __init__(self, id, name, phone=None, email=None, version=0):
+        self.id = id
+        self.name = name
+        self.phone = phone
+        self.email = email
+        self.version = version
+
+class FinanceRecord(Record):
+    fields = __slots__ = ('id', 'amount', 'category', 'date', 'description', 'version')
+    legacy_key = 'record_id'
+
+    def __init__(self, id, amount, category, date=None, description=None, version=0):
+        self.id = id
+        self.amount = amount
+        self.category = category
+        self.date = date or datetime.datetime.now().strftime("%d-%m-%Y")
+        self.description = description
+        self.version = version
+
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_ordinal(value):
+    date = parse_date(value)
+    return date.toordinal() if date else 0
+
+def timestamp_key(value):
+    # «ДД-ММ-ГГГГ ЧЧ:ММ:СС» в виде строки, которая сортируется по времени
+    value = value or ''
+    return value[6:10] + value[3:5] + value[0:2] + value[10:]
+
+@functools.lru_cache(maxsize=65536)
+def format_ordinal(ordinal):
+    return datetime.date.fromordinal(ordinal).strftime('%d-%m-%Y')
+
+
+class FinanceLedger:
+    def __init__(self, rows=()):
+        self.ids = array.array('q')
+        self.dates = array.array('q')
+        self.amounts = array.array('d')
+        self.category_codes = array.array('i')
+        self.categories = []
+        self.category_lookup = {}
+        self.descriptions = []
+        self.versions = array.array('q')
+        # Даты, которые не удалось разобрать, хранятся как есть (в колонке — 0)
+        self.raw_dates = {}
+        for row in sorted(rows, key=operator.itemgetter(0)):
+            self.insert(len(self.ids), *row)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (self.record(position) for position in range(len(self.ids)))
+
+    def category_code(self, category):
+        code = self.category_lookup.get(category)
+        if code is None:
+            code = self.category_lookup[category] = len(self.categories)
+            self.categories.append(category)
+        return code
+
+    def date_ordinal(self, record_id, date):
+        ordinal = parse_ordinal(date) if isinstance(date, str) else 0
+        if ordinal == 0:
+            self.raw_dates[record_id] = date
+        elif self.raw_dates:
+            self.raw_dates.pop(record_id, None)
+        return ordinal
+
+    def date_text(self, position):
+        ordinal = self.dates[position]
+        if ordinal == 0:
+            return self.raw_dates.get(self.ids[position])
+        return format_ordinal(ordinal)
+
+    def record(self, position):
+        return FinanceRecord(self.ids[position], self.amounts[position],
+                             self.categories[self.category_codes[position]],
+                             self.date_text(position), self.descriptions[position], self.versions[position])
+
+    def rows(self):
+        categories = self.categories
+        for position in range(len(self.ids)):
+            yield (self.ids[position], self.amounts[position], categories[self.category_codes[position]],
+                   self.date_text(position), self.descriptions[position], self.versions[position])
+
+    def position(self, record_id):
+        position = bisect.bisect_left(self.ids, record_id)
+        if position < len(self.ids) and self.ids[position] == record_id:
+            return position
+        return None
+
+    def get(self, record_id):
+        position = self.position(record_id)
+        return None if position is None else self.record(position)
+
+    def max_id(self):
+        return self.ids[-1] if self.ids else 0
+
+    def append(self, record):
+        # ID выдаются по возрастанию, поэтому колонка ids остаётся отсортированной
+        position = len(self.ids)
+        if self.ids and record.id < self.ids[-1]:
+            position = bisect.bisect_left(self.ids, record.id)
+        self.insert(position, *record.to_row())
+
+    def insert(self, position, record_id, amount, category, date, description, version):
+        self.ids.insert(position, record_id)
+        self.dates.insert(position, self.date_ordinal(record_id, date))
+        self.amounts.insert(position, float(amount))
+        self.category_codes.insert(position, self.category_code(category))
+        self.descriptions.insert(position, description)
+        self.versions.insert(position, version)
+
+    def update(self, record):
+        position = self.position(record.id)
+        self.dates[position] = self.date_ordinal(record.id, record.date)
+        self.amounts[position] = float(record.amount)
+        self.category_codes[position] = self.category_code(record.category)
+        self.descriptions[position] = record.description
+        self.versions[position] = record.version
+
+    def remove(self, record_id):
+        position = self.position(record_id)
+        del self.ids[position]
+        del self.dates[position]
+        del self.amounts[position]
+        del self.category_codes[position]
+        del self.descriptions[position]
+        del self.versions[position]
+        self.raw_dates.pop(record_id, None)
+
+    def positions_between(self, start_ordinal, end_ordinal):
+        if numpy is not None:
+            dates = numpy.frombuffer(self.dates, dtype=numpy.int64)
+            return numpy.flatnonzero((dates >= start_ordinal) & (dates <= end_ordinal)).tolist()
+        return [position for position, ordinal in enumerate(self.dates) if start_ordinal <= ordinal <= end_ordinal]
+
+    def expression_columns(self, names):
+        # Копии колонок для векторных выражений; строятся только упомянутые в выражении
+        columns = {}
+        dates = numpy.frombuffer(self.dates, dtype=numpy.int64).copy()
+        for name in names:
+            if name == 'id':
+                columns[name] = numpy.frombuffer(self.ids, dtype=numpy.int64).copy()
+            elif name == 'amount':
+                columns[name] = numpy.frombuffer(self.amounts, dtype=numpy.float64).copy()
+            elif name == 'category':
+                codes = numpy.frombuffer(self.category_codes, dtype=numpy.intc)
+                columns[name] = numpy.array(self.categories, dtype=object)[codes]
+            elif name == 'date':
+                columns[name] = dates
+            elif name == 'description':
+                columns[name] = numpy.array(self.descriptions, dtype=object)
+            elif name in ('year', 'month'):
+                days = (dates - EPOCH_ORDINAL).astype('datetime64[D]')
+                if name == 'year':
+                    columns[name] = days.astype('datetime64[Y]').astype(numpy.int64) + 1970
+                else:
+                    columns[name] = days.astype('datetime64[M]').astype(numpy.int64) % 12 + 1
+        return columns
+
+    def expression_rows(self, names):
+        # Те же переменные по одной записи, когда numpy нет
+        calendar = 'year' in names or 'month' in names
+        for position in range(len(self.ids)):
+            ordinal = self.dates[position]
+            row = {'id': self.ids[position], 'amount': self.amounts[position],
+                   'category': self.categories[self.category_codes[position]], 'date': ordinal,
+                   'description': self.descriptions[position]}
+            if calendar:
+                date = datetime.date.fromordinal(ordinal) if ordinal else None
+                row['year'] = date.year if date else 0
+                row['month'] = date.month if date else 0
+            yield row
+
+    def report_rows(self, positions):
+        categories = self.categories
+        for position in positions:
+            yield (self.ids[position], self.date_text(position), self.amounts[position],
+                   categories[self.category_codes[position]], self.descriptions[position])
+
+
+DAILY_TOTALS_MARGIN = 366
+# Деревья покрывают только дни из этого окна: опечатка вроде 01-01-0001 не растягивает массивы
+# на тысячелетия, а попадает в словарь редких дат рядом с деревьями
+DAILY_TOTALS_FIRST = datetime.date(1900, 1, 1).toordinal()
+DAILY_TOTALS_LAST = datetime.date(2200, 12, 31).toordinal()
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class DailyTotals:
+    # Деревья Фенвика по дням: доходы, расходы и число записей
+    def __init__(self, base=0, size=0, outliers=None):
+        self.base = base
+        self.size = size
+        self.trees = [array.array('d', bytes(8 * (size + 1))) for _ in range(3)]
+        self.outliers = outliers or {}
+
+    @classmethod
+    def build(cls, dates, amounts):
+        days = {}
+        for ordinal, amount in zip(dates, amounts):
+            if ordinal:
+                day = days.setdefault(ordinal, [0.0, 0.0, 0.0])
+                if amount > 0:
+                    day[0] += amount
+                elif amount < 0:
+                    day[1] += amount
+                day[2] += 1
+        return cls.from_days(days)
+
+    @classmethod
+    def from_days(cls, days, extra=()):
+        outliers = {ordinal: values for ordinal, values in days.items()
+                    if not DAILY_TOTALS_FIRST <= ordinal <= DAILY_TOTALS_LAST}
+        ordinals = [ordinal for ordinal in itertools.chain(days, extra)
+                    if DAILY_TOTALS_FIRST <= ordinal <= DAILY_TOTALS_LAST]
+        if not ordinals:
+            return cls(outliers=outliers)
+        base = max(min(ordinals) - DAILY_TOTALS_MARGIN, DAILY_TOTALS_FIRST)
+        totals = cls(base, min(max(ordinals) + DAILY_TOTALS_MARGIN, DAILY_TOTALS_LAST) - base + 1, outliers)
+        for ordinal, values in days.items():
+            if ordinal not in outliers:
+                for tree, value in zip(totals.trees, values):
+                    tree[ordinal - base + 1] = value
+        # Построение за O(n): каждый узел передаёт сумму родителю
+        for tree in totals.trees:
+            for i in range(1, totals.size + 1):
+                parent = i + (i & -i)
+                if parent <= totals.size:
+                    tree[parent] += tree[i]
+        return totals
+
+    def days(self):
+        days = dict(self.outliers)
+        previous = [0.0, 0.0, 0.0]
+        for i in range(1, self.size + 1):
+            current = self.prefix(self.base + i - 1)
+            values = [now - before for now, before in zip(current, previous)]
+            if values[2]:
+                days[self.base + i - 1] = values
+            previous = current
+        return days
+
+    def add(self, ordinal, amount, sign=1):
+        if not ordinal:
+            return
+        values = (sign * amount if amount > 0 else 0.0, sign * amount if amount < 0 else 0.0, sign)
+        if not DAILY_TOTALS_FIRST <= ordinal <= DAILY_TOTALS_LAST:
+            day = self.outliers.setdefault(ordinal, [0.0, 0.0, 0.0])
+            for k, value in enumerate(values):
+                day[k] += value
+            if not day[2]:
+                del self.outliers[ordinal]
+            return
+        if not self.base <= ordinal < self.base + self.size:
+            grown = DailyTotals.from_days(self.days(), [ordinal])
+            self.base, self.size, self.trees = grown.base, grown.size, grown.trees
+        i = ordinal - self.base + 1
+        while i <= self.size:
+            for tree, value in zip(self.trees, values):
+                tree[i] += value
+            i += i & -i
+
+    def prefix(self, ordinal):
+        totals = [0.0, 0.0, 0.0]
+        i = min(ordinal - self.base + 1, self.size)
+        while i > 0:
+            for k, tree in enumerate(self.trees):
+                totals[k] += tree[i]
+            i -= i & -i
+        return totals
+
+    def between(self, start_ordinal, end_ordinal):
+        if end_ordinal < start_ordinal:
+            return 0.0, 0.0, 0
+        high = self.prefix(end_ordinal)
+        low = self.prefix(start_ordinal - 1)
+        for ordinal, values in self.outliers.items():
+            if start_ordinal <= ordinal <= end_ordinal:
+                for k, value in enumerate(values):
+                    high[k] += value
+        return high[0] - low[0], high[1] - low[1], round(high[2] - low[2])
+
+    def to_json(self):
+        return {'base': self.base, 'size': self.size, 'trees': [tree.tolist() for tree in self.trees],
+                'outliers': [[ordinal] + values for ordinal, values in self.outliers.items()]}
+
+    @classmethod
+    def from_json(cls, data):
+        outliers = {row[0]: row[1:] for row in data.get('outliers', ())}
+        totals = cls(data['base'], data['size'], outliers)
+        totals.trees = [array.array('d', tree) for tree in data['trees']]
+        return totals
+
+
+PRIORITY_RANKS = {'высокий': 0, 'средний': 1, 'низкий': 2}
+# Ключ повестки — срок, приоритет и ID в одном int64: порядковый номер любой даты до 31-12-9999
+# занимает не больше 22 бит, на приоритет 2 бита, на ID остаётся 39
+AGENDA_DAY_BITS = 22
+AGENDA_ID_BITS = 39
+AGENDA_MAX_ORDINAL = (1 << AGENDA_DAY_BITS) - 1
+
+def priority_rank(priority):
+    # Неизвестный приоритет идёт после «Низкого»
+    return PRIORITY_RANKS.get((priority or '').strip().lower(), len(PRIORITY_RANKS))
+
+
+class TaskAgenda:
+    # Невыполненные задачи со сроком в отсортированном массиве ключей: порядок ключей —
+    # это порядок «срок, приоритет, ID», поэтому запросы по датам — срезы по bisect.
+    # ID, не влезающий в int64, переводит повестку на список обычных int с широким полем ID
+    def __init__(self):
+        self.keys = array.array('q')
+        self.by_id = {}
+        self.id_bits = AGENDA_ID_BITS
+
+    @classmethod
+    def build(cls, tasks):
+        agenda = cls()
+        for task in tasks:
+            if task.id >> agenda.id_bits:
+                agenda.widen(task.id)
+            key = agenda.task_key(task)
+            if key is not None:
+                agenda.by_id[task.id] = key
+        keys = sorted(agenda.by_id.values())
+        agenda.keys = array.array('q', keys) if agenda.id_bits == AGENDA_ID_BITS else keys
+        return agenda
+
+    def task_key(self, task):
+        if task.done:
+            return None
+        ordinal = parse_ordinal(task.due_date) if isinstance(task.due_date, str) else 0
+        if not ordinal:
+            return None
+        return (((ordinal << 2) | priority_rank(task.priority)) << self.id_bits) | task.id
+
+    def widen(self, task_id):
+        id_bits = max(task_id.bit_length(), 64)
+        self.by_id = {key_id: (((key >> self.id_bits) << id_bits) | key_id) for key_id, key in self.by_id.items()}
+        self.keys = [((key >> self.id_bits) << id_bits) | self.key_id(key) for key in self.keys]
+        self.id_bits = id_bits
+
+    def key_id(self, key):
+        return key & ((1 << self.id_bits) - 1)
+
+    def key_rank(self, key):
+        return (key >> self.id_bits) & 3
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, task):
+        if task.id >> self.id_bits:
+            self.widen(task.id)
+        key = self.task_key(task)
+        if self.by_id.get(task.id) == key:
+            return
+        self.remove(task.id)
+        if key is not None:
+            self.by_id[task.id] = key
+            self.keys.insert(bisect.bisect_left(self.keys, key), key)
+
+    def remove(self, task_id):
+        key = self.by_id.pop(task_id, None)
+        if key is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def position(self, ordinal):
+        # Граница за последней представимой датой — конец массива
+        if ordinal > AGENDA_MAX_ORDINAL:
+            return len(self.keys)
+        return bisect.bisect_left(self.keys, ordinal << (self.id_bits + 2))
+
+    def before(self, ordinal):
+        return list(map(self.key_id, self.keys[:self.position(ordinal)]))
+
+    def upcoming(self, ordinal, limit):
+        start = self.position(ordinal)
+        return list(map(self.key_id, self.keys[start:start + limit]))
+
+    def between(self, start_ordinal, end_ordinal):
+        # Сортируется только окно, а не весь список: сначала приоритет, затем срок
+        window = self.keys[self.position(start_ordinal):self.position(end_ordinal + 1)]
+        return [self.key_id(key) for key in sorted(window, key=lambda key: (self.key_rank(key), key))]
+
+
+EXPRESSION_CACHE_SIZE = 256
+EXPRESSION_MAX_EXPONENT = 10000
+# Около 4000 десятичных знаков: больше Python не переводит в строку, а считать такое долго
+EXPRESSION_MAX_BITS = 13000
+FINANCE_EXPRESSION_COLUMNS = ('id', 'amount', 'category', 'date', 'description', 'year', 'month')
+
+
+class ExpressionError(Exception):
+    pass
+
+
+def expression_power(base, exponent):
+    # Целые числа в Python не ограничены: 9 ** 9 ** 9 считалось бы часами. Размер результата
+    # оценивается по основанию и степени, так что вложенные степени тоже не проходят.
+    # Массивы numpy фиксированной ширины переполняются быстро, им ограничение не нужно
+    if numpy is not None and (isinstance(base, numpy.ndarray) or isinstance(exponent, numpy.ndarray)):
+        return numpy.power(base, exponent)
+    if isinstance(exponent, int) and abs(exponent) > EXPRESSION_MAX_EXPONENT:
+        raise ExpressionError('слишком большая степень')
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 and \
+            (abs(base).bit_length() - 1) * exponent > EXPRESSION_MAX_BITS:
+        raise ExpressionError('слишком большой результат')
+    return operator.pow(base, exponent)
+
+def expression_check_operands(left, right):
+    # Строки (и массивы строк в векторном режиме) не умножаются и не форматируются через %:
+    # "x" * 10 ** 9 заняло бы гигабайты
+    for value in (left, right):
+        if isinstance(value, (str, bytes)) or getattr(getattr(value, 'dtype', None), 'kind', '') in ('O', 'U', 'S'):
+            raise ExpressionError('недопустимая операция со строкой')
+
+def expression_multiply(left, right):
+    expression_check_operands(left, right)
+    if isinstance(left, int) and isinstance(right, int) and \
+            left.bit_length() + right.bit_length() > EXPRESSION_MAX_BITS:
+        raise ExpressionError('слишком большой результат')
+    return left * right
+
+def expression_modulo(left, right):
+    expression_check_operands(left, right)
+    return left % right
+
+def expression_day(value):
+    ordinal = parse_ordinal(value) if isinstance(value, str) else 0
+    if not ordinal:
+        raise ExpressionError(f'некорректная дата: {value}')
+    return ordinal
+
+
+EXPRESSION_BINARY = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: expression_multiply, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: expression_modulo, ast.Pow: expression_power,
+}
+EXPRESSION_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+EXPRESSION_COMPARE = {
+    ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+    ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+}
+EXPRESSION_CONSTANTS = {'pi': math.pi, 'e': math.e, 'tau': math.tau}
+EXPRESSION_FUNCTIONS = {
+    'abs': abs, 'round': round, 'min': min, 'max': max, 'sqrt': math.sqrt, 'exp': math.exp,
+    'log': math.log, 'log10': math.log10, 'sin': math.sin, 'cos': math.cos, 'tan': math.tan,
+    'floor': math.floor, 'ceil': math.ceil, 'day': expression_day,
+}
+
+def vector_functions():
+    # Те же имена над массивами numpy; min и max в векторном виде поэлементные
+    return {
+        'abs': numpy.abs, 'round': numpy.round, 'min': numpy.minimum, 'max': numpy.maximum,
+        'sqrt': numpy.sqrt, 'exp': numpy.exp, 'log': numpy.log, 'log10': numpy.log10, 'sin': numpy.sin,
+        'cos': numpy.cos, 'tan': numpy.tan, 'floor': numpy.floor, 'ceil': numpy.ceil, 'day': expression_day,
+    }
+
+
+class Expression:
+    def __init__(self, source, value, names, condition=None):
+        self.source = source
+        self.value = value
+        self.names = names
+        self.condition = condition
+
+    def __call__(self, variables=None):
+        return self.value(variables or {})
+
+
+class ExpressionCompiler:
+    # Разрешённые узлы AST превращаются в дерево замыканий; всё, чего нет в списке, — ошибка.
+    # eval и compile не используются, поэтому доступа к атрибутам, импорту и builtins нет
+    def __init__(self, vector=False):
+        self.vector = vector
+        self.functions = vector_functions() if vector else EXPRESSION_FUNCTIONS
+        self.names = set()
+
+    def compile(self, source):
+        try:
+            tree = ast.parse(source.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ExpressionError(f'синтаксическая ошибка: {e.msg}') from None
+        return self.visit(tree.body)
+
+    def visit(self, node):
+        method = getattr(self, 'visit_' + type(node).__name__, None)
+        if method is None:
+            raise ExpressionError(f'недопустимая конструкция: {type(node).__name__}')
+        return method(node)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str)):
+            raise ExpressionError(f'недопустимое значение: {node.value!r}')
+        value = node.value
+        return lambda variables: value
+
+    def visit_Name(self, node):
+        name = node.id
+        if name in EXPRESSION_CONSTANTS:
+            value = EXPRESSION_CONSTANTS[name]
+            return lambda variables: value
+        self.names.add(name)
+
+        def lookup(variables):
+            try:
+                return variables[name]
+            except KeyError:
+                raise ExpressionError(f'неизвестная переменная: {name}') from None
+        return lookup
+
+    def visit_BinOp(self, node):
+        function = EXPRESSION_BINARY.get(type(node.op))
+        if function is None:
+            raise ExpressionError(f'недопустимая операция: {type(node.op).__name__}')
+        left, right = self.visit(node.left), self.visit(node.right)
+        return lambda variables: function(left(variables), right(variables))
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.Not):
+            if self.vector:
+                return lambda variables: numpy.logical_not(operand(variables))
+            return lambda variables: not operand(variables)
+        function = EXPRESSION_UNARY.get(type(node.op))
+        if function is None:
+            raise ExpressionError(f'недопустимая операция: {type(node.op).__name__}')
+        return lambda variables: function(operand(variables))
+
+    def visit_BoolOp(self, node):
+        values = [self.visit(value) for value in node.values]
+        is_and = isinstance(node.op, ast.And)
+        if self.vector:
+            function = numpy.logical_and if is_and else numpy.logical_or
+            return lambda variables: functools.reduce(function, (value(variables) for value in values))
+
+        def evaluate(variables):
+            for value in values:
+                result = value(variables)
+                if bool(result) != is_and:
+                    return result
+            return result
+        return evaluate
+
+    def visit_Compare(self, node):
+        operands = [self.visit(node.left)] + [self.visit(comparator) for comparator in node.comparators]
+        functions = []
+        for op in node.ops:
+            function = EXPRESSION_COMPARE.get(type(op))
+            if function is None:
+                raise ExpressionError(f'недопустимое сравнение: {type(op).__name__}')
+            functions.append(function)
+        pairs = list(zip(functions, operands, operands[1:]))
+        if len(pairs) == 1:
+            function, left, right = pairs[0]
+            return lambda variables: function(left(variables), right(variables))
+        if self.vector:
+            return lambda variables: functools.reduce(
+                numpy.logical_and, (function(left(variables), right(variables)) for function, left, right in pairs))
+        return lambda variables: all(function(left(variables), right(variables)) for function, left, right in pairs)
+
+    def visit_IfExp(self, node):
+        test, body, orelse = self.visit(node.test), self.visit(node.body), self.visit(node.orelse)
+        if self.vector:
+            return lambda variables: numpy.where(test(variables), body(variables), orelse(variables))
+        return lambda variables: body(variables) if test(variables) else orelse(variables)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in self.functions:
+            raise ExpressionError('можно вызывать только функции: ' + ', '.join(sorted(self.functions)))
+        if node.keywords:
+            raise ExpressionError('именованные аргументы не поддерживаются')
+        function = self.functions[node.func.id]
+        arguments = [self.visit(argument) for argument in node.args]
+        return lambda variables: function(*(argument(variables) for argument in arguments))
+
+
+def split_where(source):
+    # «where» вне скобок и строк отделяет условие отбора записей
+    depth = 0
+    lines = source.splitlines(keepends=True)
+    try:
+        for token in generate_tokens(io.StringIO(source).readline):
+            if token.type == OP and token.string in '([{':
+                depth += 1
+            elif token.type == OP and token.string in ')]}':
+                depth -= 1
+            elif token.type == NAME and token.string == 'where' and depth == 0:
+                start = sum(map(len, lines[:token.start[0] - 1])) + token.start[1]
+                end = sum(map(len, lines[:token.end[0] - 1])) + token.end[1]
+                return source[:start], source[end:]
+    except (TokenError, SyntaxError):
+        pass
+    return source, None
+
+@functools.lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(source, vector=False):
+    # Разбор и проверка выполняются один раз на текст выражения
+    value_source, condition_source = split_where(source)
+    compiler = ExpressionCompiler(vector)
+    value = compiler.compile(value_source)
+    condition = None
+    if condition_source is not None:
+        condition = compiler.compile(condition_source)
+    return Expression(source, value, frozenset(compiler.names), condition)
+
+
+ROLLUP_PERIODS = ('month', 'week', 'year')
+ROLLUP_HEADER = ['Период', 'Категория', 'Доходы', 'Расходы', 'Баланс', 'Записей']
+
+@functools.lru_cache(maxsize=65536)
+def period_keys(ordinal):
+    # Месяц «ГГГГ-ММ» и ISO-неделя «ГГГГ-Wнн»: строки сортируются по времени
+    date = datetime.date.fromordinal(ordinal)
+    year, week, _ = date.isocalendar()
+    return f'{date.year:04d}-{date.month:02d}', f'{year:04d}-W{week:02d}'
+
+def period_key(date, period):
+    month, week = period_keys(date.toordinal())
+    return {'month': month, 'week': week, 'year': month[:4]}[period]
+
+
+class CategoryRollups:
+    # Суммы по категории и месяцу и по категории и ISO-неделе; годы складываются из месяцев.
+    # Ячейка — [доходы, расходы, число записей]; обновляется при каждой записи, отчёт по ним
+    # не зависит от числа записей
+    def __init__(self, cells=None):
+        self.cells = cells or {'month': {}, 'week': {}}
+
+    @classmethod
+    def build(cls, rows):
+        rollups = cls()
+        for ordinal, category, amount in rows:
+            rollups.add(ordinal, category, amount)
+        return rollups
+
+    def add_cell(self, ordinal, category, income, expenses, count):
+        if not ordinal:
+            return
+        for period, key in zip(('month', 'week'), period_keys(ordinal)):
+            cells = self.cells[period].setdefault(category, {})
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0.0, 0.0, 0]
+            cell[0] += income
+            cell[1] += expenses
+            cell[2] += count
+            # Пустая ячейка удаляется, чтобы в ней не копились остатки округления
+            if cell[2] == 0:
+                del cells[key]
+                if not cells:
+                    del self.cells[period][category]
+
+    def add(self, ordinal, category, amount, sign=1):
+        self.add_cell(ordinal, category, sign * amount if amount > 0 else 0.0, sign * amount if amount < 0 else 0.0,
+                      sign)
+
+    def rows(self, period='month', start=None, end=None):
+        # (период, категория, доходы, расходы, баланс, число) в порядке периода и категории;
+        # start и end — ключи периодов, границы включаются
+        source = self.cells['month' if period == 'year' else period]
+        grouped = {}
+        for category, cells in source.items():
+            for key, (income, expenses, count) in cells.items():
+                if period == 'year':
+                    key = key[:4]
+                if (start and key < start) or (end and key > end):
+                    continue
+                cell = grouped.get((key, category))
+                if cell is None:
+                    grouped[key, category] = [income, expenses, count]
+                else:
+                    cell[0] += income
+                    cell[1] += expenses
+                    cell[2] += count
+        return [(key, category, income, expenses, income + expenses, count)
+                for (key, category), (income, expenses, count) in sorted(grouped.items())]
+
+    def to_json(self):
+        return self.cells
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data)
+
+
+class StoreManager:
+    record_class = None
+    columns = {}
+    # Двоичный снимок с отображением в память; поля из lazy_fields декодируются при обращении
+    binary_snapshot = False
+    lazy_fields = ()
+    export_columns = []
+    # Поля, которые при слиянии с чужими изменениями всегда берутся из нашей версии
+    overwrite_fields = ()
+    # Порядки для постраничного просмотра, кроме порядка ID: имя -> ключ записи
+    sort_keys = {}
+    empty_message = 'Нет записей.'
+    # Поля, которые при импорте в режиме upsert переносятся из строки в найденную запись:
+    # имя -> нормализация для сравнения (значения, равные после неё, не перезаписываются)
+    merge_fields = {}
+
+    def __init__(self, file_path):
+        self._items = None
+        self._by_key = {}
+        self._max_key = 0
+        self.store = open_store(file_path, self.record_class, self.dump_items, self.columns,
+                                self.binary_snapshot, self.lazy_fields)
+        if self.store.resident:
+            self.load_items()
+
+    @property
+    def items(self):
+        # При SQLite-хранилище записи поднимаются в память только по необходимости
+        if self._items is None:
+            self.load_items()
+        return self._items
+
+    def load_items(self):
+        self._items = list(itertools.starmap(self.record_class, self.store.load()))
+        # Список держится в порядке ID: на нём работают курсоры страниц
+        if any(previous.id > item.id for previous, item in itertools.pairwise(self._items)):
+            self._items.sort(key=operator.attrgetter('id'))
+        self._by_key = {item.id: item for item in self._items}
+        self._max_key = max(self._by_key, default=0)
+
+    def dump_items(self):
+        return list(map(self.record_class.row_getter, self.items))
+
+    def save_items(self):
+        with self.transaction():
+            self.store.save(self.dump_items())
+
+    def count_items(self):
+        if self._items is None:
+            return self.store.count()
+        return len(self._items)
+
+    def iter_items(self):
+        if self._items is None:
+            return itertools.starmap(self.record_class, self.store.select())
+        return iter(self._items)
+
+    def get_item(self, key):
+        if self._items is None:
+            row = self.store.get(key)
+            return self.record_class(*row) if row else None
+        return self.lookup_item(key)
+
+    def scan_items(self, start=None, descending=False):
+        # Записи по порядку ID строго после start (при descending — перед ним, по убыванию)
+        if self._items is None:
+            where, params = None, ()
+            if start is not None:
+                where, params = ('id < ?' if descending else 'id > ?'), (start,)
+            rows = self.store.select(where, params, order_by='id DESC' if descending else 'id')
+            return itertools.starmap(self.record_class, rows)
+        items = self._items
+        if descending:
+            end = len(items) if start is None else bisect.bisect_left(items, start, key=operator.attrgetter('id'))
+            return (items[position] for position in range(end - 1, -1, -1))
+        begin = 0 if start is None else bisect.bisect_right(items, start, key=operator.attrgetter('id'))
+        return (items[position] for position in range(begin, len(items)))
+
+    def page_items(self, cursor=None, size=PAGE_SIZE, sort='id', where=None, backward=False):
+        # Страница после курсора (при backward — перед ним). В порядке ID страница читается
+        # с места курсора, время и память зависят только от размера страницы; другие порядки
+        # просматривают записи потоком и держат в памяти не больше страницы
+        if sort == 'id':
+            key = operator.attrgetter('id')
+            items = self.scan_items(cursor[1] if cursor else None, backward)
+            if where is not None:
+                items = filter(where, items)
+            found = list(itertools.islice(items, size + 1))
+        else:
+            if sort not in self.sort_keys:
+                raise ValueError(f'Неизвестный порядок сортировки: {sort}')
+            key = self.sort_keys[sort]
+            ordered = lambda item: (key(item), item.id)
+            items = self.iter_items()
+            if where is not None:
+                items = filter(where, items)
+            if cursor:
+                bound = tuple(cursor)
+                if backward:
+                    items = (item for item in items if ordered(item) < bound)
+                else:
+                    items = (item for item in items if ordered(item) > bound)
+            select = heapq.nlargest if backward else heapq.nsmallest
+            found = select(size + 1, items, key=ordered)
+        more = len(found) > size
+        found = found[:size]
+        if backward:
+            found.reverse()
+        first = [key(found[0]), found[0].id] if found else None
+        last = [key(found[-1]), found[-1].id] if found else None
+        if backward:
+            return Page(found, first if more else None, last if cursor else None)
+        return Page(found, first if cursor else None, last if more else None)
+
+    def iter_pages(self, size=PAGE_SIZE, sort='id', where=None):
+        cursor = None
+        while True:
+            page = self.page_items(cursor, size, sort, where)
+            if page.items:
+                yield page
+            if page.after is None:
+                return
+            cursor = page.after
+
+    def item_line(self, item):
+        return f'{item.id}. ' + ', '.join(str(value) for value in item.to_row()[1:-1])
+
+    def print_items(self, items):
+        write_lines(map(self.item_line, items))
+
+    def next_key(self):
+        if self._items is None:
+            return self.store.max_key() + 1
+        return self.max_loaded_key() + 1
+
+    def lookup_item(self, key):
+        return self._by_key.get(key)
+
+    def max_loaded_key(self):
+        return self._max_key
+
+    def attach_item(self, item):
+        if self._items and item.id < self._items[-1].id:
+            bisect.insort(self._items, item, key=operator.attrgetter('id'))
+        else:
+            self._items.append(item)
+        self._by_key[item.id] = item
+        self._max_key = max(self._max_key, item.id)
+
+    def detach_item(self, item):
+        self._items.remove(self._by_key.pop(item.id))
+
+    def index_item(self, item):
+        pass
+
+    def unindex_item(self, item):
+        pass
+
+    def transaction(self):
+        return transaction(self)
+
+    def rollback_items(self):
+        if self.store.resident:
+            self.load_items()
+        else:
+            self._items = None
+
+    def rollback_savepoint(self, entries):
+        # Память возвращается к точке сохранения: состояние с диска плюс записи внешнего блока
+        self.rollback_items()
+        if self._items is not None:
+            self.apply_entries(entries)
+
+    def refresh_item(self, item, row):
+        item.assign(row)
+        self.index_item(item)
+
+    def refresh(self):
+        # Подхватывает изменения, сделанные на диске другим процессом
+        entries = self.store.poll()
+        if entries is None:
+            if self.store.resident:
+                self.load_items()
+            else:
+                self._items = None
+            return
+        if self._items is None:
+            return
+        self.apply_entries(entries)
 
-def load_data(file_path, default_data):
-    if not os.path.exists(file_path):
-        save_data(file_path, default_data)
-        return default_data
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    def apply_entries(self, entries):
+        for entry in entries:
+            if entry['op'] == 'put':
+                item = self.lookup_item(entry['row'][0])
+                if item is None:
+                    item = self.record_class(*entry['row'])
+                    self.attach_item(item)
+                    self.index_item(item)
+                else:
+                    self.refresh_item(item, entry['row'])
+            elif entry['op'] == 'del':
+                item = self.lookup_item(entry['id'])
+                if item is not None:
+                    self.detach_item(item)
+                    self.unindex_item(item)
 
-def save_data(file_path, data):
-    with open(file_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    def merge_changes(self, current, item):
+        # Непустые поля строки, которые отличаются от записи
+        changes = {}
+        for name, normalize in self.merge_fields.items():
+            value, old = getattr(item, name), getattr(current, name)
+            if value in (None, '') or value == old:
+                continue
+            if normalize is None or normalize(value) != normalize(old):
+                changes[name] = value
+        return changes
 
+    def merge_duplicates(self, items, dedup, first_id):
+        # Строки, совпавшие с записями, пропускаются или сливаются с ними; возвращаются новые записи
+        fresh = []
+        for item in items:
+            target = dedup.match(item)
+            if target is None:
+                if dedup.unique:
+                    dedup.add(item, item)
+                fresh.append(item)
+                continue
+            current = target if isinstance(target, Record) else self.get_item(target)
+            if current is None:
+                fresh.append(item)
+                continue
+            changes = self.merge_changes(current, item) if dedup.mode == 'upsert' else {}
+            if not changes:
+                dedup.skipped += 1
+                continue
+            dedup.merged += 1
+            if current is target:
+                # Запись из этой же пачки ещё не сохранена
+                for name, value in changes.items():
+                    setattr(current, name, value)
+            else:
+                self.change_item(current, **changes)
+            if dedup.unique:
+                dedup.add(current, target)
+        # Пропущенные строки не оставляют дыр в ID
+        for offset, item in enumerate(fresh):
+            item.id = first_id + offset
+        return fresh
 
-class Note:
-    def __init__(self, note_id, title, content, timestamp):
-        self.note_id = note_id
-        self.title = title
-        self.content = content
-        self.timestamp = timestamp
+    def import_rows(self, rows, convert, batch_size=IMPORT_BATCH_SIZE, progress=None, dedup=None):
+        # Строки читаются потоком и сохраняются пачками: ошибка в пачке не отменяет уже записанные
+        next_id = self.next_key()
+        imported = 0
+        processed = 0
+        errors = []
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            first_line = processed + 1
+            processed += len(chunk)
+            chunk_start_id = next_id
+            items = []
+            try:
+                for row in chunk:
+                    item = convert(row, next_id)
+                    next_id = item.id + 1
+                    items.append(item)
+            except (ValueError, KeyError, TypeError, IndexError) as e:
+                errors.append((first_line, processed, str(e)))
+                next_id = chunk_start_id
+            else:
+                if dedup is None:
+                    self.insert_items(items)
+                else:
+                    with self.transaction():
+                        items = self.merge_duplicates(items, dedup, chunk_start_id)
+                        self.insert_items(items)
+                    for item in items:
+                        dedup.replace(item, item.id)
+                imported += len(items)
+                next_id = self.next_key()
+            if progress:
+                progress(imported, processed)
+        return imported, errors
 
-class Task:
-    def __init__(self, task_id, title, description, done=False, priority="Низкий", due_date=None):
-        self.task_id = task_id
-        self.title = title
-        self.description = description
-        self.done = done
-        self.priority = priority
-        self.due_date = due_date
+    def import_files(self, files, convert, workers=None, dedup=None):
+        # Файлы разбираются параллельно в отдельных процессах, а сливаются в порядке списка:
+        # ID выдаются один раз на все файлы, и всё пишется одной транзакцией
+        workers = min(workers or os.cpu_count() or 1, len(files))
+        if workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                results = list(pool.map(parse_import_file, itertools.repeat(convert), files))
+        else:
+            results = [parse_import_file(convert, file_name) for file_name in files]
+        items = []
+        errors = []
+        for file_name, rows, file_errors in results:
+            items.extend(self.record_class(*row) for row in rows)
+            errors.extend((file_name, line, error) for line, error in file_errors)
+        del results
+        with self.transaction():
+            first_id = self.next_key()
+            if dedup is None:
+                for offset, item in enumerate(items):
+                    item.id = first_id + offset
+            else:
+                items = self.merge_duplicates(items, dedup, first_id)
+            self.insert_items(items)
+        return len(items), errors
 
-class Contact:
-    def __init__(self, contact_id, name, phone=None, email=None):
-        self.contact_id = contact_id
-        self.name = name
-        self.phone = phone
-        self.email = email
+    def import_csv_files(self, source, convert, mode='append', workers=None):
+        files = import_sources(source)
+        if not files:
+            print('Файлы для импорта не найдены.')
+            return None
+        dedup = self.import_index(mode) if mode != 'append' else None
+        imported, errors = self.import_files(files, convert, workers, dedup)
+        if sys.stdout.isatty():
+            print()
+        for file_name, line, error in errors:
+            print(f'{file_name}, строка {line} не импортирована: {error}')
+        print(f'Обработано файлов: {len(files)}')
+        report_import(imported, [], dedup)
+        return imported
 
-class FinanceRecord:
-    def __init__(self, record_id, amount, category, date=None, description=None):
-        self.record_id = record_id
-        self.amount = amount
-        self.category = category
-        self.date = date or datetime.datetime.now().strftime("%d-%m-%Y")
-        self.description = description
+    def select_columns(self, fields=None):
+        if not fields:
+            return self.export_columns
+        columns = []
+        for name in fields:
+            matches = [column for column in self.export_columns if name in column[:2]]
+            if not matches:
+                raise ValueError(f'Неизвестное поле: {name}')
+            columns.extend(matches)
+        return columns
+
+    def export_items(self, target, fmt=None, fields=None, where=None, compression=None, items=None, **filters):
+        columns = self.select_columns(fields)
+        fmt = fmt or export_format(target)
+        source = self.iter_items() if items is None else items
+        if filters:
+            source = (item for item in source if all(getattr(item, name) == value for name, value in filters.items()))
+        if where is not None:
+            source = filter(where, source)
+        count = 0
+        # Записи идут из генератора прямо в поток, память не зависит от объёма выгрузки
+        with open_export_target(target, compression) as stream:
+            if fmt == 'jsonl':
+                for item in source:
+                    stream.write(json.dumps({attribute: getattr(item, attribute) for _, attribute, _ in columns},
+                                            ensure_ascii=False) + '\n')
+                    count += 1
+            elif fmt == 'csv':
+                writer = csv.writer(stream)
+                writer.writerow([header for header, _, _ in columns])
+                for item in source:
+                    writer.writerow([convert(getattr(item, attribute)) if convert else getattr(item, attribute)
+                                     for _, attribute, convert in columns])
+                    count += 1
+            else:
+                raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+        return count
+
+    def change_seq(self):
+        return self.store.change_seq()
+
+    def changes_since(self, seq):
+        # События (номер, created/updated/deleted, ID) после номера seq по порядку номеров;
+        # None, если лог изменений их уже не хранит
+        return self.store.changes_since(seq)
+
+    def export_changes(self, target, since, fmt=None, fields=None, compression=None):
+        # Разностная выгрузка: по каждой записи, изменённой после since, — её текущее состояние
+        # или отметка об удалении. Возвращает число строк и номер, с которого начать следующую
+        events = self.changes_since(since)
+        if events is None:
+            return None
+        latest = {}
+        for seq, op, key in events:
+            latest.pop(key, None)
+            latest[key] = seq, op
+        self.refresh()
+        columns = self.select_columns(fields)
+        fmt = fmt or export_format(target)
+        with open_export_target(target, compression) as stream:
+            writer = csv.writer(stream) if fmt == 'csv' else None
+            if writer:
+                writer.writerow(['Изменение', 'Номер изменения'] + [header for header, _, _ in columns])
+            elif fmt != 'jsonl':
+                raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+            for key, (seq, op) in latest.items():
+                item = None if op == 'deleted' else self.get_item(key)
+                if item is None:
+                    # Запись могли удалить уже после чтения лога
+                    op = 'deleted'
+                    data = {'id': key}
+                else:
+                    data = {attribute: getattr(item, attribute) for _, attribute, _ in columns}
+                if writer:
+                    writer.writerow([op, seq] + [convert(data[attribute]) if convert and item else data.get(attribute)
+                                                 for _, attribute, convert in columns])
+                else:
+                    stream.write(json.dumps({'change': op, 'seq': seq, **data}, ensure_ascii=False) + '\n')
+        return len(latest), events[-1][0] if events else since
+
+    def claim_keys(self, items):
+        # ID выдаются по состоянию в памяти; если другой процесс уже занял их, сдвигаем на свободные
+        shift = self.next_key() - min(item.id for item in items)
+        if shift > 0:
+            for item in items:
+                item.id += shift
+
+    def insert_item(self, item):
+        with self.transaction():
+            self.claim_keys([item])
+            if self._items is not None:
+                self.attach_item(item)
+                self.index_item(item)
+            self.store.put(item.to_row())
+
+    def insert_items(self, items):
+        if not items:
+            return
+        with self.transaction():
+            self.claim_keys(items)
+            if self._items is not None:
+                for item in items:
+                    self.attach_item(item)
+                    self.index_item(item)
+            self.store.put_many([item.to_row() for item in items])
+
+    def update_item(self, item):
+        if self._items is not None:
+            self.index_item(item)
+        self.store.put(item.to_row())
+
+    def change_item(self, item, **changes):
+        # Оптимистичная запись: под блокировкой на актуальную версию с диска накладываются
+        # только поля, которые мы поменяли. Если то же поле после нашего чтения изменил
+        # другой процесс, это конфликт, и ничего не пишется
+        key = item.id
+        version = item.version
+        seen = {name: getattr(item, name) for name in changes}
+        with self.transaction():
+            current = self.get_item(key)
+            if current is None:
+                raise ConflictError('запись удалена другим процессом')
+            changed = [name for name, value in changes.items() if value != seen[name] or name in self.overwrite_fields]
+            if current.version != version:
+                conflicts = [name for name in changed
+                             if name not in self.overwrite_fields and getattr(current, name) != seen[name]]
+                if conflicts:
+                    raise ConflictError(f'поля изменены другим процессом: {", ".join(conflicts)}')
+            for name in changed:
+                setattr(current, name, changes[name])
+            current.version += 1
+            self.update_item(current)
+        if current is not item:
+            item.assign(current.to_row())
+        return item
+
+    def remove_item(self, item):
+        key = item.id
+        version = item.version
+        with self.transaction():
+            current = self.get_item(key)
+            if current is None:
+                return
+            if current.version != version:
+                raise ConflictError('запись изменена другим процессом')
+            if self._items is not None:
+                self.detach_item(current)
+                self.unindex_item(current)
+            self.store.delete(key)
 
 
+class NoteManager(StoreManager):
+    record_class = Note
+    overwrite_fields = ('timestamp',)
+    binary_snapshot = True
+    lazy_fields = ('content',)
+    export_columns = [
+        ('ID', 'id', None),
+        ('Заголовок', 'title', None),
+        ('Содержимое', 'content', None),
+        ('Дата', 'timestamp', None),
+    ]
+    sort_keys = {
+        'title': lambda note: (note.title or '').lower(),
+        'date': lambda note: timestamp_key(note.timestamp),
+    }
+    empty_message = 'Список заметок пуст'
 
-class NoteManager:
     def __init__(self):
-        self.notes = []
-        self.load_notes()
+        self.index = None
+        self.index_changes = {}
+        self.index_path = NOTES_FILE + INDEX_SUFFIX
+        super().__init__(NOTES_FILE)
+        self.store.after_save = self.snapshot_saved
+
+    @property
+    def notes(self):
+        return self.items
+
+    def load_items(self):
+        # Записи не разбираются целиком: таблица поверх снимка создаёт их по запросу.
+        # Поисковый индекс читается только при первом поиске
+        rows = self.store.load()
+        if not isinstance(rows, SnapshotTable):
+            rows = SnapshotTable.from_rows(Note, rows)
+        self._items = rows
+        self.index = None
+        self.index_changes = {}
+
+    def snapshot_saved(self):
+        # Все изменения вошли в новый снимок — таблица открывается на нём заново
+        if self._items is not None and self.store.resident:
+            self._items = self.store.open_snapshot()
+        self.save_index()
+
+    def dump_items(self):
+        return self.items.rows(lazy=True)
+
+    def lookup_item(self, key):
+        return self._items.record(key)
+
+    def scan_items(self, start=None, descending=False):
+        if self._items is None:
+            return super().scan_items(start, descending)
+        return map(self._items.record, self._items.keys_from(start, descending))
+
+    def max_loaded_key(self):
+        return self._items.max_id()
+
+    def attach_item(self, item):
+        self._items[item.id] = item.to_row()
+
+    def detach_item(self, item):
+        self._items.pop(item.id)
+
+    def update_item(self, item):
+        if self._items is not None:
+            self._items[item.id] = item.to_row()
+        super().update_item(item)
+
+    def refresh_item(self, item, row):
+        self._items[item.id] = row
+        super().refresh_item(item, row)
+
+    def search_index(self):
+        if self.index is None:
+            if self._items is None:
+                self.load_items()
+            self.index = self.load_index()
+            # Изменения, сделанные до загрузки индекса
+            for key, item in self.index_changes.items():
+                if item is None:
+                    self.index.remove(key)
+                else:
+                    self.index.add(key, item.title, item.content)
+            self.index_changes = {}
+        return self.index
+
+    def load_index(self):
+        source = IndexFile.open(self.index_path, self.store.seen_stamp)
+        if source is not None:
+            index = NoteIndex(source)
+            for old, new in self.store.tail:
+                if new is not None:
+                    new = Note(*new)
+                    index.add(new.id, new.title, new.content)
+                elif old is not None:
+                    index.remove(old[0])
+            return index
+        index = NoteIndex()
+        for note in self._items:
+            index.add(note.id, note.title, note.content)
+        # Обновления индекса идемпотентны, так что хвост журнала при следующем запуске не навредит
+        self.save_index(index)
+        return index
+
+    def save_index(self, index=None):
+        # Незагруженный индекс не сохраняется: он будет перестроен при следующем поиске
+        index = index or self.index
+        if index is not None and self.store.seen_stamp is not None:
+            write_index(self.index_path, self.store.seen_stamp, index)
+            # Все изменения вошли в файл: дальше индекс читается с него, а не из словарей поверх прежнего
+            if index is self.index:
+                self.index = NoteIndex(IndexFile(self.index_path))
+
+    def index_item(self, item):
+        if self.index is None:
+            self.index_changes[item.id] = item
+        else:
+            self.index.add(item.id, item.title, item.content)
+
+    def unindex_item(self, item):
+        if self.index is None:
+            self.index_changes[item.id] = None
+        else:
+            self.index.remove(item.id)
 
     def load_notes(self):
-        data = load_data(NOTES_FILE, [])
-        self.notes = [Note(**note) for note in data]
+        self.load_items()
+
+    def dump_notes(self):
+        return self.dump_items()
 
     def save_notes(self):
-        data = [note.__dict__ for note in self.notes]
-        save_data(NOTES_FILE, data)
+        self.save_items()
 
     def add_note(self, title, content):
-        note_id = max([note.note_id for note in self.notes], default=0) + 1
+        note_id = self.next_key()
         timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
         new_note = Note(note_id, title, content, timestamp)
-        self.notes.append(new_note)
-        self.save_notes()
+        self.insert_item(new_note)
         print("Заметка успешно добавлена")
+        return new_note
+
+    def item_line(self, note):
+        return f"{note.id}. {note.title} (дата: {note.timestamp})"
 
     def list_notes(self):
-        if not self.notes:
-            print("Список заметок пуст")
+        if not self.count_items():
+            print(self.empty_message)
             return
-        for note in self.notes:
-            print(f"{note.note_id}. {note.title} (дата: {note.timestamp})")
+        self.print_items(self.iter_items())
 
     def get_note_by_id(self, note_id):
-        for note in self.notes:
-            if note.note_id == note_id:
-                return note
-        return None
+        return self.get_item(note_id)
+
+    def find_notes(self, query, limit=10):
+        return [(self.get_item(note_id), score) for note_id, score in self.search_index().search(query, limit)]
+
+    def search_notes(self, query, limit=10):
+        results = self.find_notes(query, limit)
+        if results:
+            for note, score in results:
+                print(f"{note.id}. {note.title} (дата: {note.timestamp}, релевантность: {score:.2f})")
+        else:
+            print("Заметки не найдены")
 
     def view_note(self, note_id):
         note = self.get_note_by_id(note_id)
@@ -99,164 +3372,330 @@ class NoteManager:
     def edit_note(self, note_id, new_title, new_content):
         note = self.get_note_by_id(note_id)
         if note:
-            note.title = new_title
-            note.content = new_content
-            note.timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
-            self.save_notes()
+            timestamp = datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+            try:
+                self.change_item(note, title=new_title, content=new_content, timestamp=timestamp)
+            except ConflictError as e:
+                print(f"Заметка не сохранена: {e}")
+                return False
             print("Заметка успешно отредактирована")
-        else:
-            print("Заметка не найдена")
+            return True
+        print("Заметка не найдена")
+        return False
 
     def delete_note(self, note_id):
         note = self.get_note_by_id(note_id)
         if note:
-            self.notes.remove(note)
-            self.save_notes()
+            try:
+                self.remove_item(note)
+            except ConflictError as e:
+                print(f"Заметка не удалена: {e}")
+                return False
             print("Заметка успешно удалена")
-        else:
-            print("Заметка не найдена")
+            return True
+        print("Заметка не найдена")
+        return False
 
-    def export_notes_to_csv(self):
-        if not self.notes:
+    def export_notes_to_csv(self, file_name='notes_export.csv'):
+        if not self.count_items():
             print('Список заметок пуст.')
             return
-        file_name = 'notes_export.csv'
-        with open(file_name, mode='w', encoding='utf-8', newline='') as csv_file:
-            fieldnames = ['ID', 'Заголовок', 'Содержимое', 'Дата']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            for note in self.notes:
-                writer.writerow({
-                    'ID': note.id,
-                    'Заголовок': note.title,
-                    'Содержимое': note.content,
-                    'Дата': note.timestamp
-                })
+        self.export_items(file_name)
         print(f'Заметки успешно добавлены в файл {file_name}')
 
-    def import_notes_from_csv(self, file_name):
+    def note_from_csv(self, row, next_id):
+        # ID из файла сохраняется, если он не пересекается с уже выданными
+        note_id = int(row["ID"])
+        if note_id < next_id:
+            note_id = next_id
+        return Note(note_id, row["Заголовок"], row["Содержимое"], row["Дата"])
+
+    def import_notes_from_csv(self, file_name, batch_size=IMPORT_BATCH_SIZE, progress=print_import_progress):
         try:
-            with open(file_name, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    note_id = int(row["ID"])
-                    title = row["Заголовок"]
-                    content = row["Содержимое"]
-                    timestamp = row["Дата"]
-                    self.notes.append(Note(note_id, title, content, timestamp))
-            self.save_notes()
+            imported, errors = self.import_rows(read_csv_rows(file_name), self.note_from_csv, batch_size, progress)
+            report_import(imported, errors)
             print(f"Заметки успешно импортированы из {file_name}")
+            return imported
         except FileNotFoundError:
             print("Файл не найден")
         except Exception as e:
             print(f"Ошибка при импорте: {e}")
 
-class TaskManager:
+class TaskManager(StoreManager):
+    record_class = Task
+    columns = {
+        'due_key': ('due_date', iso_date),
+        'open': ('done', lambda done: 0 if done else 1),
+        'priority_rank': ('priority', priority_rank),
+    }
+    export_columns = [
+        ('ID', 'id', None),
+        ('Title', 'title', None),
+        ('Description', 'description', None),
+        ('Status', 'done', lambda done: "Выполнена" if done else "Не выполнена"),
+        ('Priority', 'priority', None),
+        ('Due Date', 'due_date', None),
+    ]
+    sort_keys = {
+        'due': lambda task: parse_ordinal(task.due_date) if isinstance(task.due_date, str) else 0,
+        'priority': lambda task: priority_rank(task.priority),
+        'title': lambda task: (task.title or '').lower(),
+    }
+    empty_message = 'Нет задач для отображения.'
+
     def __init__(self):
-        self.tasks = []
-        self.load_tasks()
+        self.agenda = None
+        super().__init__(TASKS_FILE)
+
+    @property
+    def tasks(self):
+        return self.items
+
+    def load_items(self):
+        super().load_items()
+        # Повестка строится при первом запросе, до этого изменения в неё не пишутся
+        self.agenda = None
+
+    def task_agenda(self):
+        if self.agenda is None:
+            self.agenda = TaskAgenda.build(self.items)
+        return self.agenda
+
+    def index_item(self, item):
+        if self.agenda is not None:
+            self.agenda.add(item)
+
+    def unindex_item(self, item):
+        if self.agenda is not None:
+            self.agenda.remove(item.id)
 
     def load_tasks(self):
-        data = load_data(TASKS_FILE, [])
-        self.tasks = [Task(**task) for task in data]
+        self.load_items()
+
+    def dump_tasks(self):
+        return self.dump_items()
 
     def save_tasks(self):
-        data = [task.__dict__ for task in self.tasks]
-        save_data(TASKS_FILE, data)
+        self.save_items()
 
     def add_task(self, title, description, priority, due_date):
-        task_id = max([task.task_id for task in self.tasks], default=0) + 1
+        task_id = self.next_key()
         done = False
         new_task = Task(task_id, title, description, done, priority, due_date)
-        self.tasks.append(new_task)
-        self.save_tasks()
+        self.insert_item(new_task)
         print("Задача успешно добавлена!")
+        return new_task
+
+    def item_line(self, task):
+        status = "Выполнена" if task.done else "Не выполнена"
+        return f"{task.id}. {task.title} - {status}, Приоритет: {task.priority}, Срок: {task.due_date}"
 
     def list_tasks(self):
-        if not self.tasks:
-            print("Нет задач для отображения.")
+        if not self.count_items():
+            print(self.empty_message)
             return
-        for task in self.tasks:
-            status = "Выполнена" if task.done else "Не выполнена"
-            print(f"{task.task_id}. {task.title} - {status}, Приоритет: {task.priority}, Срок: {task.due_date}")
+        self.print_items(self.iter_items())
+
+    def get_task_by_id(self, task_id):
+        return self.get_item(task_id)
 
     def mark_task_done(self, task_id):
         task = self.get_task_by_id(task_id)
         if task:
-            task.done = True
-            self.save_tasks()
+            try:
+                self.change_item(task, done=True)
+            except ConflictError as e:
+                print(f"Задача не сохранена: {e}")
+                return False
             print("Задача помечена как выполненная.")
-        else:
-            print("Задача не найдена.")
+            return True
+        print("Задача не найдена.")
+        return False
 
     def edit_task(self, task_id, title=None, description=None, priority=None, due_date=None):
         task = self.get_task_by_id(task_id)
         if task:
+            changes = {}
             if title:
-                task.title = title
+                changes['title'] = title
             if description:
-                task.description = description
+                changes['description'] = description
             if priority:
-                task.priority = priority
+                changes['priority'] = priority
             if due_date:
-                task.due_date = due_date
-            self.save_tasks()
+                changes['due_date'] = due_date
+            try:
+                self.change_item(task, **changes)
+            except ConflictError as e:
+                print(f"Задача не сохранена: {e}")
+                return False
             print("Задача успешно обновлена.")
-        else:
-            print("Задача не найдена.")
+            return True
+        print("Задача не найдена.")
+        return False
+
+    def agenda_tasks(self, ids):
+        return [self.lookup_item(task_id) for task_id in ids]
+
+    def select_open_tasks(self, where, params, order_by, limit=None):
+        rows = self.store.select(f'open = 1 AND {where}', params, order_by, limit)
+        return list(itertools.starmap(self.record_class, rows))
+
+    def upcoming_tasks(self, limit=10, today=None):
+        # Ближайшие невыполненные задачи начиная с today: по сроку, затем по приоритету
+        today = today or datetime.date.today()
+        if self._items is None:
+            return self.select_open_tasks('due_key >= ?', (today.isoformat(),),
+                                          'due_key, priority_rank, id', limit)
+        return self.agenda_tasks(self.task_agenda().upcoming(today.toordinal(), limit))
+
+    def overdue_tasks(self, today=None):
+        today = today or datetime.date.today()
+        if self._items is None:
+            return self.select_open_tasks('due_key < ?', (today.isoformat(),), 'due_key, priority_rank, id')
+        return self.agenda_tasks(self.task_agenda().before(today.toordinal()))
+
+    def tasks_due_between(self, start_date, end_date):
+        # Невыполненные задачи со сроком в окне [start_date, end_date]: по приоритету, затем по сроку
+        if self._items is None:
+            return self.select_open_tasks('due_key BETWEEN ? AND ?', (start_date.isoformat(), end_date.isoformat()),
+                                          'priority_rank, due_key, id')
+        return self.agenda_tasks(self.task_agenda().between(start_date.toordinal(), end_date.toordinal()))
+
+    def print_task_list(self, tasks, empty_message):
+        if not tasks:
+            print(empty_message)
+            return
+        write_lines(f"{task.id}. {task.title} - Приоритет: {task.priority}, Срок: {task.due_date}" for task in tasks)
+
+    def show_agenda(self, today=None, days=1):
+        today = today or datetime.date.today()
+        print("Просроченные задачи:")
+        self.print_task_list(self.overdue_tasks(today), "Нет просроченных задач.")
+        end_date = today + datetime.timedelta(days=max(days, 1) - 1)
+        print(f"Задачи до {end_date.strftime('%d-%m-%Y')}:")
+        self.print_task_list(self.tasks_due_between(today, end_date), "Нет задач на этот период.")
+
+    def mark_overdue_tasks_done(self, today=None):
+        today = today or datetime.date.today()
+        # Отбор идёт уже под блокировкой, поэтому конфликтов внутри транзакции не бывает
+        with self.transaction():
+            overdue = self.overdue_tasks(today)
+            for task in overdue:
+                self.change_item(task, done=True)
+        print(f"Отмечено выполненными просроченных задач: {len(overdue)}")
 
     def delete_task(self, task_id):
         task = self.get_task_by_id(task_id)
         if task:
-            self.tasks.remove(task)
-            self.save_tasks()
+            try:
+                self.remove_item(task)
+            except ConflictError as e:
+                print(f"Задача не удалена: {e}")
+                return False
             print("Задача удалена.")
-        else:
-            print("Задача не найдена.")
-
-    def export_tasks_to_csv(self):
-        with open('tasks_export.csv', 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['ID', 'Title', 'Description', 'Status', 'Priority', 'Due Date'])
-            for task in self.tasks:
-                status = "Выполнена" if task.done else "Не выполнена"
-                writer.writerow([task.task_id, task.title, task.description, status, task.priority, task.due_date])
+            return True
+        print("Задача не найдена.")
+        return False
+
+    def export_tasks_to_csv(self, file_name='tasks_export.csv'):
+        self.export_items(file_name)
         print("Задачи успешно экспортированы в CSV.")
 
-    def import_tasks_from_csv(self, csv_file):
-        with open(csv_file, newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)
-            for row in reader:
-                task_id, title, description, done, priority, due_date = row
-                done = done == "Выполнена"
-                task = Task(int(task_id), title, description, done, priority, due_date)
-                self.tasks.append(task)
-            self.save_tasks()
+    def task_from_csv(self, row, next_id):
+        task_id, title, description, done, priority, due_date = row
+        task_id = int(task_id)
+        if task_id < next_id:
+            task_id = next_id
+        done = done == "Выполнена"
+        return Task(task_id, title, description, done, priority, due_date)
+
+    def import_tasks_from_csv(self, csv_file, batch_size=IMPORT_BATCH_SIZE, progress=print_import_progress):
+        rows = read_csv_rows(csv_file, as_dict=False, skip_header=True)
+        imported, errors = self.import_rows(rows, self.task_from_csv, batch_size, progress)
+        report_import(imported, errors)
         print("Задачи успешно импортированы из CSV.")
+        return imported
+
+class ContactManager(StoreManager):
+    record_class = Contact
+    columns = {
+        'name_key': ('name', lambda name: (name or '').lower()),
+        'phone': ('phone', None),
+        # Цифры номера в том же виде, что и в PhoneTrie: поиск по префиксу не зависит от записи номера
+        'phone_digits': ('phone', lambda phone: normalize_phone(phone) or None),
+        # LIKE в SQLite не различает регистр только для ASCII, поэтому e-mail хранится приведённым
+        'email_key': ('email', lambda email: (email or '').casefold()),
+    }
+    export_columns = [
+        ('ID', 'id', None),
+        ('Имя', 'name', None),
+        ('Телефон', 'phone', None),
+        ('E-mail', 'email', None),
+    ]
+    sort_keys = {
+        'name': lambda contact: (contact.name or '').lower(),
+    }
+    empty_message = 'Список контактов пуст.'
+    merge_fields = {
+        'name': None,
+        'phone': e164_phone,
+        'email': lambda email: (email or '').strip().lower(),
+    }
 
-class ContactManager:
     def __init__(self):
-        self.contacts = []
-        self.load_contacts()
+        self.index = None
+        super().__init__(CONTACTS_FILE)
+
+    @property
+    def contacts(self):
+        return self.items
+
+    def load_items(self):
+        super().load_items()
+        self.index = ContactIndex()
+        for contact in self._items:
+            self.index_item(contact)
+
+    def index_item(self, item):
+        self.index.add(item.id, item.name, item.phone, item.email)
+
+    def unindex_item(self, item):
+        self.index.remove(item.id)
 
     def load_contacts(self):
-        data = load_data(CONTACTS_FILE, [])
-        self.contacts = [Contact(**contact) for contact in data]
+        self.load_items()
+
+    def dump_contacts(self):
+        return self.dump_items()
 
     def save_contacts(self):
-        data = [contact.__dict__ for contact in self.contacts]
-        save_data(CONTACTS_FILE, data)
+        self.save_items()
+
+    def item_line(self, contact):
+        return f'{contact.id}. {contact.name} - {contact.phone}, {contact.email}'
 
     def add_contact(self, name, phone, email):
-        contact_id = max([contact.id for contact in self.contacts], default=0) + 1
+        contact_id = self.next_key()
         new_contact = Contact(contact_id, name, phone, email)
-        self.contacts.append(new_contact)
-        self.save_contacts()
+        self.insert_item(new_contact)
         print('Контакт успешно добавлен!')
+        return new_contact
+
+    def find_contacts(self, query, limit=CONTACT_SEARCH_LIMIT):
+        if self._items is None:
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            where = "name_key LIKE ? ESCAPE '\\' OR email_key LIKE ? ESCAPE '\\'"
+            params = [pattern.lower(), pattern.casefold()]
+            if PHONE_QUERY_RE.match(query):
+                prefixes = phone_prefixes(query)
+                where += ' OR ' + ' OR '.join(['phone_digits GLOB ?'] * len(prefixes))
+                params += [prefix + '*' for prefix in prefixes]
+            return list(itertools.starmap(Contact, self.store.select(where, params, limit=limit)))
+        return [self._by_key[contact_id] for contact_id in self.index.search(query, limit)]
 
-    def search_contacts(self, query):
-        results = [contact for contact in self.contacts if query.lower() in contact.name.lower() or query in contact.phone]
+    def search_contacts(self, query, limit=CONTACT_SEARCH_LIMIT):
+        results = self.find_contacts(query, limit)
         if results:
             for contact in results:
                 print(f"{contact.id}. {contact.name} (Телефон: {contact.phone}, E-mail: {contact.email})")
@@ -266,102 +3705,313 @@ class ContactManager:
     def edit_contact(self, contact_id, name, phone, email):
         contact = self.get_contact_by_id(contact_id)
         if contact:
-            contact.name = name
-            contact.phone = phone
-            contact.email = email
-            self.save_contacts()
+            try:
+                self.change_item(contact, name=name, phone=phone, email=email)
+            except ConflictError as e:
+                print(f'Контакт не сохранён: {e}')
+                return False
             print('Контакт успешно обновлён!')
-        else:
-            print('Контакт не найден.')
+            return True
+        print('Контакт не найден.')
+        return False
 
     def delete_contact(self, contact_id):
         contact = self.get_contact_by_id(contact_id)
         if contact:
-            self.contacts.remove(contact)
-            self.save_contacts()
+            try:
+                self.remove_item(contact)
+            except ConflictError as e:
+                print(f'Контакт не удалён: {e}')
+                return False
             print('Контакт успешно удалён!')
-        else:
-            print('Контакт не найден.')
+            return True
+        print('Контакт не найден.')
+        return False
 
     def get_contact_by_id(self, contact_id):
-        for contact in self.contacts:
-            if contact.id == contact_id:
-                return contact
-        return None
+        return self.get_item(contact_id)
 
-    def export_contacts_to_csv(self):
-        if not self.contacts:
+    def export_contacts_to_csv(self, file_name='contacts_export.csv'):
+        if not self.count_items():
             print('Список контактов пуст.')
             return
-        file_name = 'contacts_export.csv'
-        with open(file_name, mode='w', encoding='utf-8', newline='') as csv_file:
-            fieldnames = ['ID', 'Имя', 'Телефон', 'E-mail']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            for contact in self.contacts:
-                writer.writerow({
-                    'ID': contact.id,
-                    'Имя': contact.name,
-                    'Телефон': contact.phone,
-                    'E-mail': contact.email
-                })
+        self.export_items(file_name)
         print(f'Контакты успешно экспортированы в файл {file_name}')
 
-    def import_contacts_from_csv(self):
-        file_name = input('Введите имя CSV-файла для импорта: ')
+    @staticmethod
+    def contact_from_csv(row, next_id):
+        name = row.get('Имя', '')
+        phone = row.get('Телефон', '')
+        email = row.get('E-mail', '')
+        return Contact(next_id, name, phone, email)
+
+    @staticmethod
+    def contact_keys(contact):
+        # Один контакт — один телефон в E.164 и один e-mail без учёта регистра
+        phone = e164_phone(contact.phone)
+        if phone:
+            yield 'phone', phone
+        email = (contact.email or '').strip().lower()
+        if email:
+            yield 'email', email
+        # Без телефона и e-mail контакт узнаётся по имени без учёта регистра и лишних пробелов
+        name = ' '.join((contact.name or '').casefold().split())
+        if name and not phone and not email:
+            yield 'name', name
+
+    def import_index(self, mode):
+        return ImportIndex.build(self.iter_items(), self.contact_keys, unique=True, mode=mode)
+
+    def import_contacts_from_csv(self, file_name=None, batch_size=IMPORT_BATCH_SIZE, progress=print_import_progress,
+                                 mode='append', workers=None):
+        if file_name is None:
+            file_name = input('Введите имя CSV-файла, каталог или шаблон (*.csv) для импорта: ')
+        if is_import_pattern(file_name):
+            imported = self.import_csv_files(file_name, self.contact_from_csv, mode, workers)
+            if imported is not None:
+                print('Контакты успешно импортированы из CSV-файла.')
+            return imported
         if not os.path.exists(file_name):
             print('Файл не найден.')
             return
-        with open(file_name, mode='r', encoding='utf-8') as csv_file:
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                contact_id = max([contact.id for contact in self.contacts], default=0) + 1
-                name = row.get('Имя', '')
-                phone = row.get('Телефон', '')
-                email = row.get('E-mail', '')
-                new_contact = Contact(contact_id, name, phone, email)
-                self.contacts.append(new_contact)
-            self.save_contacts()
+        dedup = self.import_index(mode) if mode != 'append' else None
+        imported, errors = self.import_rows(read_csv_rows(file_name), self.contact_from_csv, batch_size, progress,
+                                            dedup)
+        report_import(imported, errors, dedup)
         print('Контакты успешно импортированы из CSV-файла.')
+        return imported
+
+class FinanceManager(StoreManager):
+    record_class = FinanceRecord
+    columns = {
+        'date_key': ('date', iso_date),
+        'category': ('category', None),
+        'amount': ('amount', None),
+    }
+    export_columns = [
+        ('ID', 'id', None),
+        ('Сумма', 'amount', None),
+        ('Категория', 'category', None),
+        ('Дата', 'date', None),
+        ('Описание', 'description', None),
+    ]
+    sort_keys = {
+        'date': lambda record: parse_ordinal(record.date) if isinstance(record.date, str) else 0,
+        'amount': lambda record: float(record.amount),
+        'category': lambda record: record.category or '',
+    }
+    empty_message = 'Финансовых записей нет.'
+    merge_fields = {'category': None}
 
-class FinanceManager:
     def __init__(self):
-        self.records = []
-        self.load_records()
+        self.totals = None
+        self.rollups = None
+        self.totals_path = FINANCE_FILE + TOTALS_SUFFIX
+        self.rollups_path = FINANCE_FILE + ROLLUPS_SUFFIX
+        # Итоги по категориям из SQL, пока записи не загружены: (версия таблицы, итоги)
+        self.grouped = None
+        super().__init__(FINANCE_FILE)
+        self.store.after_save = self.save_totals
+
+    @property
+    def records(self):
+        return self.items
+
+    def load_items(self):
+        self._items = FinanceLedger(self.store.load())
+        self.totals = self.load_totals()
+        self.rollups = self.load_rollups()
+
+    def load_totals(self):
+        payload = load_sidecar(self.totals_path, self.store.seen_stamp)
+        if payload is None:
+            totals = DailyTotals.build(self._items.dates, self._items.amounts)
+            # Агрегаты не идемпотентны: сохраняем их, только если они совпадают со снимком
+            if not self.store.tail:
+                save_sidecar(self.totals_path, self.store.seen_stamp, totals.to_json())
+            return totals
+        totals = DailyTotals.from_json(payload)
+        for old, new in self.store.tail:
+            if old is not None:
+                old = FinanceRecord(*old)
+                totals.add(parse_ordinal(old.date), float(old.amount), -1)
+            if new is not None:
+                new = FinanceRecord(*new)
+                totals.add(parse_ordinal(new.date), float(new.amount))
+        return totals
+
+    def load_rollups(self):
+        payload = load_sidecar(self.rollups_path, self.store.seen_stamp)
+        if payload is None:
+            ledger = self._items
+            categories = ledger.categories
+            rollups = CategoryRollups.build(zip(ledger.dates, (categories[code] for code in ledger.category_codes),
+                                                ledger.amounts))
+            if not self.store.tail:
+                save_sidecar(self.rollups_path, self.store.seen_stamp, rollups.to_json())
+            return rollups
+        rollups = CategoryRollups.from_json(payload)
+        for old, new in self.store.tail:
+            if old is not None:
+                old = FinanceRecord(*old)
+                rollups.add(parse_ordinal(old.date), old.category, float(old.amount), -1)
+            if new is not None:
+                new = FinanceRecord(*new)
+                rollups.add(parse_ordinal(new.date), new.category, float(new.amount))
+        return rollups
+
+    def save_totals(self):
+        if self.totals is not None:
+            save_sidecar(self.totals_path, self.store.seen_stamp, self.totals.to_json())
+        if self.rollups is not None:
+            save_sidecar(self.rollups_path, self.store.seen_stamp, self.rollups.to_json())
+
+    def dump_items(self):
+        return list(self.items.rows())
+
+    def lookup_item(self, key):
+        return self._items.get(key)
+
+    def scan_items(self, start=None, descending=False):
+        if self._items is None:
+            return super().scan_items(start, descending)
+        ledger = self._items
+        if descending:
+            end = len(ledger) if start is None else bisect.bisect_left(ledger.ids, start)
+            return map(ledger.record, range(end - 1, -1, -1))
+        begin = 0 if start is None else bisect.bisect_right(ledger.ids, start)
+        return map(ledger.record, range(begin, len(ledger)))
+
+    def max_loaded_key(self):
+        return self._items.max_id()
+
+    def aggregate_position(self, position, sign=1):
+        # Запись в позиции журнала учитывается (или вычитается) в дневных итогах и в итогах по категориям
+        ledger = self._items
+        ordinal, amount = ledger.dates[position], ledger.amounts[position]
+        self.totals.add(ordinal, amount, sign)
+        self.rollups.add(ordinal, ledger.categories[ledger.category_codes[position]], amount, sign)
+
+    def attach_item(self, item):
+        self._items.append(item)
+        self.aggregate_position(self._items.position(item.id))
+
+    def detach_item(self, item):
+        self.aggregate_position(self._items.position(item.id), -1)
+        self._items.remove(item.id)
+
+    def replace_item(self, item):
+        position = self._items.position(item.id)
+        self.aggregate_position(position, -1)
+        self._items.update(item)
+        self.aggregate_position(position)
+
+    def update_item(self, item):
+        if self._items is not None:
+            self.replace_item(item)
+        self.store.put(item.to_row())
+
+    def refresh_item(self, item, row):
+        self.replace_item(FinanceRecord(*row))
+
+    def range_totals(self, start_date_obj, end_date_obj):
+        if self._items is None:
+            income, expenses, count = self.store.aggregate(
+                'SUM(CASE WHEN amount > 0 THEN amount END), SUM(CASE WHEN amount < 0 THEN amount END), COUNT(*)',
+                'date_key BETWEEN ? AND ?', (start_date_obj.isoformat(), end_date_obj.isoformat()))
+            # SQLite складывает целые суммы в целое и без строк даёт NULL: итоги всегда float, как у JSON
+            income, expenses = float(income or 0), float(expenses or 0)
+        else:
+            income, expenses, count = self.totals.between(start_date_obj.toordinal(), end_date_obj.toordinal())
+        return {'income': income, 'expenses': expenses, 'balance': income + expenses, 'count': count}
+
+    def category_rollups(self):
+        if self._items is not None:
+            return self.rollups
+        # SQLite без загрузки записей: итоги по дням и категориям одним запросом, результат
+        # переиспользуется, пока таблицу никто не менял
+        version = self.store._version()
+        if self.grouped is None or self.grouped[0] != version:
+            rollups = CategoryRollups()
+            for category, date_key, income, expenses, count in self.store.group(
+                    'category, date_key, SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END), '
+                    'SUM(CASE WHEN amount < 0 THEN amount ELSE 0 END), COUNT(*)',
+                    'category, date_key', 'date_key IS NOT NULL'):
+                rollups.add_cell(datetime.date.fromisoformat(date_key).toordinal(), category, income, expenses, count)
+            self.grouped = (version, rollups)
+        return self.grouped[1]
+
+    def category_report(self, period='month', start_date=None, end_date=None):
+        # Доходы и расходы по категориям за месяц, ISO-неделю или год; даты задают первый
+        # и последний период, оба включаются целиком
+        if period not in ROLLUP_PERIODS:
+            raise ValueError(f'Неизвестный период: {period}')
+        start = period_key(start_date, period) if start_date else None
+        end = period_key(end_date, period) if end_date else None
+        return self.category_rollups().rows(period, start, end)
+
+    def export_category_report(self, target, period='month', start_date=None, end_date=None, compression=None):
+        rows = self.category_report(period, start_date, end_date)
+        with open_export_target(target, compression) as stream:
+            writer = csv.writer(stream)
+            writer.writerow(ROLLUP_HEADER)
+            for key, category, income, expenses, balance, count in rows:
+                writer.writerow([key, category, round(income, 2), round(abs(expenses), 2), round(balance, 2), count])
+        return len(rows)
+
+    def print_category_report(self, period='month', start_date=None, end_date=None):
+        rows = self.category_report(period, start_date, end_date)
+        if not rows:
+            print('Нет записей за выбранный период.')
+            return
+        write_lines(f'{key} | {category} | доход: {income:.2f} | расход: {abs(expenses):.2f} | '
+                    f'баланс: {balance:.2f} | записей: {count}'
+                    for key, category, income, expenses, balance, count in rows)
 
     def load_records(self):
-        data = load_data(FINANCE_FILE, [])
-        self.records = [FinanceRecord(**record) for record in data]
+        self.load_items()
+
+    def dump_records(self):
+        return self.dump_items()
 
     def save_records(self):
-        data = [record.__dict__ for record in self.records]
-        save_data(FINANCE_FILE, data)
+        self.save_items()
 
     def add_record(self, amount, category, date, description):
-        record_id = max([record.id for record in self.records], default=0) + 1
+        record_id = self.next_key()
         new_record = FinanceRecord(record_id, amount, category, date, description)
-        self.records.append(new_record)
-        self.save_records()
+        self.insert_item(new_record)
         print('Запись успешно добавлена!')
+        return new_record
+
+    def item_line(self, record):
+        return f'{record.id}. {record.date} | {record.amount} | {record.category} | {record.description}'
 
     def list_records(self):
-        if not self.records:
-            print('Финансовых записей нет.')
+        if not self.count_items():
+            print(self.empty_message)
             return
-        for record in self.records:
-            print(f'{record.id}. {record.date} | {record.amount} | {record.category} | {record.description}')
+        self.print_items(self.iter_items())
 
     def generate_report(self, start_date, end_date):
-        try:
-            start_date_obj = datetime.datetime.strptime(start_date, '%d-%m-%Y')
-            end_date_obj = datetime.datetime.strptime(end_date, '%d-%m-%Y')
-        except ValueError:
+        start_date_obj = parse_date(start_date)
+        end_date_obj = parse_date(end_date)
+        if start_date_obj is None or end_date_obj is None:
             print('Некорректный формат даты.')
             return
 
-        filtered_records = [record for record in self.records if start_date_obj <= datetime.datetime.strptime(record.date, '%d-%m-%Y') <= end_date_obj]
-        income = sum(record.amount for record in filtered_records if record.amount > 0)
-        expenses = sum(record.amount for record in filtered_records if record.amount < 0)
+        # Итоги берутся из агрегатов по дням, записи просматриваются только для CSV
+        totals = self.range_totals(start_date_obj, end_date_obj)
+        income, expenses = totals['income'], totals['expenses']
+        if self._items is None:
+            params = (start_date_obj.isoformat(), end_date_obj.isoformat())
+            records = itertools.starmap(FinanceRecord, self.store.select('date_key BETWEEN ? AND ?', params,
+                                                                         order_by='date_key, id'))
+            report_rows = ((record.id, record.date, record.amount, record.category, record.description)
+                           for record in records)
+        else:
+            positions = self.records.positions_between(start_date_obj.toordinal(), end_date_obj.toordinal())
+            report_rows = self.records.report_rows(positions)
         balance = income + expenses
         print(f'Финансовый отчёт за период с {start_date} по {end_date}:')
         print(f'- Общий доход: {income}')
@@ -371,75 +4021,159 @@ class FinanceManager:
         # Сохранение отчёта в CSV-файл
         report_file = f'report_{start_date}_{end_date}.csv'
         with open(report_file, mode='w', encoding='utf-8', newline='') as csv_file:
-            fieldnames = ['ID', 'Дата', 'Сумма', 'Категория', 'Описание']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            for record in filtered_records:
-                writer.writerow({
-                    'ID': record.id,
-                    'Дата': record.date,
-                    'Сумма': record.amount,
-                    'Категория': record.category,
-                    'Описание': record.description
-                })
+            writer = csv.writer(csv_file)
+            writer.writerow(['ID', 'Дата', 'Сумма', 'Категория', 'Описание'])
+            writer.writerows(report_rows)
         print(f'Подробная информация сохранена в файле {report_file}')
+        totals['file'] = report_file
+        return totals
+
+    def evaluate(self, source, variables=None):
+        # Выражение над колонками всех записей, например `amount * 1.2 where category == "еда"`;
+        # без where значение считается для каждой записи
+        variables = variables or {}
+        ledger = self.records
+        if numpy is None:
+            expression = compile_expression(source)
+            values = []
+            for row in ledger.expression_rows(expression.names):
+                row = dict(variables, **row)
+                if expression.condition is None or expression.condition(row):
+                    values.append(expression(row))
+            return values
+        expression = compile_expression(source, vector=True)
+        columns = dict(variables, **ledger.expression_columns(expression.names & set(FINANCE_EXPRESSION_COLUMNS)))
+        shape = (len(ledger),)
+        with numpy.errstate(all='ignore'):
+            values = numpy.broadcast_to(expression(columns), shape)
+            if expression.condition is not None:
+                values = values[numpy.broadcast_to(expression.condition(columns), shape).astype(bool)]
+        return values
+
+    def recategorize_records(self, old_category, new_category):
+        with self.transaction():
+            records = [record for record in self.iter_items() if record.category == old_category]
+            for record in records:
+                self.change_item(record, category=new_category)
+        print(f"Категория изменена у записей: {len(records)}")
 
     def delete_record(self, record_id):
         record = self.get_record_by_id(record_id)
         if record:
-            self.records.remove(record)
-            self.save_records()
+            try:
+                self.remove_item(record)
+            except ConflictError as e:
+                print(f'Запись не удалена: {e}')
+                return False
             print('Запись успешно удалена!')
-        else:
-            print('Запись не найдена.')
+            return True
+        print('Запись не найдена.')
+        return False
 
     def get_record_by_id(self, record_id):
-        for record in self.records:
-            if record.id == record_id:
-                return record
-        return None
+        return self.get_item(record_id)
+
+    def export_records(self, target, start_date=None, end_date=None, **options):
+        # Диапазон дат отбирается по колонке дат (или индексу SQLite), а не фильтром по объектам
+        if start_date or end_date:
+            start_date_obj = parse_date(start_date) if start_date else datetime.date.min
+            end_date_obj = parse_date(end_date) if end_date else datetime.date.max
+            if start_date_obj is None or end_date_obj is None:
+                raise ValueError('Некорректный формат даты.')
+            if self._items is None:
+                params = (start_date_obj.isoformat(), end_date_obj.isoformat())
+                options['items'] = itertools.starmap(FinanceRecord, self.store.select('date_key BETWEEN ? AND ?', params))
+            else:
+                positions = self.records.positions_between(start_date_obj.toordinal(), end_date_obj.toordinal())
+                options['items'] = (self.records.record(position) for position in positions)
+        return self.export_items(target, **options)
 
-    def export_records_to_csv(self):
-        if not self.records:
+    def export_records_to_csv(self, file_name='finance_export.csv'):
+        if not self.count_items():
             print('Финансовых записей нет.')
             return
-        file_name = 'finance_export.csv'
-        with open(file_name, mode='w', encoding='utf-8', newline='') as csv_file:
-            fieldnames = ['ID', 'Сумма', 'Категория', 'Дата', 'Описание']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
-            for record in self.records:
-                writer.writerow({
-                    'ID': record.id,
-                    'Сумма': record.amount,
-                    'Категория': record.category,
-                    'Дата': record.date,
-                    'Описание': record.description
-                })
+        self.export_items(file_name)
         print(f'Финансовые записи успешно экспортированы в файл {file_name}')
 
-    def import_records_from_csv(self):
-        file_name = input('Введите имя CSV-файла для импорта: ')
+    @staticmethod
+    def record_from_csv(row, next_id):
+        amount = float(row.get('Сумма', '0'))
+        category = row.get('Категория', '')
+        date = row.get('Дата', datetime.datetime.now().strftime('%d-%m-%Y'))
+        description = row.get('Описание', '')
+        return FinanceRecord(next_id, amount, category, date, description)
+
+    @staticmethod
+    def record_fingerprint(record):
+        # Дата, сумма до копеек и описание без учёта регистра и лишних пробелов
+        ordinal = parse_ordinal(record.date) if isinstance(record.date, str) else 0
+        description = ' '.join((record.description or '').lower().split())
+        yield ordinal or record.date, round(float(record.amount), 2), description
+
+    def import_index(self, mode):
+        return ImportIndex.build(self.iter_items(), self.record_fingerprint, unique=False, mode=mode)
+
+    def import_records_from_csv(self, file_name=None, batch_size=IMPORT_BATCH_SIZE, progress=print_import_progress,
+                                mode='append', workers=None):
+        if file_name is None:
+            file_name = input('Введите имя CSV-файла, каталог или шаблон (*.csv) для импорта: ')
+        if is_import_pattern(file_name):
+            imported = self.import_csv_files(file_name, self.record_from_csv, mode, workers)
+            if imported is not None:
+                print('Финансовые записи успешно импортированы из CSV-файла.')
+            return imported
         if not os.path.exists(file_name):
             print('Файл не найден.')
             return
-        with open(file_name, mode='r', encoding='utf-8') as csv_file:
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                record_id = max([record.id for record in self.records], default=0) + 1
-                amount = float(row.get('Сумма', '0'))
-                category = row.get('Категория', '')
-                date = row.get('Дата', datetime.datetime.now().strftime('%d-%m-%Y'))
-                description = row.get('Описание', '')
-                new_record = FinanceRecord(record_id, amount, category, date, description)
-                self.records.append(new_record)
-            self.save_records()
+        dedup = self.import_index(mode) if mode != 'append' else None
+        imported, errors = self.import_rows(read_csv_rows(file_name), self.record_from_csv, batch_size, progress,
+                                            dedup)
+        report_import(imported, errors, dedup)
         print('Финансовые записи успешно импортированы из CSV-файла.')
+        return imported
+
 
+SESSION = {}
+
+def get_manager(manager_class):
+    # Один менеджер на процесс: хранилище читается при первом обращении,
+    # а дальше перечитываются только изменения, появившиеся на диске
+    manager = SESSION.get(manager_class)
+    if manager is None:
+        manager = SESSION[manager_class] = manager_class()
+    else:
+        manager.refresh()
+    return manager
+
+
+def browse_pages(manager, size=PAGE_SIZE, sort='id'):
+    # Постраничный просмотр: на экране одна страница, курсоры хранят место между страницами
+    page = manager.page_items(size=size, sort=sort)
+    if not page.items:
+        print(manager.empty_message)
+        return
+    while True:
+        manager.print_items(page.items)
+        choice = input('Enter — следующая страница, п — предыдущая, в — выход: ').strip().lower()
+        if choice == 'в':
+            break
+        if choice == 'п':
+            cursor, backward = page.before, True
+        else:
+            cursor, backward = page.after, False
+        if cursor is None:
+            print('Это первая страница.' if backward else 'Это последняя страница.')
+            continue
+        following = manager.page_items(cursor, size, sort, backward=backward)
+        if following.items:
+            page = following
+        else:
+            print('Больше записей нет.')
 
 def notes_menu():
-    manager = NoteManager()
+    manager = get_manager(NoteManager)
     while True:
+        manager.refresh()
         print('\nУправление заметками:')
         print('1. Добавить новую заметку')
         print('2. Просмотреть список заметок')
@@ -448,12 +4182,52 @@ def notes_menu():
         print('5. Удалить заметку')
         print('6. Экспорт заметок в CSV')
         print('7. Импорт заметок из CSV')
-        print('8. Назад')
+        print('8. Поиск заметок')
+        print('9. Назад')
         choice = input('Выберите действие: ')
+        if choice == '1':
+            title = input('Введите заголовок заметки: ')
+            content = input('Введите содержимое заметки: ')
+            manager.add_note(title, content)
+        elif choice == '2':
+            browse_pages(manager)
+        elif choice == '3':
+            try:
+                note_id = int(input('Введите ID заметки: '))
+                manager.view_note(note_id)
+            except ValueError:
+                print('Некорректный ID.')
+        elif choice == '4':
+            try:
+                note_id = int(input('Введите ID заметки: '))
+                title = input('Введите новый заголовок: ')
+                content = input('Введите новое содержимое: ')
+                manager.edit_note(note_id, title, content)
+            except ValueError:
+                print('Некорректный ID.')
+        elif choice == '5':
+            try:
+                note_id = int(input('Введите ID заметки: '))
+                manager.delete_note(note_id)
+            except ValueError:
+                print('Некорректный ID.')
+        elif choice == '6':
+            manager.export_notes_to_csv()
+        elif choice == '7':
+            file_name = input('Введите имя CSV-файла для импорта: ')
+            manager.import_notes_from_csv(file_name)
+        elif choice == '8':
+            query = input('Введите слова для поиска: ')
+            manager.search_notes(query)
+        elif choice == '9':
+            break
+        else:
+            print('Некорректный выбор. Попробуйте снова.')
 
 def tasks_menu():
-    manager = TaskManager()
+    manager = get_manager(TaskManager)
     while True:
+        manager.refresh()
         print('\nУправление задачами:')
         print('1. Добавить новую задачу')
         print('2. Просмотреть все задачи')
@@ -462,7 +4236,9 @@ def tasks_menu():
         print('5. Удалить задачу')
         print('6. Экспорт задач в CSV')
         print('7. Импорт задач из CSV')
-        print('8. Назад')
+        print('8. Повестка на сегодня')
+        print('9. Ближайшие задачи')
+        print('10. Назад')
         choice = input('Выберите действие: ')
         if choice == '1':
             title = input('Введите название задачи: ')
@@ -471,7 +4247,7 @@ def tasks_menu():
             due_date = input('Введите срок выполнения (в формате ДД-ММ-ГГГГ): ')
             manager.add_task(title, description, priority, due_date)
         elif choice == '2':
-            manager.list_tasks()
+            browse_pages(manager)
         elif choice == '3':
             try:
                 task_id = int(input('Введите ID задачи: '))
@@ -497,15 +4273,32 @@ def tasks_menu():
         elif choice == '6':
             manager.export_tasks_to_csv()
         elif choice == '7':
-            manager.import_tasks_from_csv()
+            file_name = input('Введите имя CSV-файла для импорта: ')
+            if os.path.exists(file_name):
+                manager.import_tasks_from_csv(file_name)
+            else:
+                print('Файл не найден.')
         elif choice == '8':
+            manager.show_agenda()
+        elif choice == '9':
+            try:
+                limit = int(input('Сколько задач показать: ') or 10)
+                manager.print_task_list(manager.upcoming_tasks(limit), 'Нет предстоящих задач.')
+            except ValueError:
+                print('Некорректное число.')
+        elif choice == '10':
             break
         else:
             print('Некорректный выбор. Попробуйте снова.')
 
+def ask_import_mode():
+    choice = input('Дубликаты: 1 — пропускать, 2 — обновлять найденные записи, 3 — добавлять все [1]: ').strip()
+    return {'2': 'upsert', '3': 'append'}.get(choice, 'skip')
+
 def contacts_menu():
-    manager = ContactManager()
+    manager = get_manager(ContactManager)
     while True:
+        manager.refresh()
         print('\nУправление контактами:')
         print('1. Добавить новый контакт')
         print('2. Поиск контакта')
@@ -541,15 +4334,16 @@ def contacts_menu():
         elif choice == '5':
             manager.export_contacts_to_csv()
         elif choice == '6':
-            manager.import_contacts_from_csv()
+            manager.import_contacts_from_csv(mode=ask_import_mode())
         elif choice == '7':
             break
         else:
             print('Некорректный выбор. Попробуйте снова.')
 
 def finance_menu():
-    manager = FinanceManager()
+    manager = get_manager(FinanceManager)
     while True:
+        manager.refresh()
         print('\nУправление финансовыми записями:')
         print('1. Добавить новую запись')
         print('2. Просмотреть все записи')
@@ -557,7 +4351,8 @@ def finance_menu():
         print('4. Удалить запись')
         print('5. Экспорт финансовых записей в CSV')
         print('6. Импорт финансовых записей из CSV')
-        print('7. Назад')
+        print('7. Отчёт по категориям и периодам')
+        print('8. Назад')
         choice = input('Выберите действие: ')
         if choice == '1':
             try:
@@ -569,7 +4364,7 @@ def finance_menu():
             except ValueError:
                 print('Некорректный ввод суммы.')
         elif choice == '2':
-            manager.list_records()
+            browse_pages(manager)
         elif choice == '3':
             start_date = input('Введите начальную дату (ДД-ММ-ГГГГ): ')
             end_date = input('Введите конечную дату (ДД-ММ-ГГГГ): ')
@@ -583,22 +4378,66 @@ def finance_menu():
         elif choice == '5':
             manager.export_records_to_csv()
         elif choice == '6':
-            manager.import_records_from_csv()
+            manager.import_records_from_csv(mode=ask_import_mode())
         elif choice == '7':
+            period = {'2': 'week', '3': 'year'}.get(input('Период: 1 — месяц, 2 — неделя, 3 — год [1]: ').strip(), 'month')
+            start_date = parse_date(input('Начальная дата (ДД-ММ-ГГГГ, пусто — с начала): '))
+            end_date = parse_date(input('Конечная дата (ДД-ММ-ГГГГ, пусто — до конца): '))
+            manager.print_category_report(period, start_date, end_date)
+            file_name = input('Сохранить в CSV (имя файла, пусто — не сохранять): ').strip()
+            if file_name:
+                manager.export_category_report(file_name, period, start_date, end_date)
+                print(f'Отчёт сохранён в файле {file_name}')
+        elif choice == '8':
             break
         else:
             print('Некорректный выбор. Попробуйте снова.')
 
+ASSIGNMENT_RE = re.compile(r'^\s*([A-Za-z_]\w*)\s*=(?!=)(.*)$')
+
+def summarize_values(values):
+    values = list(values)
+    numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    summary = {'count': len(values)}
+    if numbers:
+        summary.update(sum=math.fsum(numbers), mean=math.fsum(numbers) / len(numbers),
+                       min=min(numbers), max=max(numbers))
+    return summary
+
+def calculate(expression, variables):
+    # Выражение с колонками финансов (или с where) считается над всеми записями
+    compiled = compile_expression(expression)
+    if compiled.condition is not None or compiled.names & (set(FINANCE_EXPRESSION_COLUMNS) - set(variables)):
+        values = get_manager(FinanceManager).evaluate(expression, variables)
+        return summarize_values(values.tolist() if hasattr(values, 'tolist') else values)
+    return compiled(variables)
+
 def calculator_menu():
+    variables = {}
     while True:
         expression = input("\nВведите выражение для вычисления (или 'выход' для выхода): ")
         if expression.lower() == "выход":
             break
+        # «x = выражение» сохраняет результат в переменную для следующих выражений
+        name = None
+        match = ASSIGNMENT_RE.match(expression)
+        if match:
+            name, expression = match.groups()
+        # Вывод тоже внутри try: перевод огромного числа в строку сам бросает ValueError
         try:
-            result = eval(expression)
+            result = calculate(expression, variables)
+            if isinstance(result, dict):
+                print(f"Записей: {result['count']}")
+                if 'sum' in result:
+                    print(f"Сумма: {result['sum']}, среднее: {result['mean']}, "
+                          f"минимум: {result['min']}, максимум: {result['max']}")
+                continue
             print(f"Результат: {result}")
-        except Exception as e:
-            print(f"Ошибка: {e}")
+        except (ExpressionError, ArithmeticError, ValueError, TypeError, MemoryError) as e:
+            print(f"Ошибка: {e or type(e).__name__}")
+            continue
+        if name:
+            variables[name] = result
 
 def main_menu():
     while True:
@@ -627,5 +4466,696 @@ def main_menu():
         else:
             print('Некорректный выбор. Попробуйте снова.')
 
+
+STATS_ENV = 'PA_STATS'
+PROFILE_TOP = 30
+TRACE_MEMORY_TOP = 10
+STATS = None
+
+
+class Stats:
+    # Время и число вызовов по точкам замера плюс счётчики: байты, строки, созданные объекты
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def add(self, name, seconds, calls=1):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0]
+        timing[0] += calls
+        timing[1] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self, stream=None):
+        stream = stream or sys.stderr
+        if not self.timings and not self.counters:
+            return
+        width = max(len(name) for name in itertools.chain(self.timings, self.counters))
+        print(f'\n{"Точка замера":<{width}} {"вызовов":>9} {"всего, мс":>11} {"среднее, мкс":>13}', file=stream)
+        for name, (calls, seconds) in sorted(self.timings.items(), key=lambda item: -item[1][1]):
+            average = seconds / calls * 1e6 if calls else 0.0
+            print(f'{name:<{width}} {calls:>9} {seconds * 1000:>11.2f} {average:>13.1f}', file=stream)
+        if self.counters:
+            print(f'\n{"Счётчик":<{width}} {"значение":>9}', file=stream)
+            for name, value in sorted(self.counters.items()):
+                print(f'{name:<{width}} {value:>9}', file=stream)
+
+
+def timed_generator(name, generator):
+    # Время генератора набегает во время обхода, а не при вызове функции
+    seconds = 0.0
+    produced = 0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                value = next(generator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - started
+            produced += 1
+            yield value
+    finally:
+        STATS.add(name, seconds, calls=0)
+        STATS.count(f'{name}: элементов', produced)
+
+def timed(name, function, before=None, after=None):
+    # before(args) снимает состояние до вызова, after(args, result, state) пополняет счётчики
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        state = before(args) if before else None
+        started = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            STATS.add(name, time.perf_counter() - started)
+        if after:
+            after(args, result, state)
+        if inspect.isgenerator(result):
+            return timed_generator(name, result)
+        return result
+    return wrapper
+
+def counted(name, function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        STATS.count(name)
+        return function(*args, **kwargs)
+    return wrapper
+
+def file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+def count_read(args, result, state):
+    STATS.count('байт прочитано', file_size(args[0]))
+
+def count_written(args, result, state):
+    STATS.count('байт записано', file_size(args[0]))
+
+def count_sidecar_read(args, result, state):
+    if result is not None:
+        count_read(args, result, state)
+
+def count_journal_read(args, result, state):
+    STATS.count('байт прочитано', max(0, result[1] - args[1]))
+
+def journal_size(args):
+    return file_size(args[0].journal_path)
+
+def count_journal_written(args, result, state):
+    # При сжатии журнал удаляется, а снимок учитывается в save_data
+    STATS.count('байт записано', max(0, journal_size(args) - state))
+
+def instrument_class(klass, prefix=None, public=True, names=()):
+    # Методы базового класса оборачиваются отдельно для каждого наследника, чтобы
+    # в сводке было видно, какой менеджер их вызвал
+    prefix = prefix or klass.__name__
+    for name in names or dir(klass):
+        if public and name.startswith('_'):
+            continue
+        attribute = inspect.getattr_static(klass, name)
+        if inspect.isfunction(attribute):
+            setattr(klass, name, timed(f'{prefix}.{name}', attribute))
+
+def enable_stats():
+    # Обёртки ставятся только при включении статистики: без PA_STATS/--stats код работает как есть
+    global STATS
+    if STATS is not None:
+        return STATS
+    STATS = Stats()
+    module = globals()
+    module['load_data'] = timed('load_data', load_data, after=count_read)
+    module['save_data'] = timed('save_data', save_data, after=count_written)
+    module['load_sidecar'] = timed('load_sidecar', load_sidecar, after=count_sidecar_read)
+    module['save_sidecar'] = timed('save_sidecar', save_sidecar)
+    module['read_csv_rows'] = timed('read_csv_rows', read_csv_rows, after=count_read)
+    module['parse_date'] = timed('parse_date', parse_date)
+    JournalStore._read_journal = timed('JournalStore.read_journal', JournalStore._read_journal,
+                                       after=count_journal_read)
+    JournalStore._append = timed('JournalStore.append', JournalStore._append, before=journal_size,
+                                 after=count_journal_written)
+    instrument_class(JournalStore, names=('load', 'poll', 'compact'))
+    instrument_class(SqliteStore, names=('load', 'select', 'aggregate', 'get', 'put', 'put_many', 'delete', 'save'))
+    for manager_class in (NoteManager, TaskManager, ContactManager, FinanceManager):
+        instrument_class(manager_class)
+    for record_class in (Note, Task, Contact, FinanceRecord):
+        record_class.__init__ = counted(f'объектов: {record_class.__name__}', record_class.__init__)
+    atexit.register(STATS.report)
+    return STATS
+
+@contextlib.contextmanager
+def profiling(profile=None, trace_memory=False):
+    # Профиль одной команды: cProfile в файл (при «-» — сводка в stderr) и пик памяти по tracemalloc
+    profiler = cProfile.Profile() if profile else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            if profile == '-':
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(PROFILE_TOP)
+            else:
+                profiler.dump_stats(profile)
+                print(f'Профиль сохранён в {profile}', file=sys.stderr)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'Память: сейчас {current / 1024:.0f} КиБ, пик {peak / 1024:.0f} КиБ', file=sys.stderr)
+            for statistic in snapshot.statistics('lineno')[:TRACE_MEMORY_TOP]:
+                print(f'  {statistic}', file=sys.stderr)
+
+if os.environ.get(STATS_ENV, '') not in ('', '0'):
+    enable_stats()
+
+if os.environ.get(WRITE_BEHIND_ENV, '') not in ('', '0'):
+    try:
+        enable_write_behind(*parse_write_behind(os.environ[WRITE_BEHIND_ENV]))
+    except ValueError as e:
+        print(f'{WRITE_BEHIND_ENV}: {e}, отложенная запись выключена', file=sys.stderr)
+
+
+class CommandError(Exception):
+    pass
+
+
+def item_to_json(item):
+    return item.to_dict()
+
+def require_item(item, message):
+    if item is None:
+        raise CommandError(message)
+    return item
+
+def print_item(item):
+    for name, value in item_to_json(item).items():
+        print(f'{name}: {value}')
+
+def parse_cursor(value):
+    if value is None:
+        return None
+    try:
+        cursor = json.loads(value)
+    except ValueError:
+        cursor = None
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        raise CommandError('Курсор задаётся так, как его вернула предыдущая страница, например [10, 10].')
+    return cursor
+
+def cli_list(args, manager, print_items):
+    # С --limit, --after, --before или --sort выводится одна страница и курсоры соседних
+    if args.limit is None and args.after is None and args.before is None and args.sort == 'id':
+        if not args.json:
+            print_items()
+            return None
+        return [item_to_json(item) for item in manager.iter_items()]
+    backward = args.before is not None
+    page = manager.page_items(parse_cursor(args.before if backward else args.after), args.limit or PAGE_SIZE,
+                              args.sort, backward=backward)
+    cursors = {'before': page.before, 'after': page.after}
+    if not args.json:
+        manager.print_items(page.items)
+        for name, cursor in cursors.items():
+            if cursor is not None:
+                print(f'--{name} {shlex.quote(json.dumps(cursor, ensure_ascii=False))}')
+        return None
+    return dict(items=[item_to_json(item) for item in page.items], **cursors)
+
+def cli_export(args, manager):
+    options = {'fmt': args.format, 'fields': args.fields.split(',') if args.fields else None,
+               'compression': args.compress}
+    if args.since is not None:
+        if 'start' in args and (args.start or args.end):
+            raise CommandError('Разностную выгрузку нельзя ограничить датами.')
+        result = manager.export_changes(args.file, args.since, **options)
+        if result is None:
+            raise CommandError(f'Лог изменений не хранит изменения после номера {args.since}, нужна полная выгрузка.')
+        count, seq = result
+        if not args.json and args.file != '-':
+            print(f'Выгружено изменённых записей: {count} в файл {args.file}, следующая выгрузка: --since {seq}')
+        return {'file': args.file, 'count': count, 'seq': seq}
+    # Номер берётся до выгрузки: изменения, попавшие в неё позже, повторятся в следующей разностной
+    seq = manager.change_seq()
+    if isinstance(manager, FinanceManager):
+        count = manager.export_records(args.file, args.start, args.end, **options)
+    else:
+        count = manager.export_items(args.file, **options)
+    # При выгрузке в stdout итог не смешивается с данными
+    if not args.json and args.file != '-':
+        print(f'Выгружено записей: {count} в файл {args.file}, следующая выгрузка: --since {seq}')
+    return {'file': args.file, 'count': count, 'seq': seq}
+
+def cli_changes(args, manager):
+    events = manager.changes_since(args.since)
+    if events is None:
+        raise CommandError(f'Лог изменений не хранит изменения после номера {args.since}, нужна полная выгрузка.')
+    if not args.json:
+        write_lines(f'{seq} {op} {key}' for seq, op, key in events)
+    return [{'seq': seq, 'change': op, 'id': key} for seq, op, key in events]
+
+def cli_import(args, import_csv):
+    if not os.path.exists(args.file) and not ('workers' in args and import_sources(args.file)):
+        raise CommandError('Файл не найден.')
+    options = {'mode': args.mode, 'workers': args.workers} if 'mode' in args else {}
+    return {'file': args.file, 'imported': import_csv(args.file, batch_size=args.batch_size, **options)}
+
+def cli_notes(args):
+    manager = get_manager(NoteManager)
+    if args.action == 'add':
+        return item_to_json(manager.add_note(args.title, args.content))
+    if args.action == 'list':
+        return cli_list(args, manager, manager.list_notes)
+    if args.action == 'view':
+        note = require_item(manager.get_note_by_id(args.id), 'Заметка не найдена')
+        if not args.json:
+            manager.view_note(args.id)
+        return item_to_json(note)
+    if args.action == 'edit':
+        note = require_item(manager.get_note_by_id(args.id), 'Заметка не найдена')
+        title = note.title if args.title is None else args.title
+        content = note.content if args.content is None else args.content
+        if not manager.edit_note(args.id, title, content):
+            raise ConflictError('заметка изменена другим процессом')
+        return item_to_json(note)
+    if args.action == 'delete':
+        require_item(manager.get_note_by_id(args.id), 'Заметка не найдена')
+        if not manager.delete_note(args.id):
+            raise ConflictError('заметка изменена другим процессом')
+        return {'id': args.id}
+    if args.action == 'search':
+        if not args.json:
+            manager.search_notes(args.query, args.limit)
+            return None
+        return [dict(item_to_json(note), score=score) for note, score in manager.find_notes(args.query, args.limit)]
+    if args.action == 'export':
+        return cli_export(args, manager)
+    if args.action == 'changes':
+        return cli_changes(args, manager)
+    if args.action == 'import':
+        return cli_import(args, manager.import_notes_from_csv)
+
+def cli_tasks(args):
+    manager = get_manager(TaskManager)
+    if args.action == 'add':
+        return item_to_json(manager.add_task(args.title, args.description, args.priority, args.due))
+    if args.action == 'list':
+        return cli_list(args, manager, manager.list_tasks)
+    if args.action == 'done':
+        task = require_item(manager.get_task_by_id(args.id), 'Задача не найдена.')
+        if not manager.mark_task_done(args.id):
+            raise ConflictError('задача изменена другим процессом')
+        return item_to_json(task)
+    if args.action == 'edit':
+        task = require_item(manager.get_task_by_id(args.id), 'Задача не найдена.')
+        if not manager.edit_task(args.id, args.title, args.description, args.priority, args.due):
+            raise ConflictError('задача изменена другим процессом')
+        return item_to_json(task)
+    if args.action == 'delete':
+        require_item(manager.get_task_by_id(args.id), 'Задача не найдена.')
+        if not manager.delete_task(args.id):
+            raise ConflictError('задача изменена другим процессом')
+        return {'id': args.id}
+    today = None
+    if getattr(args, 'today', None):
+        today = parse_date(args.today)
+        if today is None:
+            raise CommandError('Некорректный формат даты.')
+    if args.action == 'overdue':
+        manager.mark_overdue_tasks_done(today)
+        return None
+    if args.action == 'upcoming':
+        tasks = manager.upcoming_tasks(args.limit, today)
+        if args.json:
+            return [item_to_json(task) for task in tasks]
+        manager.print_task_list(tasks, "Нет предстоящих задач.")
+        return None
+    if args.action == 'agenda':
+        today = today or datetime.date.today()
+        if args.json:
+            end_date = today + datetime.timedelta(days=max(args.days, 1) - 1)
+            return {'overdue': [item_to_json(task) for task in manager.overdue_tasks(today)],
+                    'due': [item_to_json(task) for task in manager.tasks_due_between(today, end_date)]}
+        manager.show_agenda(today, args.days)
+        return None
+    if args.action == 'export':
+        return cli_export(args, manager)
+    if args.action == 'changes':
+        return cli_changes(args, manager)
+    if args.action == 'import':
+        return cli_import(args, manager.import_tasks_from_csv)
+
+def cli_contacts(args):
+    manager = get_manager(ContactManager)
+    if args.action == 'add':
+        return item_to_json(manager.add_contact(args.name, args.phone, args.email))
+    if args.action == 'list':
+        return cli_list(args, manager, lambda: [print_item(contact) for contact in manager.iter_items()])
+    if args.action == 'search':
+        if not args.json:
+            manager.search_contacts(args.query, args.limit)
+            return None
+        return [item_to_json(contact) for contact in manager.find_contacts(args.query, args.limit)]
+    if args.action == 'edit':
+        contact = require_item(manager.get_contact_by_id(args.id), 'Контакт не найден.')
+        name = contact.name if args.name is None else args.name
+        phone = contact.phone if args.phone is None else args.phone
+        email = contact.email if args.email is None else args.email
+        if not manager.edit_contact(args.id, name, phone, email):
+            raise ConflictError('контакт изменён другим процессом')
+        return item_to_json(contact)
+    if args.action == 'delete':
+        require_item(manager.get_contact_by_id(args.id), 'Контакт не найден.')
+        if not manager.delete_contact(args.id):
+            raise ConflictError('контакт изменён другим процессом')
+        return {'id': args.id}
+    if args.action == 'export':
+        return cli_export(args, manager)
+    if args.action == 'changes':
+        return cli_changes(args, manager)
+    if args.action == 'import':
+        return cli_import(args, manager.import_contacts_from_csv)
+
+def cli_finance(args):
+    manager = get_manager(FinanceManager)
+    if args.action == 'add':
+        date = args.date or datetime.date.today().strftime('%d-%m-%Y')
+        return item_to_json(manager.add_record(args.amount, args.category, date, args.description))
+    if args.action == 'list':
+        return cli_list(args, manager, manager.list_records)
+    if args.action == 'report':
+        report = manager.generate_report(args.start, args.end)
+        if report is None:
+            raise CommandError('Некорректный формат даты.')
+        return report
+    if args.action == 'rollup':
+        dates = []
+        for value in (args.start, args.end):
+            date = parse_date(value) if value else None
+            if value and date is None:
+                raise CommandError('Некорректный формат даты.')
+            dates.append(date)
+        if args.output:
+            return {'file': args.output, 'rows': manager.export_category_report(args.output, args.period, *dates)}
+        if not args.json:
+            manager.print_category_report(args.period, *dates)
+            return None
+        return [dict(zip(('period', 'category', 'income', 'expenses', 'balance', 'count'), row))
+                for row in manager.category_report(args.period, *dates)]
+    if args.action == 'eval':
+        try:
+            values = manager.evaluate(args.expression)
+        except (ExpressionError, ArithmeticError, ValueError, TypeError) as e:
+            raise CommandError(f'Ошибка в выражении: {e}')
+        summary = summarize_values(values.tolist() if hasattr(values, 'tolist') else values)
+        if not args.json:
+            print(f"Записей: {summary['count']}")
+            if 'sum' in summary:
+                print(f"Сумма: {summary['sum']}, среднее: {summary['mean']}, "
+                      f"минимум: {summary['min']}, максимум: {summary['max']}")
+        return summary
+    if args.action == 'recategorize':
+        manager.recategorize_records(args.old, args.new)
+        return None
+    if args.action == 'delete':
+        require_item(manager.get_record_by_id(args.id), 'Запись не найдена.')
+        if not manager.delete_record(args.id):
+            raise ConflictError('запись изменена другим процессом')
+        return {'id': args.id}
+    if args.action == 'export':
+        return cli_export(args, manager)
+    if args.action == 'changes':
+        return cli_changes(args, manager)
+    if args.action == 'import':
+        return cli_import(args, manager.import_records_from_csv)
+
+def add_list_command(actions, manager_class):
+    command = actions.add_parser('list', help='все записи или одна страница по курсору')
+    command.add_argument('--limit', type=int, help='размер страницы')
+    command.add_argument('--after', help='курсор: страница после него')
+    command.add_argument('--before', help='курсор: страница перед ним')
+    command.add_argument('--sort', choices=['id', *manager_class.sort_keys], default='id')
+    return command
+
+def add_io_commands(actions, default_export):
+    command = actions.add_parser('export', help='выгрузка в CSV или JSON Lines')
+    command.add_argument('file', nargs='?', default=default_export, help='имя файла или «-» для stdout')
+    command.add_argument('--format', choices=['csv', 'jsonl'], help='по умолчанию определяется по расширению')
+    command.add_argument('--fields', help='список полей через запятую')
+    command.add_argument('--compress', choices=['gzip', 'xz'])
+    command.add_argument('--since', type=int, metavar='SEQ',
+                         help='только записи, изменённые после этого номера изменения (удалённые — отметкой)')
+    command = actions.add_parser('changes', help='лог изменений: номер, тип изменения и ID записи')
+    command.add_argument('--since', type=int, default=0, metavar='SEQ')
+    command = actions.add_parser('import', help='импорт из CSV')
+    command.add_argument('file')
+    command.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    return actions
+
+def add_import_mode(actions):
+    command = actions.choices['import']
+    command.add_argument(
+        '--mode', choices=IMPORT_MODES, default='skip',
+        help='дубликаты: skip — пропускать, upsert — обновлять найденные записи, append — добавлять все')
+    command.add_argument('--workers', type=int,
+                         help='процессов для разбора, когда file — каталог или шаблон (по умолчанию по числу ядер)')
+
+def write_behind_argument(value):
+    try:
+        return parse_write_behind(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='personal_assistant.py', description='Персональный помощник. '
+                                     'Без аргументов запускается интерактивное меню.')
+    parser.add_argument('--json', action='store_true', help='выводить результат в формате JSON')
+    parser.add_argument('--stats', action='store_true',
+                        help=f'при выходе вывести в stderr время и счётчики по операциям (то же, что {STATS_ENV}=1)')
+    parser.add_argument('--profile', metavar='FILE', help='профилировать команду cProfile; «-» — сводка в stderr')
+    parser.add_argument('--trace-memory', action='store_true', help='вывести пик памяти и места выделений')
+    parser.add_argument('--write-behind', action='store_true',
+                        help='отложенная запись в фоне: сброс через паузу после последней правки, но не позже '
+                             f'предела (то же, что {WRITE_BEHIND_ENV})')
+    parser.add_argument('--write-behind-interval', metavar='ПАУЗА[:ПРЕДЕЛ]', type=write_behind_argument,
+                        help='интервалы отложенной записи в секундах, включает её (по умолчанию '
+                             f'{WRITE_BEHIND_DEBOUNCE:g}:{WRITE_BEHIND_MAX_LATENCY:g})')
+    sections = parser.add_subparsers(dest='section', metavar='раздел')
+
+    actions = sections.add_parser('notes', help='заметки').add_subparsers(dest='action', required=True)
+    command = actions.add_parser('add')
+    command.add_argument('--title', required=True)
+    command.add_argument('--content', default='')
+    add_list_command(actions, NoteManager)
+    actions.add_parser('view').add_argument('id', type=int)
+    command = actions.add_parser('edit')
+    command.add_argument('id', type=int)
+    command.add_argument('--title')
+    command.add_argument('--content')
+    actions.add_parser('delete').add_argument('id', type=int)
+    command = actions.add_parser('search')
+    command.add_argument('query')
+    command.add_argument('--limit', type=int, default=10)
+    add_io_commands(actions, 'notes_export.csv')
+
+    actions = sections.add_parser('tasks', help='задачи').add_subparsers(dest='action', required=True)
+    command = actions.add_parser('add')
+    command.add_argument('--title', required=True)
+    command.add_argument('--description', default='')
+    command.add_argument('--priority', default='Средний')
+    command.add_argument('--due', default='', help='срок в формате ДД-ММ-ГГГГ')
+    add_list_command(actions, TaskManager)
+    actions.add_parser('done').add_argument('id', type=int)
+    command = actions.add_parser('edit')
+    command.add_argument('id', type=int)
+    command.add_argument('--title')
+    command.add_argument('--description')
+    command.add_argument('--priority')
+    command.add_argument('--due')
+    actions.add_parser('delete').add_argument('id', type=int)
+    actions.add_parser('overdue', help='отметить просроченные задачи выполненными').add_argument(
+        '--today', help='дата отсчёта в формате ДД-ММ-ГГГГ')
+    command = actions.add_parser('upcoming', help='ближайшие невыполненные задачи по сроку')
+    command.add_argument('--limit', type=int, default=10)
+    command.add_argument('--today', help='дата отсчёта в формате ДД-ММ-ГГГГ')
+    command = actions.add_parser('agenda', help='просроченные задачи и задачи на ближайшие дни по приоритету')
+    command.add_argument('--days', type=int, default=1)
+    command.add_argument('--today', help='дата отсчёта в формате ДД-ММ-ГГГГ')
+    add_io_commands(actions, 'tasks_export.csv')
+
+    actions = sections.add_parser('contacts', help='контакты').add_subparsers(dest='action', required=True)
+    command = actions.add_parser('add')
+    command.add_argument('--name', required=True)
+    command.add_argument('--phone', default='')
+    command.add_argument('--email', default='')
+    add_list_command(actions, ContactManager)
+    command = actions.add_parser('search')
+    command.add_argument('query')
+    command.add_argument('--limit', type=int, default=CONTACT_SEARCH_LIMIT)
+    command = actions.add_parser('edit')
+    command.add_argument('id', type=int)
+    command.add_argument('--name')
+    command.add_argument('--phone')
+    command.add_argument('--email')
+    actions.add_parser('delete').add_argument('id', type=int)
+    add_io_commands(actions, 'contacts_export.csv')
+    add_import_mode(actions)
+
+    actions = sections.add_parser('finance', help='финансы').add_subparsers(dest='action', required=True)
+    command = actions.add_parser('add')
+    command.add_argument('--amount', type=float, required=True, help='доход — положительное число, расход — отрицательное')
+    command.add_argument('--category', required=True)
+    command.add_argument('--date', default=None, help='дата в формате ДД-ММ-ГГГГ, по умолчанию сегодня')
+    command.add_argument('--description', default='')
+    add_list_command(actions, FinanceManager)
+    command = actions.add_parser('report')
+    command.add_argument('--from', dest='start', required=True)
+    command.add_argument('--to', dest='end', required=True)
+    command = actions.add_parser('rollup', help='доходы и расходы по категориям за месяцы, недели или годы')
+    command.add_argument('--period', choices=ROLLUP_PERIODS, default='month')
+    command.add_argument('--from', dest='start', help='дата в формате ДД-ММ-ГГГГ')
+    command.add_argument('--to', dest='end', help='дата в формате ДД-ММ-ГГГГ')
+    command.add_argument('--output', help='CSV-файл или «-» для stdout')
+    command = actions.add_parser('eval', help='выражение над всеми записями, например: amount * 1.2 where category == "еда"')
+    command.add_argument('expression')
+    command = actions.add_parser('recategorize')
+    command.add_argument('old')
+    command.add_argument('new')
+    actions.add_parser('delete').add_argument('id', type=int)
+    add_io_commands(actions, 'finance_export.csv')
+    add_import_mode(actions)
+    command = actions.choices['export']
+    command.add_argument('--from', dest='start')
+    command.add_argument('--to', dest='end')
+
+    command = sections.add_parser('batch', help='выполнить команды из файла или stdin, по одной в строке')
+    command.add_argument('file', nargs='?', default='-')
+    command.add_argument('--transaction', action='store_true',
+                         help='записать все изменения одной порцией в конце пакета')
+    command.add_argument('--stop-on-error', action='store_true',
+                         help='остановиться на первой ошибке (вместе с --transaction пакет отменяется целиком)')
+
+    parser.set_defaults(handler=None)
+    for section, handler in (('notes', cli_notes), ('tasks', cli_tasks),
+                             ('contacts', cli_contacts), ('finance', cli_finance)):
+        sections.choices[section].set_defaults(handler=handler)
+    return parser
+
+def run_command(parser, argv):
+    # Вывод менеджеров перехватывается и возвращается вместе с результатом
+    response = {'command': argv}
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            args = parser.parse_args(argv)
+            if args.handler is None:
+                raise CommandError('Команда не поддерживается в пакетном режиме.')
+            args.json = True
+            response['result'] = args.handler(args)
+        response['ok'] = True
+    except SystemExit as e:
+        response['ok'] = e.code == 0
+    except (CommandError, ConflictError, ValueError, OSError, csv.Error, sqlite3.Error) as e:
+        response['ok'] = False
+        response['error'] = str(e)
+    response['messages'] = output.getvalue().splitlines()
+    return response
+
+def read_batch_commands(file_name):
+    # Команда — строка в синтаксисе shell или JSON-массив аргументов; пустые строки и # пропускаются
+    stream = sys.stdin if file_name == '-' else open(file_name, encoding='utf-8')
+    with stream:
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if line.startswith('['):
+                    argv = json.loads(line)
+                    if not isinstance(argv, list):
+                        raise ValueError('ожидался массив аргументов')
+                    yield line_number, [str(arg) for arg in argv]
+                else:
+                    yield line_number, shlex.split(line)
+            except ValueError as e:
+                yield line_number, e
+
+def run_batch(parser, args):
+    failed = 0
+
+    def run_all():
+        nonlocal failed
+        for line_number, argv in read_batch_commands(args.file):
+            if isinstance(argv, Exception):
+                response = {'command': None, 'ok': False, 'error': f'Строка {line_number}: {argv}', 'messages': []}
+            else:
+                response = run_command(parser, argv)
+            response['line'] = line_number
+            print(json.dumps(response, ensure_ascii=False))
+            if not response['ok']:
+                failed += 1
+                if args.stop_on_error:
+                    raise CommandError(f'Пакет остановлен на строке {line_number}')
+
+    try:
+        if args.transaction:
+            with transaction(*(get_manager(manager_class)
+                               for manager_class in (NoteManager, TaskManager, ContactManager, FinanceManager))):
+                run_all()
+        else:
+            run_all()
+    except CommandError as e:
+        error = f'{e}, изменения пакета отменены' if args.transaction else str(e)
+        print(json.dumps({'ok': False, 'error': error}, ensure_ascii=False))
+    sys.stdout.flush()
+    return 1 if failed else 0
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        main_menu()
+        return 0
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.stats:
+        enable_stats()
+    if args.write_behind_interval:
+        args.write_behind = True
+        enable_write_behind(*args.write_behind_interval)
+    elif args.write_behind:
+        enable_write_behind()
+    with profiling(args.profile, args.trace_memory):
+        return run_main(parser, args, argv)
+
+def run_main(parser, args, argv):
+    if args.section == 'batch':
+        return run_batch(parser, args)
+    if args.handler is None:
+        if args.stats or args.profile or args.trace_memory or args.write_behind:
+            main_menu()
+            return 0
+        parser.print_help()
+        return 2
+    if args.json:
+        response = run_command(parser, argv)
+        print(json.dumps(response, ensure_ascii=False))
+        return 0 if response['ok'] else 1
+    try:
+        args.handler(args)
+    except (CommandError, ConflictError, ValueError, OSError, csv.Error, sqlite3.Error) as e:
+        print(f'Ошибка: {e}')
+        return 1
+    return 0
+
 if __name__ == '__main__':
-    main_menu()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,417 @@
+import io
+import sys
+import json
+import signal
+import asyncio
+import argparse
+import datetime
+import itertools
+import collections
+import urllib.parse
+import concurrent.futures
+
+import personal_assistant as pa
+
+MAX_BODY_SIZE = 1024 * 1024
+LIST_LIMIT = 100
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               409: 'Conflict', 410: 'Gone', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise ValueError('ожидалась строка')
+    return value
+
+def flag(value):
+    if not isinstance(value, bool):
+        raise ValueError('ожидалось true или false')
+    return value
+
+def number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('ожидалось число')
+    return float(value)
+
+
+# Поля, которые можно передавать в запросах, и значения по умолчанию для новых записей
+SECTIONS = {
+    'notes': {
+        'manager': pa.NoteManager,
+        'fields': {'title': text, 'content': text},
+        'required': ('title',),
+        'defaults': {'content': ''},
+        'search': lambda manager, query, limit: [dict(pa.item_to_json(note), score=score)
+                                                 for note, score in manager.find_notes(query, limit)],
+    },
+    'tasks': {
+        'manager': pa.TaskManager,
+        'fields': {'title': text, 'description': text, 'done': flag, 'priority': text, 'due_date': text},
+        'required': ('title',),
+        'defaults': {'description': '', 'done': False, 'priority': 'Средний', 'due_date': ''},
+        'search': None,
+    },
+    'contacts': {
+        'manager': pa.ContactManager,
+        'fields': {'name': text, 'phone': text, 'email': text},
+        'required': ('name',),
+        'defaults': {'phone': '', 'email': ''},
+        'search': lambda manager, query, limit: [pa.item_to_json(contact)
+                                                 for contact in manager.find_contacts(query, limit)],
+    },
+    'finance': {
+        'manager': pa.FinanceManager,
+        'fields': {'amount': number, 'category': text, 'date': text, 'description': text},
+        'required': ('amount', 'category'),
+        'defaults': {'date': None, 'description': ''},
+        'search': None,
+    },
+}
+
+
+def read_fields(section, body, partial):
+    if not isinstance(body, dict):
+        raise HttpError(400, 'Ожидался JSON-объект')
+    fields = {}
+    for name, value in body.items():
+        if name == 'version':
+            continue
+        convert = section['fields'].get(name)
+        if convert is None:
+            raise HttpError(400, f'Неизвестное поле: {name}')
+        try:
+            fields[name] = convert(value)
+        except ValueError as e:
+            raise HttpError(400, f'Поле {name}: {e}')
+    if not partial:
+        missing = [name for name in section['required'] if name not in fields]
+        if missing:
+            raise HttpError(400, f'Не заданы поля: {", ".join(missing)}')
+    return fields
+
+def now_timestamp():
+    return datetime.datetime.now().strftime("%d-%m-%Y %H:%M:%S")
+
+
+# Операции ниже выполняются в рабочем потоке и возвращают готовые для JSON данные
+
+def list_items(manager, offset, limit, after=None):
+    # after — ID последней полученной записи: следующая страница без пропуска offset записей
+    if after is not None:
+        page = manager.page_items([after, after], limit)
+        return {'items': [pa.item_to_json(item) for item in page.items],
+                'after': page.after[1] if page.after else None, 'total': manager.count_items()}
+    items = itertools.islice(manager.iter_items(), offset, offset + limit)
+    return {'items': [pa.item_to_json(item) for item in items], 'total': manager.count_items()}
+
+def list_changes(manager, since):
+    # Изменения после since и номер, с которого запрашивать следующие
+    events = manager.changes_since(since)
+    if events is None:
+        raise HttpError(410, 'Лог изменений не хранит изменения после этого номера, нужна полная выгрузка')
+    return {'changes': [{'seq': seq, 'change': op, 'id': key} for seq, op, key in events],
+            'seq': events[-1][0] if events else since}
+
+def get_item(manager, key):
+    item = manager.get_item(key)
+    if item is None:
+        raise HttpError(404, 'Запись не найдена')
+    return pa.item_to_json(item)
+
+def create_item(manager, section, fields):
+    fields = dict(section['defaults'], **fields)
+    if isinstance(manager, pa.NoteManager):
+        fields['timestamp'] = now_timestamp()
+    item = manager.record_class(manager.next_key(), **fields)
+    manager.insert_item(item)
+    return pa.item_to_json(item)
+
+def check_version(item, version):
+    # Клиент может передать версию, которую он читал: тогда любое изменение после неё — конфликт
+    if version is not None and item.version != version:
+        raise HttpError(409, f'Запись изменена: текущая версия {item.version}')
+
+def update_item(manager, key, fields, version):
+    item = manager.get_item(key)
+    if item is None:
+        raise HttpError(404, 'Запись не найдена')
+    check_version(item, version)
+    if isinstance(manager, pa.NoteManager):
+        fields['timestamp'] = now_timestamp()
+    try:
+        manager.change_item(item, **fields)
+    except pa.ConflictError as e:
+        raise HttpError(409, str(e))
+    return pa.item_to_json(item)
+
+def delete_item(manager, key, version):
+    item = manager.get_item(key)
+    if item is None:
+        raise HttpError(404, 'Запись не найдена')
+    check_version(item, version)
+    try:
+        manager.remove_item(item)
+    except pa.ConflictError as e:
+        raise HttpError(409, str(e))
+    return {'id': key}
+
+def finance_report(manager, start_date, end_date, fmt):
+    start_date_obj = pa.parse_date(start_date)
+    end_date_obj = pa.parse_date(end_date)
+    if start_date_obj is None or end_date_obj is None:
+        raise HttpError(400, 'Некорректный формат даты, ожидается ДД-ММ-ГГГГ')
+    if fmt == 'csv':
+        stream = io.StringIO()
+        manager.export_records(stream, start_date, end_date, fmt='csv')
+        return stream.getvalue()
+    return dict(manager.range_totals(start_date_obj, end_date_obj), start=start_date, end=end_date)
+
+
+class Backend:
+    # Менеджеры и общее соединение SQLite не потокобезопасны, поэтому все обращения к ним
+    # идут через один рабочий поток; цикл событий только разбирает запросы и пишет ответы.
+    # Записи, накопившиеся, пока поток занят, фиксируются одной транзакцией (group commit)
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        self.writes = collections.deque()
+        self.scheduled = False
+
+    async def read(self, manager_class, operation, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._read, manager_class, operation, args)
+
+    def _read(self, manager_class, operation, args):
+        return operation(pa.get_manager(manager_class), *args)
+
+    async def write(self, manager_class, operation, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.writes.append((manager_class, operation, args, future))
+        if not self.scheduled:
+            self.scheduled = True
+            loop.run_in_executor(self.executor, self._flush, loop)
+        return await future
+
+    def _flush(self, loop):
+        # Флаг сбрасывается до разбора очереди: запись, добавленная после этого, запланирует новый проход
+        self.scheduled = False
+        batch = []
+        while self.writes:
+            batch.append(self.writes.popleft())
+        if not batch:
+            return
+        managers = {manager_class: pa.get_manager(manager_class) for manager_class, _, _, _ in batch}
+        results = []
+        try:
+            with pa.transaction(*managers.values()):
+                for manager_class, operation, args, future in batch:
+                    try:
+                        results.append((future, operation(managers[manager_class], *args), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            results = [(future, None, e) for _, _, _, future in batch]
+        for future, result, error in results:
+            loop.call_soon_threadsafe(settle, future, result, error)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def settle(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def query_int(query, name, default):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise HttpError(400, f'Параметр {name} должен быть целым числом')
+    if value < 0:
+        raise HttpError(400, f'Параметр {name} не может быть отрицательным')
+    return value
+
+def parse_body(body):
+    try:
+        return json.loads(body or b'{}')
+    except ValueError:
+        raise HttpError(400, 'Некорректный JSON')
+
+def body_version(body):
+    version = body.get('version') if isinstance(body, dict) else None
+    if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+        raise HttpError(400, 'Поле version должно быть целым числом')
+    return version
+
+
+async def dispatch(backend, method, target, body):
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    parts = [part for part in url.path.split('/') if part]
+    if not parts or parts[0] not in SECTIONS or len(parts) > 2:
+        raise HttpError(404, 'Адрес не найден')
+    section = SECTIONS[parts[0]]
+    manager_class = section['manager']
+
+    if len(parts) == 1:
+        if method == 'GET':
+            after = query_int(query, 'after', 0) if 'after' in query else None
+            return 200, await backend.read(manager_class, list_items, query_int(query, 'offset', 0),
+                                           query_int(query, 'limit', LIST_LIMIT), after)
+        if method == 'POST':
+            fields = read_fields(section, parse_body(body), partial=False)
+            return 201, await backend.write(manager_class, create_item, section, fields)
+        raise HttpError(405, 'Метод не поддерживается')
+
+    if parts[1] == 'search':
+        if section['search'] is None:
+            raise HttpError(404, 'Поиск в этом разделе не поддерживается')
+        if method != 'GET':
+            raise HttpError(405, 'Метод не поддерживается')
+        if not query.get('q'):
+            raise HttpError(400, 'Не задан параметр q')
+        return 200, await backend.read(manager_class, section['search'], query['q'], query_int(query, 'limit', 10))
+
+    if parts[1] == 'changes':
+        if method != 'GET':
+            raise HttpError(405, 'Метод не поддерживается')
+        return 200, await backend.read(manager_class, list_changes, query_int(query, 'since', 0))
+
+    if parts[0] == 'finance' and parts[1] == 'report':
+        if method != 'GET':
+            raise HttpError(405, 'Метод не поддерживается')
+        if 'from' not in query or 'to' not in query:
+            raise HttpError(400, 'Не заданы параметры from и to')
+        return 200, await backend.read(manager_class, finance_report, query['from'], query['to'], query.get('format'))
+
+    try:
+        key = int(parts[1])
+    except ValueError:
+        raise HttpError(404, 'Адрес не найден')
+    if method == 'GET':
+        return 200, await backend.read(manager_class, get_item, key)
+    if method in ('PATCH', 'PUT'):
+        data = parse_body(body)
+        fields = read_fields(section, data, partial=True)
+        return 200, await backend.write(manager_class, update_item, key, fields, body_version(data))
+    if method == 'DELETE':
+        version = query_int(query, 'version', 0) if 'version' in query else None
+        return 200, await backend.write(manager_class, delete_item, key, version)
+    raise HttpError(405, 'Метод не поддерживается')
+
+
+def render(status, payload):
+    if isinstance(payload, str):
+        return status, payload.encode('utf-8'), 'text/csv; charset=utf-8'
+    return status, json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8'
+
+async def respond(backend, method, target, body):
+    try:
+        return render(*await dispatch(backend, method, target, body))
+    except HttpError as e:
+        return render(e.status, {'error': str(e)})
+    except Exception as e:
+        return render(500, {'error': f'Внутренняя ошибка: {e}'})
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, version = request_line.decode('latin-1').split()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    # Без правильной длины не понять, где кончается тело: такой запрос — 400 с закрытием соединения
+    length = headers.get('content-length') or '0'
+    if not (length.isascii() and length.isdigit()):
+        raise HttpError(400, f'Некорректный Content-Length: {length}')
+    return method.upper(), target, version, headers, int(length)
+
+async def handle_connection(backend, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ValueError:
+                request = None
+                status, payload, content_type = render(400, {'error': 'Некорректный запрос'})
+                keep_alive = False
+            except HttpError as e:
+                request = None
+                status, payload, content_type = render(e.status, {'error': str(e)})
+                keep_alive = False
+            else:
+                if request is None:
+                    break
+                method, target, version, headers, length = request
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+                if length > MAX_BODY_SIZE:
+                    status, payload, content_type = render(413, {'error': 'Слишком большое тело запроса'})
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload, content_type = await respond(backend, method, target, body)
+            head = (f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Length: {len(payload)}\r\n'
+                    f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+            writer.write(head.encode('latin-1') + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, ready=None):
+    backend = Backend()
+    server = await asyncio.start_server(lambda reader, writer: handle_connection(backend, reader, writer),
+                                        host, port, backlog=1024)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    address = server.sockets[0].getsockname()
+    print(f'Сервер запущен на http://{address[0]}:{address[1]}', flush=True)
+    if ready is not None:
+        ready(address)
+    async with server:
+        await stop.wait()
+    # Дожидаемся записей, уже переданных рабочему потоку
+    backend.close()
+    print('Сервер остановлен')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTTP/JSON-сервис Персонального помощника')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
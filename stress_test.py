@@ -0,0 +1,115 @@
+import os
+import sys
+import argparse
+import tempfile
+import multiprocessing
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Нагрузочная проверка одновременной записи '
+                                     'из нескольких процессов: ни одно изменение не должно потеряться.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=200, help='операций каждого вида на процесс')
+    parser.add_argument('--storage', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--compact-threshold', type=int, default=50,
+                        help='порог сжатия журнала; маленький, чтобы сжатие шло параллельно с записью')
+    parser.add_argument('--dir', help='рабочий каталог (по умолчанию временный)')
+    return parser.parse_args()
+
+
+def worker(number, operations, results):
+    import personal_assistant as pa
+    # Вывод менеджеров в нагрузочном тесте не нужен
+    sys.stdout = open(os.devnull, 'w')
+    tasks = pa.TaskManager()
+    notes = pa.NoteManager()
+    finance = pa.FinanceManager()
+    conflicts = 0
+    for i in range(operations):
+        tasks.add_task(f'{number}:{i}', 'нагрузка', 'Средний', '01-01-2030')
+        finance.add_record(1.0, f'процесс {number}', '15-06-2026', str(i))
+        # Счётчик в общей заметке: классическое чтение-изменение-запись, конфликт — повтор
+        while True:
+            counter = notes.get_note_by_id(1)
+            try:
+                notes.change_item(counter, content=str(int(counter.content) + 1))
+                break
+            except pa.ConflictError:
+                conflicts += 1
+        # Одно поле общей записи: изменения после чтения другим процессом дают конфликт и повтор
+        shared = tasks.get_task_by_id(1)
+        while True:
+            try:
+                tasks.change_item(shared, description=f'{number}:{i}')
+                break
+            except pa.ConflictError:
+                conflicts += 1
+                shared = tasks.get_task_by_id(1)
+    results.put(conflicts)
+
+
+def main():
+    args = parse_args()
+    os.environ['PA_STORAGE'] = args.storage
+    directory = args.dir or tempfile.mkdtemp(prefix='pa-stress-')
+    os.chdir(directory)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import personal_assistant as pa
+    pa.JOURNAL_COMPACT_THRESHOLD = args.compact_threshold
+
+    # Начальные данные создаются в отдельном процессе, чтобы родитель не держал открытых хранилищ
+    def prepare():
+        sys.stdout = open(os.devnull, 'w')
+        pa.NoteManager().add_note('счётчик', '0')
+        pa.TaskManager().add_task('общая задача', '', 'Средний', '01-01-2030')
+
+    context = multiprocessing.get_context('fork')
+    process = context.Process(target=prepare)
+    process.start()
+    process.join()
+
+    results = context.Queue()
+    workers = [context.Process(target=worker, args=(number, args.operations, results))
+               for number in range(args.workers)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    if any(process.exitcode for process in workers):
+        print('Один из процессов завершился с ошибкой')
+        return 1
+    conflicts = sum(results.get() for _ in workers)
+
+    expected = args.workers * args.operations
+    tasks = pa.TaskManager()
+    notes = pa.NoteManager()
+    finance = pa.FinanceManager()
+    titles = [task.title for task in tasks.iter_items()]
+    errors = []
+    if len(titles) != expected + 1 or len(set(titles)) != len(titles):
+        errors.append(f'задач {len(titles)}, уникальных {len(set(titles))}, ожидалось {expected + 1}')
+    counter = int(notes.get_note_by_id(1).content)
+    if counter != expected:
+        errors.append(f'счётчик {counter}, ожидалось {expected}')
+    shared = tasks.get_task_by_id(1)
+    if shared.title != 'общая задача' or shared.version != expected:
+        errors.append(f'общая задача: {shared.title!r}, версия {shared.version}, ожидалась {expected}')
+    totals = finance.range_totals(pa.parse_date('01-01-2026'), pa.parse_date('31-12-2026'))
+    if totals['count'] != expected or totals['income'] != expected:
+        errors.append(f'финансы: {totals}, ожидалось {expected} записей')
+    if finance.count_items() != expected:
+        errors.append(f'финансовых записей {finance.count_items()}, ожидалось {expected}')
+
+    print(f'Хранилище: {args.storage}, процессов: {args.workers}, операций на процесс: {args.operations}')
+    print(f'Каталог: {directory}')
+    print(f'Конфликтов (повторено): {conflicts}')
+    if errors:
+        for error in errors:
+            print(f'ОШИБКА: {error}')
+        return 1
+    print('Потерянных изменений нет')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import personal_assistant as pa
+
+
+def close_databases():
+    for database in pa.SqliteDatabase.opened.values():
+        database.conn.close()
+    pa.SqliteDatabase.opened.clear()
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(pa, 'STORAGE_BACKEND', request.param)
+    return request.param
+
+
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    # Хранилища пишут файлы в текущий каталог: каждый тест в своём временном
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pa, 'STORAGE_BACKEND', 'json')
+    pa.SESSION.clear()
+    close_databases()
+    yield tmp_path
+    pa.SESSION.clear()
+    close_databases()
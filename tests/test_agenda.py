@@ -0,0 +1,38 @@
+import datetime
+
+import personal_assistant as pa
+
+
+def test_extreme_dates_keep_order():
+    manager = pa.TaskManager()
+    manager.items
+    manager.add_task('Последняя', '', 'Низкий', '31-12-9999')
+    manager.add_task('Первая', '', 'Высокий', '01-01-0001')
+    manager.add_task('Сегодня', '', 'Средний', datetime.date.today().strftime('%d-%m-%Y'))
+
+    upcoming = manager.upcoming_tasks(today=datetime.date(2000, 1, 1))
+    assert [task.title for task in upcoming] == ['Сегодня', 'Последняя']
+    assert [task.title for task in manager.overdue_tasks(today=datetime.date.max)] == ['Первая', 'Сегодня']
+    assert [task.title for task in manager.tasks_due_between(datetime.date.min, datetime.date.max)] == \
+        ['Первая', 'Сегодня', 'Последняя']
+    assert manager.upcoming_tasks(today=datetime.date.max)[0].title == 'Последняя'
+
+
+def test_wide_ids_do_not_collide_with_rank():
+    tasks = [
+        pa.Task(2 ** 45, 'Большой', '', priority='Низкий', due_date='01-01-2030'),
+        pa.Task(1, 'Маленький', '', priority='Высокий', due_date='01-01-2030'),
+    ]
+    agenda = pa.TaskAgenda.build(tasks)
+    assert agenda.between(datetime.date(2030, 1, 1).toordinal(), datetime.date(2030, 1, 1).toordinal()) == [1, 2 ** 45]
+
+    agenda.add(pa.Task(2 ** 70, 'Огромный', '', priority='Средний', due_date='31-12-2029'))
+    assert agenda.before(datetime.date(2031, 1, 1).toordinal()) == [2 ** 70, 1, 2 ** 45]
+    agenda.remove(2 ** 45)
+    assert agenda.upcoming(datetime.date(2030, 1, 1).toordinal(), 10) == [1]
+
+
+def test_narrow_agenda_stays_int64():
+    agenda = pa.TaskAgenda.build([pa.Task(2 ** 39 - 1, 'Край', '', due_date='31-12-9999')])
+    assert agenda.keys.typecode == 'q'
+    assert agenda.before(datetime.date.max.toordinal() + 1) == [2 ** 39 - 1]
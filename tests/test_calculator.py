@@ -0,0 +1,58 @@
+import pytest
+
+import personal_assistant as pa
+
+
+def run_menu(monkeypatch, capsys, lines):
+    answers = iter(lines + ['выход'])
+    monkeypatch.setattr('builtins.input', lambda prompt='': next(answers))
+    pa.calculator_menu()
+    return capsys.readouterr().out
+
+
+@pytest.mark.parametrize('expression, result', [
+    ('2 ** 10', 1024),
+    ('7 % 3', 1),
+    ('10 ** 4000 > 0', True),
+    ('1e308 * 10', float('inf')),
+])
+def test_calculates_within_limits(expression, result):
+    assert pa.calculate(expression, {}) == result
+
+
+@pytest.mark.parametrize('expression', [
+    '9 ** 9999',
+    '(9 ** 999) ** 999',
+    '"x" * 10 ** 9',
+    '"%0999999999d" % 1',
+    '2 ** 10 ** 6',
+    '1 / 0',
+])
+def test_rejects_results_beyond_limits(expression):
+    with pytest.raises((pa.ExpressionError, ArithmeticError, TypeError, ValueError)):
+        pa.calculate(expression, {})
+
+
+def test_menu_survives_errors_and_keeps_variables(monkeypatch, capsys):
+    output = run_menu(monkeypatch, capsys, ['9 ** 9999', 'x = 2 + 3', '"x" * 10 ** 9', 'x * 2', '1 / 0'])
+    lines = [line for line in output.splitlines() if line.startswith(('Результат', 'Ошибка'))]
+    assert [line.split(':')[0] for line in lines] == ['Ошибка', 'Результат', 'Ошибка', 'Результат', 'Ошибка']
+    assert lines[3] == 'Результат: 10'
+
+
+@pytest.mark.parametrize('vector', [False, True])
+def test_power_cap_holds_in_finance_expressions(vector, monkeypatch):
+    # В векторном режиме степень над массивом считает numpy, но целые подвыражения
+    # вроде 9 ** 9 ** 9 проходят ту же проверку размера
+    if vector:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(pa, 'numpy', None)
+    manager = pa.FinanceManager()
+    manager.add_record(-150, 'food', '01-03-2024', '')
+    manager.add_record(1000, 'salary', '05-03-2024', '')
+    assert list(manager.evaluate('amount ** 2 where category == "food"')) == [22500.0]
+    with pytest.raises(pa.ExpressionError):
+        manager.evaluate('amount + 9 ** 9 ** 9 where category == "food"')
+    with pytest.raises(pa.ExpressionError):
+        pa.calculate('amount + 9 ** 9 ** 9 where category == "food"', {})
@@ -0,0 +1,70 @@
+import json
+
+import personal_assistant as pa
+
+
+def read_jsonl(file_name):
+    with open(file_name, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_changes_since(backend):
+    manager = pa.NoteManager()
+    first = manager.add_note('Первая', '')
+    second = manager.add_note('Вторая', '')
+    seq = manager.change_seq()
+    manager.change_item(first, content='правка')
+    manager.add_note('Третья', '')
+    manager.remove_item(second)
+    events = manager.changes_since(seq)
+    assert [(op, key) for _, op, key in events] == [('updated', 1), ('created', 3), ('deleted', 2)]
+    assert [event_seq for event_seq, _, _ in events] == sorted(event_seq for event_seq, _, _ in events)
+    assert all(event_seq > seq for event_seq, _, _ in events)
+    assert manager.changes_since(manager.change_seq()) == []
+
+
+def test_export_since_writes_delta(backend):
+    manager = pa.NoteManager()
+    first = manager.add_note('Первая', '')
+    second = manager.add_note('Вторая', '')
+    manager.add_note('Без изменений', '')
+    response = pa.main(['--json', 'notes', 'export', 'full.jsonl'])
+    assert response == 0
+    seq = manager.change_seq()
+    manager.change_item(first, content='правка')
+    manager.change_item(first, title='Первая!')
+    manager.remove_item(second)
+
+    assert pa.main(['notes', 'export', 'delta.jsonl', '--since', str(seq)]) == 0
+    rows = read_jsonl('delta.jsonl')
+    assert [(row['change'], row['id']) for row in rows] == [('updated', 1), ('deleted', 2)]
+    assert (rows[0]['title'], rows[0]['content']) == ('Первая!', 'правка')
+    assert rows[1] == {'change': 'deleted', 'seq': rows[1]['seq'], 'id': 2}
+
+    # Следующая разностная выгрузка начинается с номера из этой и пуста
+    count, next_seq = manager.export_changes('next.jsonl', seq)
+    assert count == 2
+    assert manager.export_changes('empty.jsonl', next_seq) == (0, next_seq)
+
+
+def test_export_since_survives_compaction(monkeypatch):
+    monkeypatch.setattr(pa, 'JOURNAL_COMPACT_THRESHOLD', 3)
+    manager = pa.TaskManager()
+    task = manager.add_task('Задача', '', 'Средний', '')
+    seq = manager.change_seq()
+    for number in range(6):
+        manager.change_item(task, description=f'шаг {number}')
+    count, _ = manager.export_changes('delta.jsonl', seq)
+    assert count == 1
+    assert read_jsonl('delta.jsonl')[0]['description'] == 'шаг 5'
+
+
+def test_trimmed_log_requires_full_export(monkeypatch, capsys):
+    monkeypatch.setattr(pa, 'JOURNAL_COMPACT_THRESHOLD', 2)
+    monkeypatch.setattr(pa, 'CHANGES_KEEP', 2)
+    manager = pa.TaskManager()
+    for number in range(12):
+        manager.add_task(f'Задача {number}', '', 'Средний', '')
+    assert manager.changes_since(0) is None
+    assert pa.main(['tasks', 'export', 'delta.jsonl', '--since', '0']) == 1
+    assert 'нужна полная выгрузка' in capsys.readouterr().out
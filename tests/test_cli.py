@@ -0,0 +1,24 @@
+import pytest
+
+import personal_assistant as pa
+
+
+def test_write_behind_flag_keeps_following_command():
+    args = pa.build_parser().parse_args(['--write-behind', 'tasks', 'add', '--title', 'x'])
+    assert args.write_behind is True
+    assert args.write_behind_interval is None
+    assert (args.section, args.action, args.title) == ('tasks', 'add', 'x')
+
+
+def test_write_behind_interval():
+    args = pa.build_parser().parse_args(['--write-behind-interval', '0.2:3', 'notes', 'list'])
+    assert args.write_behind_interval == (0.2, 3.0)
+    args = pa.build_parser().parse_args(['--write-behind-interval', '10', 'notes', 'list'])
+    assert args.write_behind_interval == (10.0, 10.0)
+
+
+@pytest.mark.parametrize('value', ['abc', '-1', '1:-2'])
+def test_write_behind_interval_rejects_garbage(value, capsys):
+    with pytest.raises(SystemExit):
+        pa.build_parser().parse_args(['--write-behind-interval', value, 'notes', 'list'])
+    assert '--write-behind-interval' in capsys.readouterr().err
@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+import personal_assistant as pa
+from conftest import close_databases
+
+
+def add_people(manager):
+    manager.add_contact('Иван', '+7 (916) 123-45-67', 'ivan@example.com')
+    manager.add_contact('Пётр', '8 916 765 43 21', 'petr@example.com')
+    manager.add_contact('Анна', '+44 20 7946 0000', None)
+
+
+def searched(manager, query):
+    return [contact.name for contact in manager.find_contacts(query)]
+
+
+@pytest.mark.parametrize('query', ['+7916', '8916', '916', '7 (916)'])
+def test_phone_search_matches_any_notation(backend, query):
+    add_people(pa.ContactManager())
+    pa.SESSION.clear()
+    manager = pa.ContactManager()
+    assert searched(manager, query) == ['Иван', 'Пётр']
+    manager.items
+    assert searched(manager, query) == ['Иван', 'Пётр']
+
+
+def test_phone_search_other_country(backend):
+    manager = pa.ContactManager()
+    add_people(manager)
+    assert searched(pa.ContactManager(), '+4420') == ['Анна']
+    assert searched(pa.ContactManager(), 'Анн') == ['Анна']
+
+
+def test_phone_digits_column_added_to_existing_table(monkeypatch):
+    monkeypatch.setattr(pa, 'STORAGE_BACKEND', 'sqlite')
+    add_people(pa.ContactManager())
+    close_databases()
+    conn = sqlite3.connect(pa.SQLITE_FILE)
+    conn.execute('DROP INDEX contacts_phone_digits')
+    conn.execute('ALTER TABLE contacts DROP COLUMN phone_digits')
+    conn.commit()
+    conn.close()
+    assert searched(pa.ContactManager(), '8 916') == ['Иван', 'Пётр']
+
+
+@pytest.mark.parametrize('query, names', [('mail.ru', ['Иван', 'Сергей']), ('IVAN@', ['Иван']),
+                                          ('ПОЧТА.РФ', ['Олег'])])
+def test_email_substring_search(backend, query, names):
+    manager = pa.ContactManager()
+    manager.add_contact('Иван', None, 'ivan@mail.ru')
+    manager.add_contact('Олег', None, 'Oleg@Почта.рф')
+    manager.add_contact('Мария', None, 'maria@example.com')
+    manager.add_contact('Сергей', None, 'sergey@bk.mail.ru')
+    pa.SESSION.clear()
+    manager = pa.ContactManager()
+    assert sorted(searched(manager, query)) == names
+    manager.items
+    assert sorted(searched(manager, query)) == names
+
+
+def test_email_key_column_added_to_existing_table(monkeypatch):
+    monkeypatch.setattr(pa, 'STORAGE_BACKEND', 'sqlite')
+    add_people(pa.ContactManager())
+    close_databases()
+    conn = sqlite3.connect(pa.SQLITE_FILE)
+    conn.execute('DROP INDEX contacts_email_key')
+    conn.execute('ALTER TABLE contacts DROP COLUMN email_key')
+    conn.commit()
+    conn.close()
+    assert searched(pa.ContactManager(), 'PETR@EXAMPLE') == ['Пётр']
+
+
+def write_contacts_csv(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('Имя,Телефон,E-mail\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+
+@pytest.mark.parametrize('mode', ['skip', 'upsert'])
+def test_reimport_does_not_duplicate(backend, mode):
+    rows = [('Иван', '+7 916 123-45-67', ''), ('Пётр', '', 'PETR@example.com'), ('Бабушка', '', '')]
+    write_contacts_csv('contacts.csv', rows)
+    manager = pa.ContactManager()
+    manager.import_contacts_from_csv('contacts.csv', mode=mode, progress=None)
+    write_contacts_csv('again.csv', [('Иван Иванов', '8 (916) 123 45 67', ''), ('Пётр', '', 'petr@example.com'),
+                                     ('  бабушка ', '', '')])
+    manager.import_contacts_from_csv('again.csv', mode=mode, progress=None)
+    names = sorted(contact.name for contact in manager.iter_items())
+    if mode == 'upsert':
+        assert names == ['  бабушка ', 'Иван Иванов', 'Пётр']
+    else:
+        assert names == ['Бабушка', 'Иван', 'Пётр']
+
+
+def test_append_mode_keeps_duplicates():
+    write_contacts_csv('contacts.csv', [('Бабушка', '', '')])
+    manager = pa.ContactManager()
+    manager.import_contacts_from_csv('contacts.csv', progress=None)
+    manager.import_contacts_from_csv('contacts.csv', progress=None)
+    assert manager.count_items() == 2
@@ -0,0 +1,43 @@
+import datetime
+
+import personal_assistant as pa
+
+
+def test_report_totals_are_float_on_both_backends(backend, capsys):
+    manager = pa.FinanceManager()
+    manager.add_record(100, 'Зарплата', '05-03-2024', '')
+    pa.SESSION.clear()
+    manager = pa.FinanceManager()
+    totals = manager.generate_report('01-03-2024', '31-03-2024')
+    assert (totals['income'], totals['expenses'], totals['balance'], totals['count']) == (100.0, 0.0, 100.0, 1)
+    assert all(type(totals[name]) is float for name in ('income', 'expenses', 'balance'))
+    output = capsys.readouterr().out
+    assert '- Общие расходы: 0.0\n' in output
+    assert '- Общий доход: 100.0\n' in output
+
+    empty = manager.range_totals(datetime.date(2000, 1, 1), datetime.date(2000, 1, 31))
+    assert (empty['income'], empty['expenses'], empty['count']) == (0.0, 0.0, 0)
+    assert type(empty['income']) is float
+
+
+def write_statement(file_name, rows):
+    with open(file_name, 'w', encoding='utf-8', newline='') as f:
+        f.write('Сумма,Категория,Дата,Описание\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+
+
+def test_statement_reimport_keeps_repeated_purchases(backend):
+    # Две одинаковые покупки в выписке — две записи; повторный импорт той же выписки ничего не добавляет
+    rows = [('-150', 'еда', '01-03-2024', 'Обед'), ('-150', 'еда', '01-03-2024', 'Обед'),
+            ('1000', 'зарплата', '05-03-2024', 'Аванс')]
+    write_statement('march.csv', rows)
+    manager = pa.FinanceManager()
+    manager.import_records_from_csv('march.csv', mode='skip', progress=None)
+    manager.import_records_from_csv('march.csv', mode='skip', progress=None)
+    assert manager.count_items() == 3
+
+    write_statement('more.csv', rows + [('-150', 'кафе', '01-03-2024', '  обед ')])
+    manager.import_records_from_csv('more.csv', mode='upsert', progress=None)
+    records = sorted((record.amount, record.category) for record in manager.iter_items())
+    assert records == [(-150.0, 'еда'), (-150.0, 'еда'), (-150.0, 'кафе'), (1000.0, 'зарплата')]
@@ -0,0 +1,63 @@
+import os
+
+import personal_assistant as pa
+
+
+def reopened_tasks():
+    pa.SESSION.clear()
+    return pa.TaskManager()
+
+
+def task_state(manager):
+    return [(task.id, task.title, task.done, task.version) for task in manager.iter_items()]
+
+
+def test_journal_replays_changes_over_snapshot():
+    manager = pa.TaskManager()
+    first = manager.add_task('Первая', '', 'Высокий', '01-01-2030')
+    second = manager.add_task('Вторая', '', 'Низкий', '')
+    manager.add_task('Третья', '', 'Средний', '')
+    manager.mark_task_done(first.id)
+    manager.remove_item(second)
+    assert os.path.getsize(pa.TASKS_FILE + pa.JOURNAL_SUFFIX) > 0
+    assert task_state(reopened_tasks()) == [(1, 'Первая', True, 1), (3, 'Третья', False, 0)]
+
+
+def test_torn_journal_tail_is_dropped():
+    manager = pa.TaskManager()
+    manager.add_task('Целая', '', 'Высокий', '')
+    journal = pa.TASKS_FILE + pa.JOURNAL_SUFFIX
+    size = os.path.getsize(journal)
+    with open(journal, 'ab') as f:
+        f.write('{"seq": 2, "op": "put", "row": [2, "Оборв'.encode('utf-8'))
+    manager = reopened_tasks()
+    assert task_state(manager) == [(1, 'Целая', False, 0)]
+    assert os.path.getsize(journal) == size
+    manager.add_task('Следующая', '', 'Низкий', '')
+    assert [task.title for task in reopened_tasks().iter_items()] == ['Целая', 'Следующая']
+
+
+def test_compaction_folds_journal_into_snapshot(monkeypatch):
+    monkeypatch.setattr(pa, 'JOURNAL_COMPACT_THRESHOLD', 5)
+    manager = pa.TaskManager()
+    for number in range(12):
+        manager.add_task(f'Задача {number}', '', 'Средний', '')
+    journal = pa.TASKS_FILE + pa.JOURNAL_SUFFIX
+    assert manager.store.journal_ops < 5
+    assert not os.path.exists(journal) or os.path.getsize(journal) < 5 * 200
+    assert [task.title for task in reopened_tasks().iter_items()] == [f'Задача {number}' for number in range(12)]
+    # События сжатого журнала остаются в логе изменений, номера идут без пропусков
+    events = reopened_tasks().changes_since(0)
+    assert [seq for seq, _, _ in events] == list(range(1, 13))
+    assert {op for _, op, _ in events} == {'created'}
+
+
+def test_binary_snapshot_replays_journal():
+    manager = pa.NoteManager()
+    manager.add_note('Первая', 'текст')
+    manager.save_items()
+    note = manager.add_note('Вторая', 'после снимка')
+    manager.change_item(note, content='исправлено')
+    pa.SESSION.clear()
+    notes = [(note.id, note.content) for note in pa.NoteManager().iter_items()]
+    assert notes == [(1, 'текст'), (2, 'исправлено')]
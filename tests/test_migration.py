@@ -0,0 +1,78 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import personal_assistant as pa
+
+OPEN_TASKS = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import personal_assistant as pa
+print(pa.TaskManager().count_items())
+'''
+
+LEGACY_NOTES = [
+    {'note_id': 1, 'title': 'Первая', 'content': 'текст', 'timestamp': '01-01-2024 10:00:00'},
+    {'note_id': 1, 'title': 'Дубль ID', 'content': 'ещё', 'timestamp': '02-01-2024 10:00:00'},
+    {'note_id': 5, 'title': 'Пятая', 'content': '', 'timestamp': '03-01-2024 10:00:00'},
+]
+LEGACY_TASKS = [
+    {'task_id': 1, 'title': 'Задача', 'description': '', 'done': True, 'priority': 'Высокий', 'due_date': '01-02-2024'},
+]
+
+
+def write_legacy(file_name, records):
+    with open(file_name, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False)
+
+
+def test_legacy_notes_move_to_binary_snapshot_with_backup():
+    write_legacy(pa.NOTES_FILE, LEGACY_NOTES)
+    manager = pa.NoteManager()
+    notes = [(note.id, note.title) for note in manager.iter_items()]
+    # Повторяющийся ID получает новый номер
+    assert notes == [(1, 'Первая'), (5, 'Пятая'), (6, 'Дубль ID')]
+    assert os.path.exists('notes.snap')
+    assert not os.path.exists(pa.NOTES_FILE)
+    with open(pa.NOTES_FILE + pa.BACKUP_SUFFIX, encoding='utf-8') as f:
+        assert json.load(f) == LEGACY_NOTES
+
+    pa.SESSION.clear()
+    assert [note.id for note in pa.NoteManager().iter_items()] == [1, 5, 6]
+
+
+def test_legacy_tasks_rewritten_as_rows():
+    write_legacy(pa.TASKS_FILE, LEGACY_TASKS)
+    task = pa.TaskManager().get_task_by_id(1)
+    assert (task.title, task.done, task.priority, task.due_date) == ('Задача', True, 'Высокий', '01-02-2024')
+    with open(pa.TASKS_FILE, encoding='utf-8') as f:
+        data = json.load(f)
+    assert data['fields'] == list(pa.Task.fields)
+
+
+def test_legacy_json_moves_to_sqlite(monkeypatch):
+    monkeypatch.setattr(pa, 'STORAGE_BACKEND', 'sqlite')
+    write_legacy(pa.TASKS_FILE, LEGACY_TASKS)
+    assert [task.title for task in pa.TaskManager().iter_items()] == ['Задача']
+    pa.SESSION.clear()
+    assert pa.TaskManager().count_items() == 1
+
+
+def test_concurrent_first_open_migrates_once(tmp_path):
+    # Несколько процессов одновременно открывают базу рядом со старым JSON: перенос идёт
+    # под BEGIN IMMEDIATE, и каждый видит все записи ровно один раз
+    write_legacy(pa.TASKS_FILE, [dict(LEGACY_TASKS[0], task_id=number, title=f'Задача {number}')
+                                 for number in range(1, 201)])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PA_STORAGE='sqlite')
+    processes = [subprocess.Popen([sys.executable, '-c', OPEN_TASKS, root], cwd=tmp_path, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True) for _ in range(6)]
+    outputs = [process.communicate(timeout=60) for process in processes]
+    assert [process.returncode for process in processes] == [0] * 6, [error for _, error in outputs]
+    assert [output.strip() for output, _ in outputs] == ['200'] * 6
+    conn = sqlite3.connect(pa.SQLITE_FILE)
+    assert conn.execute('SELECT COUNT(*) FROM tasks').fetchone() == (200,)
+    assert conn.execute("SELECT COUNT(*) FROM migrations WHERE name = 'tasks'").fetchone() == (1,)
+    conn.close()
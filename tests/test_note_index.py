@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+import personal_assistant as pa
+
+WORDS = ['встреча', 'отчёт', 'проект', 'срочно', 'позвонить', 'сервер', 'серверная', 'python', 'docker',
+         'москва', 'оплатить', 'счёт', 'список', 'покупок', 'ремонт']
+QUERIES = ['встреча', 'отчёт проект', '"срочно позвонить"', 'серв*', 'python docker', 'москва', 'нет такого']
+
+
+def random_notes(count, seed=1):
+    rng = random.Random(seed)
+    return [(note_id, ' '.join(rng.choices(WORDS, k=2)), ' '.join(rng.choices(WORDS, k=rng.randint(3, 12))))
+            for note_id in range(1, count + 1)]
+
+
+def built(notes):
+    index = pa.NoteIndex()
+    for note in notes:
+        index.add(*note)
+    return index
+
+
+def results(index):
+    return {query: [(note_id, round(score, 9)) for note_id, score in index.search(query, 20)] for query in QUERIES}
+
+
+def reopened(index, tmp_path):
+    pa.write_index(str(tmp_path / 'notes.idx'), [1, 2], index)
+    return pa.NoteIndex(pa.IndexFile.open(str(tmp_path / 'notes.idx'), [1, 2]))
+
+
+def test_saved_index_searches_like_built(tmp_path):
+    index = built(random_notes(200))
+    assert results(reopened(index, tmp_path)) == results(index)
+
+
+@pytest.mark.parametrize('search_first', [False, True])
+def test_changes_over_saved_index(tmp_path, search_first):
+    notes = random_notes(200)
+    loaded = reopened(built(notes), tmp_path)
+    if search_first:
+        results(loaded)
+    # Удаление, правка, новая заметка и повторная правка той же заметки
+    changed = {note_id: (note_id, title, content) for note_id, title, content in notes}
+    for note_id in (3, 50, 120):
+        loaded.remove(note_id)
+        del changed[note_id]
+    for note in [(7, 'встреча новая', 'совсем новые слова'), (201, 'python', 'срочно позвонить'),
+                 (7, 'москва', 'ремонт')]:
+        loaded.add(*note)
+        changed[note[0]] = note
+    expected = built(sorted(changed.values()))
+    assert results(loaded) == results(expected)
+    assert loaded.doc_count == expected.doc_count
+    assert loaded.total_length == expected.total_length
+    again = reopened(loaded, tmp_path)
+    assert results(again) == results(expected)
+    assert again.all_terms() == expected.all_terms()
+
+
+def test_stale_or_foreign_index_is_ignored(tmp_path):
+    path = str(tmp_path / 'notes.idx')
+    pa.write_index(path, [1, 2], built(random_notes(5)))
+    assert pa.IndexFile.open(path, [1, 3]) is None
+    with open(path, 'w') as f:
+        f.write('{"stamp": [1, 2], "payload": {}}')
+    assert pa.IndexFile.open(path, [1, 2]) is None
+
+
+def test_manager_reads_index_from_disk():
+    manager = pa.NoteManager()
+    manager.add_note('Встреча', 'обсудить отчёт по проекту')
+    manager.add_note('Покупки', 'молоко хлеб')
+    manager.save_items()
+    # Первый поиск строит индекс и сохраняет его рядом со снимком
+    manager.find_notes('отчёт')
+    pa.SESSION.clear()
+    manager = pa.NoteManager()
+    assert isinstance(manager.search_index().source, pa.IndexFile)
+    assert [note.title for note, _ in manager.find_notes('отчёт')] == ['Встреча']
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+
+async def exchange(raw):
+    backend = server.Backend()
+    listener = await asyncio.start_server(lambda reader, writer: server.handle_connection(backend, reader, writer),
+                                          '127.0.0.1', 0)
+    port = listener.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    listener.close()
+    await listener.wait_closed()
+    backend.executor.shutdown()
+    return response
+
+
+def request(raw):
+    head, _, body = asyncio.run(exchange(raw)).partition(b'\r\n\r\n')
+    return head.split(b'\r\n'), json.loads(body)
+
+
+@pytest.mark.parametrize('length', ['abc', '-5', '1.5', '１２'])
+def test_bad_content_length_is_rejected(length):
+    head, body = request(f'POST /notes HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}'.encode('utf-8'))
+    assert head[0] == b'HTTP/1.1 400 Bad Request'
+    assert b'Connection: close' in head
+    assert 'Content-Length' in body['error']
+
+
+def test_body_is_read_by_content_length():
+    payload = json.dumps({'title': 'Из сервера', 'content': ''}).encode('utf-8')
+    head, body = request(b'POST /notes HTTP/1.1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n' % len(payload)
+                         + payload)
+    assert head[0] == b'HTTP/1.1 201 Created'
+    assert body['title'] == 'Из сервера'
@@ -0,0 +1,17 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_concurrent_writers_lose_nothing(storage, tmp_path):
+    # Процессы одновременно открывают хранилище впервые (перенос схемы SQLite) и пишут в него
+    result = subprocess.run([sys.executable, os.path.join(ROOT, 'stress_test.py'), '--storage', storage,
+                             '--workers', '6', '--operations', '40', '--dir', str(tmp_path)],
+                            capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert 'Потерянных изменений нет' in result.stdout
@@ -0,0 +1,35 @@
+import datetime
+import os
+
+import personal_assistant as pa
+
+
+def day(text):
+    return pa.parse_ordinal(text)
+
+
+def test_typo_date_does_not_stretch_trees():
+    totals = pa.DailyTotals.build([day('01-03-2024'), day('05-03-2024')], [100.0, -40.0])
+    size = totals.size
+    totals.add(day('01-01-0001'), 7.0)
+    totals.add(day('31-12-9999'), -3.0)
+    assert totals.size == size
+    assert totals.between(day('01-01-0001'), day('31-12-9999')) == (107.0, -43.0, 4)
+    assert totals.between(day('01-01-0001'), day('01-01-0001')) == (7.0, 0.0, 1)
+    assert totals.between(day('01-03-2024'), day('31-03-2024')) == (100.0, -40.0, 2)
+
+    restored = pa.DailyTotals.from_json(totals.to_json())
+    assert restored.between(datetime.date.min.toordinal(), datetime.date.max.toordinal()) == (107.0, -43.0, 4)
+    totals.add(day('01-01-0001'), 7.0, -1)
+    assert list(totals.outliers) == [day('31-12-9999')]
+
+
+def test_typo_date_keeps_sidecar_small():
+    manager = pa.FinanceManager()
+    manager.add_record(100.0, 'Зарплата', '01-03-2024', '')
+    manager.add_record(5.0, 'Прочее', '01-01-0001', '')
+    report = manager.range_totals(datetime.date.min, datetime.date.max)
+    assert (report['income'], report['count']) == (105.0, 2)
+    assert manager.totals.size < 2 * pa.DAILY_TOTALS_MARGIN + 2
+    manager.save_totals()
+    assert os.path.getsize(manager.totals_path) < 100_000
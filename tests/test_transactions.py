@@ -0,0 +1,70 @@
+import pytest
+
+import personal_assistant as pa
+
+
+class Boom(Exception):
+    pass
+
+
+def titles(manager):
+    return sorted(note.title for note in manager.iter_items())
+
+
+def fresh_titles():
+    pa.SESSION.clear()
+    return titles(pa.NoteManager())
+
+
+def test_rollback_discards_block(backend):
+    manager = pa.NoteManager()
+    manager.add_note('Останется', '')
+    with pytest.raises(Boom):
+        with manager.transaction():
+            manager.add_note('Пропадёт', '')
+            raise Boom()
+    assert titles(manager) == ['Останется']
+    assert fresh_titles() == ['Останется']
+
+
+def test_nested_rollback_keeps_outer_writes(backend):
+    manager = pa.NoteManager()
+    with manager.transaction():
+        manager.add_note('Внешняя', '')
+        try:
+            with manager.transaction():
+                manager.add_note('Вложенная', '')
+                raise Boom()
+        except Boom:
+            pass
+        assert titles(manager) == ['Внешняя']
+        manager.add_note('После', '')
+    assert titles(manager) == ['Внешняя', 'После']
+    assert fresh_titles() == ['Внешняя', 'После']
+
+
+def test_nested_commit_undone_by_outer(backend):
+    manager = pa.NoteManager()
+    with pytest.raises(Boom):
+        with manager.transaction():
+            with manager.transaction():
+                manager.add_note('Вложенная', '')
+            raise Boom()
+    assert titles(manager) == []
+    assert fresh_titles() == []
+
+
+def test_nested_rollback_after_full_save_aborts_outer():
+    manager = pa.NoteManager()
+    manager.add_note('Была', '')
+    with pytest.raises(pa.ConflictError):
+        with manager.transaction():
+            manager.save_items()
+            try:
+                with manager.transaction():
+                    manager.add_note('Вложенная', '')
+                    raise Boom()
+            except Boom:
+                pass
+    assert titles(manager) == ['Была']
+    assert fresh_titles() == ['Была']